@@ -0,0 +1,540 @@
+"""
+Compiles JSON schemas to Python validation functions.
+
+A compiled function returns true when the data is valid and fills defaults
+from `properties` like the jsonschema based validator does. When the data
+is invalid, the jsonschema validator is run to produce the error, so error
+messages are the same with and without compilation.
+
+The generated modules are cached to a directory and reused as long as the
+schema and the documents it references have the same content.
+"""
+import logging
+import re
+from collections.abc import Mapping, Sequence
+from hashlib import sha1
+from importlib.util import module_from_spec, spec_from_file_location
+from json import dumps as to_json
+from math import isfinite
+from numbers import Number
+from os.path import isfile, join
+from threading import Lock
+from urllib.parse import urldefrag
+
+from jsonschema._utils import equal, unbool, uniq
+
+from .utils.files import atomic_write
+from .utils.translation import _
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = (
+    'CompiledValidator',
+    'validator_compiler',
+)
+
+# increase when the generated code changes
+COMPILER_VERSION = 1
+
+SUPPORTED_DRAFTS = ('/draft-06/', '/draft-07/')
+
+TYPE_CHECKS = {
+    'object': "isinstance({0}, Mapping)",
+    'array': "(isinstance({0}, Sequence) and not isinstance({0}, str))",
+    'string': "isinstance({0}, str)",
+    'integer': ("(isinstance({0}, int) and not isinstance({0}, bool)"
+        " or isinstance({0}, float) and {0}.is_integer())"),
+    'number': "(isinstance({0}, Number) and not isinstance({0}, bool))",
+    'boolean': "isinstance({0}, bool)",
+    'null': "{0} is None",
+}
+
+# keywords, which are used by other keywords or have no effect
+IGNORED_KEYWORDS = ('then', 'else', 'format')
+
+
+class Unsupported(Exception):
+    pass
+
+
+## Helpers used by the generated code
+
+def in_enum(instance, enums):
+    if instance == 0 or instance == 1:
+        unbooled = unbool(instance)
+        return any(unbooled == unbool(each) for each in enums)
+    return instance in enums
+
+
+def multiple_of(instance, dB):
+    if isinstance(dB, float):
+        quotient = instance / dB
+        return int(quotient) == quotient
+    return not instance % dB
+
+
+def always_valid(instance):
+    return True
+
+
+def never_valid(instance):
+    return False
+
+
+## Code generation
+
+def hash_schema(schema):
+    return sha1(to_json(schema, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def to_literal(value):
+    """Returns the source of a Python literal for a JSON value"""
+    if value is None or isinstance(value, bool):
+        return repr(value)
+    if isinstance(value, str):
+        return repr(str(value))
+    if isinstance(value, int):
+        return repr(int(value))
+    if isinstance(value, float):
+        if not isfinite(value):
+            raise Unsupported("non-finite number %r" % (value,))
+        return repr(float(value))
+    if isinstance(value, Mapping):
+        return '{%s}' % ', '.join('%s: %s' % (to_literal(k), to_literal(v))
+            for k, v in value.items())
+    if isinstance(value, Sequence):
+        return '[%s]' % ', '.join(to_literal(v) for v in value)
+    raise Unsupported("value of type %s" % (type(value).__name__,))
+
+
+def type_check(type_, var='x'):
+    if type_ not in TYPE_CHECKS:
+        raise Unsupported("type %r" % (type_,))
+    return TYPE_CHECKS[type_].format(var)
+
+
+class SourceGenerator:
+    """
+    Generates a module with a function per subschema.
+
+    Functions evaluate every keyword, even after the result is known, so
+    defaults are set in the same places as jsonschema does. Subschemas,
+    which jsonschema evaluates only partially (if, not, oneOf, contains and
+    propertyNames), must not contain defaults, else Unsupported is raised.
+    """
+    def __init__(self, resolver, validators):
+        self.resolver = resolver
+        self.validators = validators
+        self.constants = []
+        self.functions = []
+        self.documents = {}
+        self._refs = {}
+        self._count = 0
+
+    def generate(self, schema):
+        name = self.function(schema, True)
+        lines = [
+            "# generated by apluslms_yamlidator.compiler version %d" % (COMPILER_VERSION,),
+            "from apluslms_yamlidator.compiler import (",
+            "    Mapping, Number, Sequence, always_valid, equal, in_enum,",
+            "    multiple_of, never_valid, re, uniq)",
+            "",
+            "DOCUMENTS = %r" % (self.documents,),
+            "",
+        ]
+        lines.extend(self.constants)
+        lines.append('')
+        lines.extend(self.functions)
+        lines.append("validate = %s" % (name,))
+        return '\n'.join(lines) + '\n'
+
+    def new_name(self, prefix):
+        self._count += 1
+        return '_%s%d' % (prefix, self._count)
+
+    def constant(self, value):
+        name = self.new_name('c')
+        self.constants.append("%s = %s" % (name, to_literal(value)))
+        return name
+
+    def constant_set(self, values):
+        name = self.new_name('c')
+        self.constants.append("%s = frozenset(%s)" % (name, to_literal(values)))
+        return name
+
+    def pattern(self, pattern):
+        name = self.new_name('p')
+        self.constants.append("%s = re.compile(%s)" % (name, to_literal(pattern)))
+        return name
+
+    def function(self, schema, defaults, name=None):
+        """Returns the name of a function, which validates `schema`"""
+        if schema is True:
+            return 'always_valid'
+        if schema is False:
+            return 'never_valid'
+        if not isinstance(schema, Mapping):
+            raise Unsupported("schema of type %s" % (type(schema).__name__,))
+        if name is None:
+            name = self.new_name('v')
+        body = []
+        scope = schema.get('$id')
+        if isinstance(scope, str) and scope:
+            self.resolver.push_scope(scope)
+        try:
+            if '$ref' in schema:
+                body.extend(self.kw_ref(schema['$ref'], defaults))
+            else:
+                for key, value in schema.items():
+                    if key not in self.validators or key in IGNORED_KEYWORDS:
+                        continue
+                    method = getattr(self, 'kw_' + key, None)
+                    if method is None:
+                        raise Unsupported("keyword %r" % (key,))
+                    body.extend(method(value, schema, defaults))
+        finally:
+            if isinstance(scope, str) and scope:
+                self.resolver.pop_scope()
+        lines = ["def %s(x):" % (name,), "    ok = True"]
+        lines.extend("    " + line for line in body)
+        lines.extend(["    return ok", ""])
+        self.functions.append('\n'.join(lines))
+        return name
+
+    def check(self, condition, guard=None):
+        """Lines, which set ok to false when condition is true"""
+        if guard:
+            condition = "%s and %s" % (guard, condition)
+        return ["if %s:" % (condition,), "    ok = False"]
+
+    def descend(self, func, var='x'):
+        return "ok = %s(%s) and ok" % (func, var)
+
+    # keywords
+
+    def kw_ref(self, ref, defaults):
+        url, resolved = self.resolver.resolve(ref)
+        document = urldefrag(url)[0]
+        if document not in self.documents:
+            self.documents[document] = hash_schema(self.resolver.resolve_from_url(document))
+        key = (url, defaults)
+        name = self._refs.get(key)
+        if name is None:
+            name = self._refs[key] = self.new_name('r')
+            self.resolver.push_scope(url)
+            try:
+                self.function(resolved, defaults, name=name)
+            finally:
+                self.resolver.pop_scope()
+        return [self.descend(name)]
+
+    def kw_type(self, types, schema, defaults):
+        if isinstance(types, str):
+            types = [types]
+        return self.check("not (%s)" % (' or '.join(type_check(t) for t in types),))
+
+    def kw_enum(self, enums, schema, defaults):
+        return self.check("not in_enum(x, %s)" % (self.constant(enums),))
+
+    def kw_const(self, const, schema, defaults):
+        return self.check("not equal(x, %s)" % (self.constant(const),))
+
+    def kw_multipleOf(self, dB, schema, defaults):
+        return self.check("not multiple_of(x, %s)" % (to_literal(dB),), type_check('number'))
+
+    def kw_minimum(self, value, schema, defaults):
+        return self.check("x < %s" % (to_literal(value),), type_check('number'))
+
+    def kw_maximum(self, value, schema, defaults):
+        return self.check("x > %s" % (to_literal(value),), type_check('number'))
+
+    def kw_exclusiveMinimum(self, value, schema, defaults):
+        return self.check("x <= %s" % (to_literal(value),), type_check('number'))
+
+    def kw_exclusiveMaximum(self, value, schema, defaults):
+        return self.check("x >= %s" % (to_literal(value),), type_check('number'))
+
+    def kw_minLength(self, value, schema, defaults):
+        return self.check("len(x) < %d" % (value,), type_check('string'))
+
+    def kw_maxLength(self, value, schema, defaults):
+        return self.check("len(x) > %d" % (value,), type_check('string'))
+
+    def kw_pattern(self, pattern, schema, defaults):
+        return self.check("not %s.search(x)" % (self.pattern(pattern),), type_check('string'))
+
+    def kw_minItems(self, value, schema, defaults):
+        return self.check("len(x) < %d" % (value,), type_check('array'))
+
+    def kw_maxItems(self, value, schema, defaults):
+        return self.check("len(x) > %d" % (value,), type_check('array'))
+
+    def kw_uniqueItems(self, value, schema, defaults):
+        if not value:
+            return []
+        return self.check("not uniq(x)", type_check('array'))
+
+    def kw_items(self, items, schema, defaults):
+        lines = ["if %s:" % (type_check('array'),)]
+        if isinstance(items, Sequence) and not isinstance(items, str):
+            for index, subschema in enumerate(items):
+                func = self.function(subschema, defaults)
+                lines.append("    if len(x) > %d:" % (index,))
+                lines.append("        " + self.descend(func, 'x[%d]' % (index,)))
+            if len(lines) == 1:
+                return []
+        else:
+            func = self.function(items, defaults)
+            lines.append("    for item in x:")
+            lines.append("        " + self.descend(func, 'item'))
+        return lines
+
+    def kw_additionalItems(self, aI, schema, defaults):
+        items = schema.get('items', {})
+        if isinstance(items, Mapping):
+            return []
+        if not isinstance(items, Sequence) or isinstance(items, str):
+            raise Unsupported("additionalItems with items %r" % (items,))
+        if isinstance(aI, Mapping):
+            func = self.function(aI, defaults)
+            return [
+                "if %s:" % (type_check('array'),),
+                "    for item in x[%d:]:" % (len(items),),
+                "        " + self.descend(func, 'item'),
+            ]
+        if not aI:
+            return self.check("len(x) > %d" % (len(items),), type_check('array'))
+        return []
+
+    def kw_contains(self, contains, schema, defaults):
+        func = self.function(contains, False)
+        return self.check("not any(%s(item) for item in x)" % (func,), type_check('array'))
+
+    def kw_minProperties(self, value, schema, defaults):
+        return self.check("len(x) < %d" % (value,), type_check('object'))
+
+    def kw_maxProperties(self, value, schema, defaults):
+        return self.check("len(x) > %d" % (value,), type_check('object'))
+
+    def kw_required(self, required, schema, defaults):
+        if not required:
+            return []
+        return self.check("not all(p in x for p in %s)" % (self.constant(required),),
+            type_check('object'))
+
+    def kw_properties(self, properties, schema, defaults):
+        lines = []
+        for prop, subschema in properties.items():
+            if isinstance(subschema, Mapping) and 'default' in subschema:
+                if not defaults:
+                    raise Unsupported("default in a partially evaluated subschema")
+                lines.append("x.setdefault(%s, %s)" % (
+                    to_literal(prop), to_literal(subschema['default'])))
+        for prop, subschema in properties.items():
+            func = self.function(subschema, defaults)
+            lines.append("if %s in x:" % (to_literal(prop),))
+            lines.append("    " + self.descend(func, 'x[%s]' % (to_literal(prop),)))
+        if not lines:
+            return []
+        return ["if %s:" % (type_check('object'),)] + ["    " + line for line in lines]
+
+    def kw_patternProperties(self, patterns, schema, defaults):
+        lines = []
+        for pattern, subschema in patterns.items():
+            func = self.function(subschema, defaults)
+            lines.extend([
+                "    for key, value in x.items():",
+                "        if %s.search(key):" % (self.pattern(pattern),),
+                "            " + self.descend(func, 'value'),
+            ])
+        if not lines:
+            return []
+        return ["if %s:" % (type_check('object'),)] + lines
+
+    def kw_additionalProperties(self, aP, schema, defaults):
+        if aP is True:
+            return []
+        properties = self.constant_set(sorted(schema.get('properties', {})))
+        patterns = '|'.join(schema.get('patternProperties', {}))
+        extra = "key not in %s" % (properties,)
+        if patterns:
+            extra += " and not %s.search(key)" % (self.pattern(patterns),)
+        if isinstance(aP, Mapping):
+            action = self.descend(self.function(aP, defaults), 'x[key]')
+        elif not aP:
+            action = "ok = False"
+        else:
+            return []
+        return [
+            "if %s:" % (type_check('object'),),
+            "    for key in x:",
+            "        if %s:" % (extra,),
+            "            " + action,
+        ]
+
+    def kw_dependencies(self, dependencies, schema, defaults):
+        lines = []
+        for prop, dependency in dependencies.items():
+            if isinstance(dependency, Sequence) and not isinstance(dependency, str):
+                lines.extend([
+                    "    if %s in x and not all(p in x for p in %s):" % (
+                        to_literal(prop), self.constant(dependency)),
+                    "        ok = False",
+                ])
+            else:
+                func = self.function(dependency, defaults)
+                lines.extend([
+                    "    if %s in x:" % (to_literal(prop),),
+                    "        " + self.descend(func),
+                ])
+        if not lines:
+            return []
+        return ["if %s:" % (type_check('object'),)] + lines
+
+    def kw_propertyNames(self, names, schema, defaults):
+        func = self.function(names, False)
+        return [
+            "if %s:" % (type_check('object'),),
+            "    for key in x:",
+            "        " + self.descend(func, 'key'),
+        ]
+
+    def kw_if(self, if_schema, schema, defaults):
+        lines = ["if %s(x):" % (self.function(if_schema, False),)]
+        if 'then' in schema:
+            lines.append("    " + self.descend(self.function(schema['then'], defaults)))
+        else:
+            lines.append("    pass")
+        if 'else' in schema:
+            lines.append("else:")
+            lines.append("    " + self.descend(self.function(schema['else'], defaults)))
+        return lines
+
+    def kw_allOf(self, subschemas, schema, defaults):
+        return [self.descend(self.function(s, defaults)) for s in subschemas]
+
+    def kw_anyOf(self, subschemas, schema, defaults):
+        # like jsonschema, stops at the first valid subschema
+        funcs = [self.function(s, defaults) for s in subschemas]
+        return self.check("not (%s)" % (' or '.join('%s(x)' % f for f in funcs) or 'False',))
+
+    def kw_oneOf(self, subschemas, schema, defaults):
+        funcs = [self.function(s, False) for s in subschemas]
+        return self.check("(%s) != 1" % (' + '.join('%s(x)' % f for f in funcs) or '0',))
+
+    def kw_not(self, not_schema, schema, defaults):
+        return self.check("%s(x)" % (self.function(not_schema, False),))
+
+
+## Validators
+
+class CompiledValidator:
+    """
+    Wraps a jsonschema validator. Valid data is checked with the compiled
+    function and invalid data is validated again to raise the error.
+    """
+    def __init__(self, validator, function):
+        self._validator = validator
+        self._function = function
+
+    def __getattr__(self, name):
+        return getattr(self._validator, name)
+
+    def is_valid(self, instance, _schema=None):
+        if _schema is not None:
+            return self._validator.is_valid(instance, _schema)
+        return self._function(instance)
+
+    def validate(self, instance, *args, **kwargs):
+        if args or kwargs or not self._function(instance):
+            self._validator.validate(instance, *args, **kwargs)
+
+
+class ValidatorCompiler:
+    """
+    Compiles validators for the registered schema names. Generated modules
+    are written to the cache directory, if one is registered.
+    """
+    def __init__(self):
+        self.names = set()
+        self.cache_dir = None
+        self._lock = Lock()
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def register(self, names, cache_dir=None):
+        self.names.update(names)
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+
+    def compile(self, validator):
+        """
+        Returns CompiledValidator or the validator as is, if the schema
+        can't be compiled.
+        """
+        meta = validator.META_SCHEMA.get('$schema', '')
+        if not any(draft in meta for draft in SUPPORTED_DRAFTS):
+            logger.debug("Not compiling a validator for %s", meta)
+            return validator
+        schema = validator.schema
+        key = sha1(("%d:%s:%s" % (COMPILER_VERSION, meta, hash_schema(schema)))
+            .encode('utf-8')).hexdigest()
+        with self._lock:
+            try:
+                function = self._load(validator, key) or self._generate(validator, key)
+            except Unsupported as err:
+                logger.debug("Not compiling a validator for %s: %s",
+                    validator.ID_OF(schema), err)
+                return validator
+        return CompiledValidator(validator, function)
+
+    def _path(self, key):
+        return join(self.cache_dir, 'validator_%s.py' % (key,))
+
+    def _load(self, validator, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not isfile(path):
+            return None
+        try:
+            spec = spec_from_file_location('_yamlidator_validator_' + key, path)
+            module = module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception as err:
+            logger.warning(_("Failed to load a compiled validator %s: %s"), path, err)
+            return None
+        resolver = validator.resolver
+        for document, hash_ in module.DOCUMENTS.items():
+            if hash_schema(resolver.resolve_from_url(document)) != hash_:
+                logger.debug("Schema %s has changed, compiling %s again", document, path)
+                return None
+        return module.validate
+
+    def _generate(self, validator, key):
+        generator = SourceGenerator(validator.resolver, validator.VALIDATORS)
+        source = generator.generate(validator.schema)
+        logger.debug("Compiled a validator for %s", validator.ID_OF(validator.schema))
+        if self.cache_dir:
+            path = self._path(key)
+            if self._write(path, source):
+                function = self._load(validator, key)
+                if function is not None:
+                    return function
+        namespace = {}
+        exec(compile(source, '<validator %s>' % (key,), 'exec'), namespace)
+        return namespace['validate']
+
+    def _write(self, path, source):
+        try:
+            with atomic_write(path) as f:
+                f.write(source)
+        except OSError as err:
+            logger.warning(_("Failed to write a compiled validator %s: %s"), path, err)
+            return False
+        return True
+
+
+validator_compiler = ValidatorCompiler()
@@ -88,6 +88,24 @@ class Versioned:
                               for idx, (ver, data) in enumerate(self._documents)}
             logger.debug("Read %d documents from %s", len(self._documents), path)
 
+    @classmethod
+    def from_data(cls, path, documents, content_hash=b'', *, version_key=None):
+        """
+        Creates a container from already parsed documents without reading
+        the file. The documents don't have line and column information.
+        """
+        self = cls.__new__(cls)
+        self.path = path
+        self._dir = dirname(path)
+        if version_key is not None:
+            self._version_key = version_key
+        self._hash = content_hash
+        pv = self._parse_version
+        self._documents = [(pv(data), data) for data in documents]
+        self._versions = {ver: idx
+                          for idx, (ver, data) in enumerate(self._documents)}
+        return self
+
     def exists(self):
         return bool(self._documents)
 
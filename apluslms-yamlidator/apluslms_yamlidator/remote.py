@@ -0,0 +1,229 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from json import dump as json_dumpf, loads as json_load
+from os.path import join
+from threading import Lock
+from time import time
+from urllib.parse import quote_plus as quote, urldefrag, urljoin, urlsplit
+
+from .schemas import get_text, schema_registry, write_schema
+from .utils.files import atomic_write
+from .utils.translation import _
+
+
+logger = logging.getLogger(__name__)
+
+REMOTE_SCHEMES = ('http', 'https')
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_TIMEOUT = 10.0
+PREFETCH_WORKERS = 8
+
+
+class RemoteSchemaError(Exception):
+    pass
+
+
+def is_remote(url):
+    return urlsplit(url).scheme in REMOTE_SCHEMES
+
+
+def iter_refs(schema, base=''):
+    """Yields the absolute urls without fragments referenced in a schema tree"""
+    if isinstance(schema, dict):
+        id_ = schema.get('$id', schema.get('id'))
+        if isinstance(id_, str):
+            base = urljoin(base, id_)
+        ref = schema.get('$ref')
+        if isinstance(ref, str):
+            url = urldefrag(urljoin(base, ref))[0]
+            if url:
+                yield url
+        for key, value in schema.items():
+            if key not in ('enum', 'const', 'default', 'examples'):
+                yield from iter_refs(value, base)
+    elif isinstance(schema, list):
+        for value in schema:
+            yield from iter_refs(value, base)
+
+
+class RemoteSchemaCache:
+    """
+    Schemas loaded over http(s) and cached to the schema cache dir. Schemas
+    younger than `ttl` seconds are used as they are and older ones are
+    revalidated with a conditional request. When the request fails, a cached
+    schema is used regardless of its age. In `offline` mode, the network is
+    never used and a schema missing from the cache raises RemoteSchemaError.
+    """
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL, timeout=DEFAULT_TIMEOUT,
+            offline=False):
+        self._cache_dir = cache_dir
+        self.ttl = ttl
+        self.timeout = timeout
+        self.offline = offline
+        self._loaded = {}
+        self._lock = Lock()
+
+    def configure(self, cache_dir=None, ttl=None, timeout=None, offline=None):
+        if cache_dir is not None:
+            self._cache_dir = cache_dir
+        if ttl is not None:
+            self.ttl = int(ttl)
+        if timeout is not None:
+            self.timeout = float(timeout)
+        if offline is not None:
+            self.offline = bool(offline)
+
+    def get_settings(self):
+        """Returns the arguments of configure(), e.g. for worker processes"""
+        return {
+            'cache_dir': self._cache_dir,
+            'ttl': self.ttl,
+            'timeout': self.timeout,
+            'offline': self.offline,
+        }
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir or schema_registry._cache
+
+    def _meta_path(self, basename):
+        # not a schema, see SchemaRegistry.register_cache
+        return join(self.cache_dir, '.meta', basename + '.json')
+
+    def _read(self, basename):
+        if not self.cache_dir:
+            return None, {}
+        data = meta = None
+        try:
+            data = json_load(get_text(join(self.cache_dir, basename + '.json')))
+            meta = json_load(get_text(self._meta_path(basename)))
+        except (OSError, ValueError):
+            pass
+        if not isinstance(meta, dict):
+            # schemas cached by older versions are revalidated
+            meta = {}
+        return data, meta
+
+    def _write(self, basename, data, meta):
+        if not self.cache_dir:
+            return
+        if data is not None:
+            write_schema(self.cache_dir, basename, data)
+        path = self._meta_path(basename)
+        try:
+            with atomic_write(path) as f:
+                json_dumpf(meta, f)
+        except OSError as e:
+            logger.warning(_("Failed to save the schema cache metadata %s: %s"), path, e)
+
+    def _fetch(self, url, meta):
+        # requests is slow to import and only needed for remote schemas
+        from requests import RequestException, get as requests_get
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        logger.debug("Requesting a schema from a url %s", url)
+        try:
+            response = requests_get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                return None, dict(meta, fetched=time())
+            response.raise_for_status()
+            data = response.json()
+        except (RequestException, ValueError) as err:
+            raise RemoteSchemaError(_("Failed to load a schema from {}: {}")
+                .format(url, err)) from err
+        return data, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched': time(),
+        }
+
+    def _is_fresh(self, fetched):
+        return self.offline or time() - fetched < self.ttl
+
+    def get(self, url):
+        with self._lock:
+            loaded = self._loaded.get(url)
+        # loaded schemas expire like the cached files
+        if loaded is not None and self._is_fresh(loaded[0]):
+            return loaded[1]
+        basename = quote(url)
+        data, meta = self._read(basename)
+        if data is not None:
+            fetched = meta.get('fetched', 0)
+            if self._is_fresh(fetched):
+                return self._remember(url, data, fetched)
+        elif self.offline:
+            raise RemoteSchemaError(_("Schema {} is not cached and the network "
+                "is not used in offline mode").format(url))
+
+        try:
+            new_data, new_meta = self._fetch(url, meta if data is not None else {})
+        except RemoteSchemaError as err:
+            if data is None:
+                raise
+            logger.warning(_("%s, using the cached schema"), err)
+            # not requested again until the ttl has passed
+            return self._remember(url, data, time())
+        self._write(basename, new_data, new_meta)
+        return self._remember(url, new_data if new_data is not None else data,
+            new_meta['fetched'])
+
+    def _remember(self, url, data, fetched):
+        """Keeps `data` in memory, unless another thread has loaded it already"""
+        with self._lock:
+            loaded = self._loaded.get(url)
+            if loaded is None or not self._is_fresh(loaded[0]):
+                loaded = self._loaded[url] = (fetched, data)
+            return loaded[1]
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+
+    def prefetch(self, schema, base='', load=None, workers=PREFETCH_WORKERS):
+        """
+        Loads all remote schemas referenced in the schema tree at the same
+        time. Local references are followed with `load`, when given. Errors
+        are only logged, as they are raised again when a reference is used.
+        """
+        if self.offline:
+            return
+        seen = set()
+        pending = [(schema, base)]
+        executor = None
+        try:
+            while pending:
+                remote = []
+                # local documents are appended and walked in the same round
+                for document, doc_base in pending:
+                    for url in iter_refs(document, doc_base):
+                        if url in seen:
+                            continue
+                        seen.add(url)
+                        if is_remote(url):
+                            remote.append(url)
+                        elif load is not None:
+                            try:
+                                pending.append((load(url), url))
+                            except Exception:
+                                pass
+                pending = []
+                if not remote:
+                    break
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers=workers)
+                for url, future in [(url, executor.submit(self.get, url)) for url in remote]:
+                    try:
+                        pending.append((future.result(), url))
+                    except RemoteSchemaError as err:
+                        logger.warning("%s", err)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+remote_schemas = RemoteSchemaCache()
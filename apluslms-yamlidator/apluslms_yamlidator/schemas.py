@@ -2,11 +2,11 @@ import logging
 from codecs import open
 from collections import OrderedDict
 from importlib import import_module
-from itertools import zip_longest
 from json import dump as json_dumpf, loads as json_load
 from os import (
     listdir,
     makedirs,
+    stat,
 )
 from os.path import (
     basename,
@@ -17,8 +17,10 @@ from os.path import (
     join,
     splitext,
 )
+from time import time
 
 from .utils.decorator import cached_property
+from .utils.files import atomic_write
 from .utils.module_resources import get_module_resources, get_resource_text
 from .utils.translation import _
 from .utils.yaml import load as yaml_load
@@ -58,6 +60,28 @@ def iter_paths(paths, extensions):
                     yield join(path, filename), encoding
 
 
+def get_mtime(path):
+    try:
+        return stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_module_stamp(module):
+    """Returns the package version and the mtime of the module directory"""
+    try:
+        file_ = import_module(module).__file__
+        package = import_module(module.partition('.')[0])
+    except (ImportError, AttributeError):
+        return None
+    if not file_:
+        return None
+    mtime = get_mtime(dirname(file_))
+    if mtime is None:
+        return None
+    return [str(getattr(package, '__version__', '')), mtime]
+
+
 def get_file_loader(path, encoding=None):
     name, ext = splitext(basename(path))
     parser = json_load if ext == 'json' else yaml_load
@@ -113,6 +137,80 @@ def write_schema(dir_, basename, data):
         logger.warning(_("Failed to safe the schema to a cache file %s: %s"), path, e)
 
 
+class SchemaIndex:
+    """
+    Lists of schema files for the registered paths and modules. A list is
+    reused as long as the stamp of its source is the same: the mtime for a
+    path and the package version and directory mtime for a module. The
+    index is stored in one file, when a path is given.
+    """
+    VERSION = 1
+    # a source changed this recently may change again within the same mtime
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, extensions, path=None):
+        self.extensions = extensions
+        self.path = path
+        self._sources = None
+        self._changed = False
+
+    @property
+    def sources(self):
+        if self._sources is None:
+            self._sources = self._read()
+        return self._sources
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            data = json_load(get_text(self.path))
+        except (OSError, ValueError):
+            return {}
+        if (not isinstance(data, dict)
+                or data.get('version') != self.VERSION
+                or data.get('extensions') != list(self.extensions)):
+            return {}
+        return data.get('sources', {})
+
+    def get(self, key, stamp, scan):
+        entry = self.sources.get(key)
+        if stamp is not None and entry is not None and entry['stamp'] == stamp:
+            return entry['files']
+        logger.debug("Listing schemas in %s", key)
+        files = scan()
+        if stamp is not None and time() * 10**9 - stamp[-1] > self.RACY_NS:
+            self.sources[key] = {'stamp': stamp, 'files': files}
+            self._changed = True
+        else:
+            self.sources.pop(key, None)
+        return files
+
+    def get_path(self, path):
+        stamp = get_mtime(path)
+        return self.get('path:' + path, stamp and [stamp],
+            lambda: [p for p, _e in iter_paths(((path, None),), self.extensions)])
+
+    def get_module(self, module):
+        return self.get('module:' + module, get_module_stamp(module),
+            lambda: sorted(get_module_resources(module, self.extensions)))
+
+    def save(self):
+        if not self._changed or not self.path:
+            return
+        self._changed = False
+        data = {
+            'version': self.VERSION,
+            'extensions': list(self.extensions),
+            'sources': self.sources,
+        }
+        try:
+            with atomic_write(self.path) as f:
+                json_dumpf(data, f)
+        except OSError as e:
+            logger.warning(_("Failed to save the schema index %s: %s"), self.path, e)
+
+
 class SchemaRegistry:
     extensions = ('json', 'yml', 'yaml')
 
@@ -120,6 +218,7 @@ class SchemaRegistry:
         self._modules = []
         self._paths = []
         self._cache = None
+        self._index = SchemaIndex(self.extensions)
 
     def __iter__(self):
         yield from self.schemas
@@ -136,13 +235,16 @@ class SchemaRegistry:
         self.reload()
 
     def register_path(self, path, encoding=None):
-        if path not in self._paths:
+        if (path, encoding) not in self._paths:
             self._paths.append((path, encoding))
         self.reload()
 
     def register_cache(self, path, encoding=None):
         self.register_path(path, encoding=encoding)
         self._cache = path
+        # other files are kept in dot directories under the cache, so they
+        # are not listed as schemas and don't change the mtime of the cache
+        self._index = SchemaIndex(self.extensions, join(path, '.index', 'registry.json'))
 
     def find_file(self, name):
         if name in self.schemas:
@@ -155,7 +257,7 @@ class SchemaRegistry:
                     return self.get_file_loader(path, encoding)
         return None
 
-    def get_file_loader(self, path, encofing=None):
+    def get_file_loader(self, path, encoding=None):
         name, loader = get_file_loader(path, encoding)
         # NOTE: can set wrong path, if schemas is out of date
         self.schemas.setdefault(name, loader)
@@ -170,24 +272,28 @@ class SchemaRegistry:
     @cached_property
     def schemas(self):
         schemas = OrderedDict()
+        index = self._index
         # NOTE: paths are sorted, thus json > yaml > yml
-        for path, encoding in iter_paths(self._paths, self.extensions):
-            name, loader = get_file_loader(path, encoding)
-            schemas.setdefault(name, loader)
+        for dir_, encoding in self._paths:
+            for path in index.get_path(dir_):
+                name, loader = get_file_loader(path, encoding)
+                schemas.setdefault(name, loader)
         for module in self._modules:
-            for filename in sorted(get_module_resources(module, self.extensions)):
+            for filename in index.get_module(module):
                 name, loader = get_resource_loader(module, filename)
                 schemas.setdefault(name, loader)
+        index.save()
         return schemas
 
     def schemas_with_dirs(self, dirs, encoding=None):
         if not dirs:
             return self.schemas
         schemas = OrderedDict(self.schemas)
-        paths = zip_longest(dirs, (), fillvalue=encoding)
-        for path, encoding in iter_paths(paths, self.extensions):
-            name, loader = get_file_loader(path, encoding)
-            schemas.setdefault(name, loader)
+        for dir_ in dirs:
+            for path in self._index.get_path(dir_):
+                name, loader = get_file_loader(path, encoding)
+                schemas.setdefault(name, loader)
+        self._index.save()
         return schemas
 
     def reload(self):
@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+from os import curdir, makedirs, remove, replace
+from os.path import dirname
+from tempfile import NamedTemporaryFile
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Yields a temporary file in the directory of `path`, which replaces `path`
+    at the end of the with block. Readers see either the old or the new
+    content. If the block raises, `path` is not changed and the temporary
+    file is removed. The directory is created, when it doesn't exist.
+    """
+    dir_ = dirname(path) or curdir
+    makedirs(dir_, exist_ok=True)
+    tmp = NamedTemporaryFile(mode, dir=dir_, suffix='.tmp', delete=False)
+    try:
+        with tmp:
+            yield tmp
+        replace(tmp.name, path)
+    except BaseException:
+        try:
+            remove(tmp.name)
+        except OSError:
+            pass
+        raise
@@ -3,15 +3,16 @@ import re
 from collections import OrderedDict
 from collections.abc import Mapping, Sequence
 from functools import lru_cache
-from urllib.parse import quote_plus as quote, unquote_plus as unquote, urlsplit
+from urllib.parse import urlsplit
 
 from jsonschema import (
     RefResolver,
     ValidationError,
     validators,
 )
-from requests import get as requests_get
 
+from .compiler import validator_compiler
+from .remote import is_remote, remote_schemas
 from .schemas import schema_registry
 from .utils.error_render import render_lc
 from .utils.translation import _
@@ -24,17 +25,25 @@ SCHEMA_FILENAME_RE = re.compile("^(.*)[_-]v?(\d+)[_.](\d+)$")
 
 
 def get_remote_schema(uri):
-    url = urlsplit(uri)
-    if url.scheme not in ('http', 'https'):
-        raise ValueError("Invalid schema protocol '{}': {}".format(url.scheme, uri))
-    basename = quote(url.geturl())
-    loader = schema_registry.find_file(basename)
-    if loader is not None:
-        return loader
-    logger.debug("Requesting a schema from a url %s", uri)
-    data = requests_get(uri).json()
-    schema_registry.save_schema(basename, data)
-    return data
+    if not is_remote(uri):
+        raise ValueError("Invalid schema protocol '{}': {}".format(urlsplit(uri).scheme, uri))
+    return remote_schemas.get(uri)
+
+
+class HandlerRefResolver(RefResolver):
+    """
+    RefResolver, which uses the scheme handlers without importing requests.
+    The base class imports requests for every remote uri, even when a
+    handler resolves it.
+    """
+    def resolve_remote(self, uri):
+        handler = self.handlers.get(urlsplit(uri).scheme)
+        if handler is None:
+            return super().resolve_remote(uri)
+        result = handler(uri)
+        if self.cache_remote:
+            self.store[uri] = result
+        return result
 
 
 def ref_wrap(loader, ref):
@@ -80,7 +89,7 @@ class Validator:
         schemas = schema_registry.schemas_with_dirs(self._dirs)
         for ref, loader in schemas.items():
             if ref.startswith('http%3A') or ref.startswith('https%3A'):
-                ref_index.setdefault(unquote(ref), loader)
+                # cached remote schemas are loaded via remote_schemas, which checks their age
                 continue
             match = SCHEMA_FILENAME_RE.match(ref)
             if match:
@@ -100,6 +109,10 @@ class Validator:
         self.get_schema.cache_clear()
         self.get_validator.cache_clear()
 
+    def get_versions(self, name):
+        """Returns the known versions of the schema `name` in ascending order"""
+        return sorted(self._index.get(name, ()))
+
     def get_version(self, name, major, minor=None):
         """
         Find a schema with given 'major' and 'minor'.
@@ -141,11 +154,15 @@ class Validator:
         _v, ref = self.get_version(schema_name, major, minor)
         schema = self.get_schema(ref)
         logger.debug("Creating validator for %s", ref)
+        remote_schemas.prefetch(schema, ref, load=self.get_schema)
         handlers = {scheme: self.get_schema for scheme in ('', 'file', 'http', 'https')}
-        resolver = RefResolver.from_schema(schema, cache_remote=False, handlers=handlers)
+        resolver = HandlerRefResolver.from_schema(schema, cache_remote=False, handlers=handlers)
         validator = _validator_for(schema)
         validator.check_schema(schema)
-        return validator(schema, resolver=resolver)
+        validator = validator(schema, resolver=resolver)
+        if schema_name in validator_compiler:
+            validator = validator_compiler.compile(validator)
+        return validator
 
     def validate(self, data, schema_name, major, minor=None):
         validator = self.get_validator(schema_name, major, minor)
@@ -210,7 +227,7 @@ def _validator_with_default_feature(validator_class):
 
     def set_defaults(validator, properties, instance, schema):
         for property, subschema in properties.items():
-            if "default" in subschema:
+            if isinstance(subschema, Mapping) and "default" in subschema:
                 instance.setdefault(property, subschema["default"])
         yield from validate_properties(validator, properties, instance, schema)
 
@@ -0,0 +1,208 @@
+import unittest
+from copy import deepcopy
+from glob import glob
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from jsonschema import RefResolver, ValidationError
+
+from apluslms_yamlidator.compiler import CompiledValidator, ValidatorCompiler
+from apluslms_yamlidator.utils.collections import Changes
+from apluslms_yamlidator.validator import _validator_for
+
+
+DRAFT7 = 'http://json-schema.org/draft-07/schema'
+
+other_schema = {
+    '$id': 'other-v1.0',
+    '$schema': DRAFT7,
+    'definitions': {
+        'name': {'type': 'string', 'pattern': '^[a-z]+$'},
+    },
+}
+
+test_schema = {
+    '$id': 'test-v1.0',
+    '$schema': DRAFT7,
+    'type': 'object',
+    'required': ['version'],
+    'additionalProperties': False,
+    'definitions': {
+        'item': {
+            'if': {'type': 'string'},
+            'then': {'$ref': 'other-v1.0#/definitions/name'},
+            'else': {
+                'type': 'object',
+                'properties': {
+                    'name': {'$ref': 'other-v1.0#/definitions/name'},
+                    'size': {'type': 'integer', 'default': 1, 'minimum': 1},
+                },
+            },
+        },
+    },
+    'properties': {
+        'version': {
+            'oneOf': [
+                {'type': 'string', 'pattern': '^[0-9]+(.[0-9]+)?$'},
+                {'type': 'integer', 'minimum': 0},
+            ],
+        },
+        'backend': {'type': 'string', 'default': 'docker'},
+        'items': {
+            'type': 'array',
+            'items': {'$ref': '#/definitions/item'},
+            'maxItems': 3,
+        },
+        'tags': {'type': 'array', 'uniqueItems': True, 'items': {'enum': ['a', 'b', 1]}},
+        'pair': {'type': 'array', 'items': [{'type': 'string'}, {'type': 'number'}],
+            'additionalItems': False},
+        'flags': {
+            'type': 'object',
+            'propertyNames': {'pattern': '^[a-z]+$'},
+            'patternProperties': {'^x': {'type': 'boolean'}},
+            'additionalProperties': {'type': 'integer'},
+            'maxProperties': 2,
+        },
+        'ratio': {'type': 'number', 'exclusiveMinimum': 0, 'maximum': 1, 'multipleOf': 0.25},
+        'mode': {'anyOf': [{'const': 'fast'}, {'type': 'null'}]},
+        'text': {'type': 'string', 'minLength': 1, 'not': {'const': 'none'}},
+        'deps': {'type': 'object', 'dependencies': {'a': ['b'], 'c': {'required': ['d']}}},
+        'list': {'type': 'array', 'contains': {'type': 'integer'}},
+        'anything': True,
+    },
+}
+
+instances = [
+    {},
+    {'version': '1.0'},
+    {'version': 1},
+    {'version': -1},
+    {'version': '1.0', 'unknown': 1},
+    {'version': '1', 'items': ['abc', {'name': 'def'}, {'size': 2}]},
+    {'version': '1', 'items': ['ABC']},
+    {'version': '1', 'items': [{'name': 'abc', 'size': 0}]},
+    {'version': '1', 'items': [1]},
+    {'version': '1', 'items': ['a', 'b', 'c', 'd']},
+    {'version': '1', 'tags': ['a', 1]},
+    {'version': '1', 'tags': ['a', 'a']},
+    {'version': '1', 'tags': [True]},
+    {'version': '1', 'pair': ['a', 1.5]},
+    {'version': '1', 'pair': ['a', 1, 2]},
+    {'version': '1', 'pair': [1]},
+    {'version': '1', 'flags': {'xa': True, 'b': 1}},
+    {'version': '1', 'flags': {'xa': 1}},
+    {'version': '1', 'flags': {'B': 1}},
+    {'version': '1', 'flags': {'a': 1, 'b': 2, 'c': 3}},
+    {'version': '1', 'ratio': 0.5},
+    {'version': '1', 'ratio': 0},
+    {'version': '1', 'ratio': 0.3},
+    {'version': '1', 'mode': None},
+    {'version': '1', 'mode': 'slow'},
+    {'version': '1', 'text': ''},
+    {'version': '1', 'text': 'none'},
+    {'version': '1', 'deps': {'a': 1, 'b': 2}},
+    {'version': '1', 'deps': {'a': 1}},
+    {'version': '1', 'deps': {'c': 1}},
+    {'version': '1', 'list': ['a', 2]},
+    {'version': '1', 'list': ['a']},
+    {'version': '1', 'anything': [{}]},
+    {'version': '1', 'backend': 1},
+    'invalid',
+]
+
+
+def create_validator(schema=test_schema, other=other_schema):
+    resolver = RefResolver.from_schema(schema, store={'other-v1.0': deepcopy(other)})
+    return _validator_for(schema)(schema, resolver=resolver)
+
+
+class TestCompiledValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.compiler = ValidatorCompiler()
+        self.validator = create_validator()
+        self.compiled = self.compiler.compile(self.validator)
+
+    def test_compile_shouldReturnCompiledValidator(self):
+        self.assertIsInstance(self.compiled, CompiledValidator)
+        self.assertIs(self.compiled.schema, self.validator.schema)
+
+    def test_isValid_shouldMatchJsonschema(self):
+        for instance in instances:
+            with self.subTest(instance=instance):
+                expected = deepcopy(instance)
+                data = deepcopy(instance)
+                self.assertEqual(self.compiled.is_valid(data),
+                    self.validator.is_valid(expected))
+
+    def test_validData_shouldGetSameDefaults(self):
+        for instance in instances:
+            expected = deepcopy(instance)
+            if not self.validator.is_valid(expected):
+                continue
+            with self.subTest(instance=instance):
+                data = deepcopy(instance)
+                self.compiled.validate(data)
+                self.assertEqual(data, expected)
+        data = {'version': '1', 'items': [{}]}
+        self.compiled.validate(data)
+        self.assertEqual(data, {'version': '1', 'backend': 'docker', 'items': [{'size': 1}]})
+
+    def test_changesContainers(self):
+        data = Changes.wrap({'version': '1', 'items': [{'name': 'abc'}]})
+        self.assertTrue(self.compiled.is_valid(data))
+        self.assertEqual(data['backend'], 'docker')
+
+    def test_invalidData_shouldRaiseJsonschemaError(self):
+        with self.assertRaises(ValidationError) as compiled_error:
+            self.compiled.validate({'version': '1', 'text': ''})
+        with self.assertRaises(ValidationError) as error:
+            self.validator.validate({'version': '1', 'text': ''})
+        self.assertEqual(compiled_error.exception.message, error.exception.message)
+        self.assertEqual(list(compiled_error.exception.path), ['text'])
+
+    def test_defaultInPartiallyEvaluatedSchema_shouldNotCompile(self):
+        schema = {
+            '$schema': DRAFT7,
+            'oneOf': [{'properties': {'a': {'default': 1}}}, {'type': 'string'}],
+        }
+        validator = create_validator(schema)
+        self.assertIs(self.compiler.compile(validator), validator)
+
+    def test_draft4_shouldNotCompile(self):
+        schema = {'$schema': 'http://json-schema.org/draft-04/schema', 'type': 'object'}
+        validator = create_validator(schema)
+        self.assertIs(self.compiler.compile(validator), validator)
+
+
+class TestCompilerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.compiler = ValidatorCompiler()
+        self.compiler.register(('test',), self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_compile_shouldWriteModule(self):
+        self.compiler.compile(create_validator())
+        self.assertEqual(len(glob(join(self.tmp.name, '*.py'))), 1)
+
+    def test_secondCompile_shouldLoadModule(self):
+        self.compiler.compile(create_validator())
+        with patch.object(ValidatorCompiler, '_generate') as generate:
+            compiled = ValidatorCompiler()
+            compiled.register((), self.tmp.name)
+            validator = compiled.compile(create_validator())
+        generate.assert_not_called()
+        self.assertTrue(validator.is_valid({'version': '1'}))
+
+    def test_changedReference_shouldCompileAgain(self):
+        self.compiler.compile(create_validator())
+        other = deepcopy(other_schema)
+        other['definitions']['name']['pattern'] = '^[A-Z]+$'
+        validator = self.compiler.compile(create_validator(other=other))
+        self.assertTrue(validator.is_valid({'version': '1', 'items': ['ABC']}))
+        self.assertFalse(validator.is_valid({'version': '1', 'items': ['abc']}))
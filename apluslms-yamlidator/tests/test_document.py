@@ -100,6 +100,23 @@ class TestInMemoryDocument(unittest.TestCase):
             d.mlget('foo.bar.baz')
         self.assertEqual(cm.exception.args[0], 'foo.bar.baz')
 
+class TestContainerFromData(unittest.TestCase):
+
+    def test_documents_are_used_without_reading_the_file(self):
+        class TestDocument(Document):
+            version = (1, 0)
+
+        container = TestDocument.Container.from_data('non-existent/file.yaml', [
+            {'version': '1.0', 'foo': 'old'},
+            {'version': '1.1', 'foo': 'new'},
+        ])
+        self.assertEqual(len(container), 2)
+        d = container.get_latest(max_version='1.0', validate=False)
+        self.assertEqual(d['foo'], 'old')
+        self.assertEqual(d.path, 'non-existent/file.yaml')
+        self.assertEqual(container.get_latest(validate=False)['foo'], 'new')
+
+
 @patch_validator_registry
 class TestInMemoryDocumentWithSchema(unittest.TestCase):
 
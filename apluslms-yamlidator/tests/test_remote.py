@@ -0,0 +1,165 @@
+import json
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+from apluslms_yamlidator.remote import RemoteSchemaCache, RemoteSchemaError, iter_refs
+
+
+class SchemaServer(HTTPServer):
+    """A local stand-in for a schema host, which counts the requests"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SchemaHandler)
+        self.schemas = {}
+        self.requests = []
+        self.url = 'http://127.0.0.1:%d' % (self.server_address[1],)
+
+
+class SchemaHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        schema = server.schemas.get(self.path)
+        if schema is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = '"%d"' % (hash(json.dumps(schema, sort_keys=True)) & 0xffff,)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(schema).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RemoteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SchemaServer()
+        self.thread = Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+        self.tmp = TemporaryDirectory()
+        self.server.schemas['/a.json'] = {'type': 'object',
+            'properties': {'b': {'$ref': 'b.json#/definitions/b'}}}
+        self.server.schemas['/b.json'] = {'definitions': {'b': {'$ref': 'c.json'}}}
+        self.server.schemas['/c.json'] = {'type': 'string'}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def url(self, path):
+        return self.server.url + path
+
+    def create_cache(self, **kwargs):
+        kwargs.setdefault('timeout', 5)
+        return RemoteSchemaCache(self.tmp.name, **kwargs)
+
+
+class TestRemoteSchemaCache(RemoteTestCase):
+
+    def test_get_shouldFetchAndCache(self):
+        data = self.create_cache().get(self.url('/c.json'))
+        self.assertEqual(data, {'type': 'string'})
+        self.assertEqual(self.create_cache().get(self.url('/c.json')), data)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_staleSchema_shouldBeRevalidated(self):
+        self.create_cache().get(self.url('/c.json'))
+        data = self.create_cache(ttl=0).get(self.url('/c.json'))
+        self.assertEqual(data, {'type': 'string'})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('If-None-Match', self.server.requests[1][1])
+
+    def test_changedSchema_shouldBeUpdated(self):
+        self.create_cache().get(self.url('/c.json'))
+        self.server.schemas['/c.json'] = {'type': 'integer'}
+        data = self.create_cache(ttl=0).get(self.url('/c.json'))
+        self.assertEqual(data, {'type': 'integer'})
+        self.assertEqual(self.create_cache().get(self.url('/c.json')), data)
+
+    def test_loadedSchema_shouldBeReusedUntilTtl(self):
+        cache = self.create_cache(ttl=60)
+        data = cache.get(self.url('/c.json'))
+        self.assertIs(cache.get(self.url('/c.json')), data)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expiredLoadedSchema_shouldBeRevalidated(self):
+        cache = self.create_cache(ttl=60)
+        cache.get(self.url('/c.json'))
+        self.server.schemas['/c.json'] = {'type': 'integer'}
+        cache.ttl = 0
+        self.assertEqual(cache.get(self.url('/c.json')), {'type': 'integer'})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('If-None-Match', self.server.requests[1][1])
+
+    def test_failedRequest_shouldUseStaleSchema(self):
+        self.create_cache().get(self.url('/c.json'))
+        del self.server.schemas['/c.json']
+        with self.assertLogs('apluslms_yamlidator.remote', 'WARNING'):
+            data = self.create_cache(ttl=0).get(self.url('/c.json'))
+        self.assertEqual(data, {'type': 'string'})
+
+    def test_settings_shouldConfigureAnotherCache(self):
+        cache = self.create_cache(ttl=60, offline=True)
+        other = RemoteSchemaCache()
+        other.configure(**cache.get_settings())
+        self.assertEqual((other.cache_dir, other.ttl, other.timeout, other.offline),
+            (self.tmp.name, 60, 5, True))
+
+    def test_missingSchema_shouldRaise(self):
+        with self.assertRaises(RemoteSchemaError):
+            self.create_cache().get(self.url('/missing.json'))
+
+    def test_offline_shouldNotUseNetwork(self):
+        self.create_cache().get(self.url('/c.json'))
+        cache = self.create_cache(ttl=0, offline=True)
+        self.assertEqual(cache.get(self.url('/c.json')), {'type': 'string'})
+        with self.assertRaises(RemoteSchemaError):
+            cache.get(self.url('/a.json'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_prefetch_shouldLoadReferencedSchemas(self):
+        cache = self.create_cache()
+        cache.prefetch({'$ref': self.url('/a.json')})
+        self.assertEqual(sorted(path for path, _h in self.server.requests),
+            ['/a.json', '/b.json', '/c.json'])
+        cache.get(self.url('/c.json'))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_prefetch_shouldFollowLocalReferences(self):
+        local = {'local-v1.0': {'$ref': self.url('/c.json')}}
+        self.create_cache().prefetch({'$ref': 'local-v1.0'}, load=local.__getitem__)
+        self.assertEqual([path for path, _h in self.server.requests], ['/c.json'])
+
+
+class TestIterRefs(unittest.TestCase):
+
+    def test_refsAreResolvedAgainstIds(self):
+        schema = {
+            '$id': 'http://example.com/root.json',
+            'properties': {
+                'a': {'$ref': '#/definitions/a'},
+                'b': {'$ref': 'b.json#/x'},
+                'c': {'$id': 'http://other.com/dir/', 'items': {'$ref': 'c.json'}},
+                'd': {'enum': [{'$ref': 'not-a-ref'}]},
+            },
+        }
+        self.assertEqual(sorted(iter_refs(schema)), [
+            'http://example.com/b.json',
+            'http://example.com/root.json',
+            'http://other.com/dir/c.json',
+        ])
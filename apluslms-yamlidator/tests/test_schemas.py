@@ -1,4 +1,9 @@
+import json
 import unittest
+from os import makedirs, stat, utime
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import time
 from unittest.mock import mock_open, patch
 
 from apluslms_yamlidator import schemas
@@ -56,3 +61,72 @@ class TestWriteSchema(unittest.TestCase):
             schemas.write_schema('dir', 'name', [1, 2, 3])
             val = ''.join(a[0] for a, kw in mock_fh().write.call_args_list)
             self.assertEqual(val, '[1, 2, 3]')
+
+
+class SchemaDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = join(self.tmp.name, 'schemas')
+        self.cache = join(self.tmp.name, 'cache')
+        makedirs(self.dir)
+        makedirs(join(self.cache, '.index'))
+        self.write('a-v1.0.yaml')
+        self.write('b-v1.0.json')
+        self.write('notes.txt')
+        self.age()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name):
+        with open(join(self.dir, name), 'w') as f:
+            f.write('{}')
+
+    def age(self):
+        # older than the racy window, so the listing can be stored
+        old = time() - 60
+        utime(self.dir, (old, old))
+        utime(self.cache, (old, old))
+
+    def create_registry(self):
+        registry = schemas.SchemaRegistry()
+        registry.register_path(self.dir)
+        registry.register_cache(self.cache)
+        return registry
+
+
+class TestSchemaIndex(SchemaDirTestCase):
+
+    def test_unchangedPath_shouldNotBeListedAgain(self):
+        self.assertEqual(list(self.create_registry().schemas), ['a-v1.0', 'b-v1.0'])
+        registry = self.create_registry()
+        with patch(schemas.__name__+'.listdir') as mock_listdir:
+            self.assertEqual(list(registry.schemas), ['a-v1.0', 'b-v1.0'])
+        mock_listdir.assert_not_called()
+
+    def test_changedPath_shouldBeListedAgain(self):
+        list(self.create_registry().schemas)
+        self.write('c-v1.0.yml')
+        self.age()
+        utime(self.dir, ns=(0, stat(self.dir).st_mtime_ns + 1))
+        self.assertEqual(list(self.create_registry().schemas), ['a-v1.0', 'b-v1.0', 'c-v1.0'])
+
+    def test_recentlyChangedPath_shouldNotBeStored(self):
+        utime(self.dir)
+        list(self.create_registry().schemas)
+        with open(join(self.cache, '.index', 'registry.json')) as f:
+            self.assertNotIn('path:' + self.dir, json.load(f)['sources'])
+
+    def test_reload_shouldNotListAgain(self):
+        registry = self.create_registry()
+        list(registry.schemas)
+        registry.reload()
+        with patch(schemas.__name__+'.listdir') as mock_listdir:
+            self.assertIn('a-v1.0', registry)
+        mock_listdir.assert_not_called()
+
+    def test_brokenIndex_shouldBeIgnored(self):
+        with open(join(self.cache, '.index', 'registry.json'), 'w') as f:
+            f.write('{broken')
+        self.assertEqual(list(self.create_registry().schemas), ['a-v1.0', 'b-v1.0'])
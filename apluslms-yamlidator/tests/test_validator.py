@@ -78,3 +78,7 @@ class TestValidator(unittest.TestCase):
             self.assertFalse(val({'foo': {'bar': 0}}))
         with self.assertLogs('apluslms_yamlidator.validator', 'WARNING'):
             self.assertFalse(val({'foo': {'invalid': 'invalid'}}))
+
+    def test_get_versions(self, registry):
+        self.assertEqual(self.validator.get_versions('test-base'), [(1, 0)])
+        self.assertEqual(self.validator.get_versions('missing'), [])
@@ -0,0 +1,44 @@
+import unittest
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from apluslms_yamlidator.utils.files import atomic_write
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_replaces_file_at_the_end(self):
+        path = join(self.tmp.name, 'a.json')
+        with open(path, 'w') as f:
+            f.write('old')
+        with atomic_write(path) as f:
+            f.write('new')
+            with open(path) as old:
+                self.assertEqual(old.read(), 'old')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(listdir(self.tmp.name), ['a.json'])
+
+    def test_creates_missing_directories(self):
+        path = join(self.tmp.name, 'sub', 'a.bin')
+        with atomic_write(path, 'wb') as f:
+            f.write(b'data')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_error_keeps_old_file_and_removes_temporary(self):
+        path = join(self.tmp.name, 'a.json')
+        with open(path, 'w') as f:
+            f.write('old')
+        with self.assertRaises(ValueError):
+            with atomic_write(path) as f:
+                f.write('partial')
+                raise ValueError()
+        with open(path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(listdir(self.tmp.name), ['a.json'])
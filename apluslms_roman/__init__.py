@@ -4,12 +4,31 @@ __author__ = 'io.github.apluslms'
 __app_id__ = 'io.github.apluslms.Roman'
 
 import appdirs
+from os.path import join
 DATA_DIR = appdirs.user_data_dir(appname=__app_id__, appauthor=__author__)
 CONFIG_DIR = appdirs.user_config_dir(appname=__app_id__, appauthor=__author__)
 CACHE_DIR = appdirs.user_cache_dir(appname=__app_id__, appauthor=__author__)
-del appdirs
+DAEMON_SOCKET = join(CACHE_DIR, 'daemon.sock')
+del appdirs, join
 
-from .configuration import ProjectConfig
-from .builder import Builder, Engine
+_LAZY = {
+    'ProjectConfig': 'apluslms_roman.configuration.ProjectConfig',
+    'Builder': 'apluslms_roman.builder.Builder',
+    'Engine': 'apluslms_roman.builder.Engine',
+}
 
-from . import schemas # register our schemas
+def __getattr__(name):
+    # the public api is imported on first use, so the cli starts fast
+    if name in _LAZY:
+        from .utils.importing import import_string
+        value = import_string(_LAZY[name])
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+import sys
+if sys.version_info < (3, 7):
+    # module __getattr__ (PEP 562) is not supported, import the api eagerly
+    from .configuration import ProjectConfig
+    from .builder import Builder, Engine
+del sys
@@ -1,19 +1,39 @@
+import logging
 from collections import namedtuple
 from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from fnmatch import fnmatch
+from functools import partial
+from os.path import join
+from threading import Lock
+from time import time
 
 from ..observer import BuildObserver
 from ..utils.env import EnvDict
+from ..utils.scheduler import Overlaps, StepGraph, run_graph
+
+
+logger = logging.getLogger(__name__)
 
 
 BACKENDS = {
     'docker': 'apluslms_roman.backends.docker.DockerBackend',
+    'docker-async': 'apluslms_roman.backends.docker_aio.DockerAsyncBackend',
+    'local': 'apluslms_roman.backends.local.LocalBackend',
 }
 
 
 BuildTask = namedtuple('BuildTask', [
     'path',
     'steps',
+    'workers',
+    'cache',
+    'source_writes',
 ])
+# source_writes: If not None, the (start, end) times of the steps with `mnt`,
+# which may write to the project directory, are appended to it
+BuildTask.__new__.__defaults__ = (None,)
 
 
 def clean_image_name(image):
@@ -22,6 +42,46 @@ def clean_image_name(image):
     return image
 
 
+def parse_repository_tag(image):
+    """
+    Returns the repository and the tag of an image reference, like
+    parse_repository_tag of docker-py. For a digest reference, e.g.
+    'repo@sha256:...', the whole reference is returned with the tag None.
+    """
+    if '@' in image:
+        return image, None
+    repository, sep, tag = image.rpartition(':')
+    # the colon of a registry port is followed by a path
+    if sep and '/' not in tag:
+        return repository, tag
+    return image, 'latest'
+
+
+def format_pull_progress(event, layers):
+    """
+    Returns a line describing a pull event from the docker API or None, if
+    the event has nothing new to report. Progress of downloads and
+    extractions is reported in steps of 10%. `layers` holds the last
+    reported state per layer.
+    """
+    status = event.get('status')
+    layer = event.get('id')
+    if not status:
+        return None
+    if not layer:
+        return status
+    detail = event.get('progressDetail') or {}
+    current, total = detail.get('current'), detail.get('total')
+    percent = 100 * current // total // 10 * 10 if current and total else None
+    state = (status, percent)
+    if layers.get(layer) == state:
+        return None
+    layers[layer] = state
+    if percent is not None:
+        return "%s: %s %d%% of %.1f MB" % (layer, status, percent, total / 1e6)
+    return "%s: %s" % (layer, status)
+
+
 class BuildStep:
     """
     img: docker image
@@ -29,8 +89,13 @@ class BuildStep:
     mnt: If not None, course data is mounted to this path in RW mode
     env: If not None, dict that is given as environment for the image
     ref: Name/index of the step
+    depends_on: If not None, refs of the steps this step depends on,
+        otherwise the step depends on the previous step
+    inputs: If not None, glob patterns of source files the step reads
+    timeout: If not None, seconds the step may run before it is stopped
     """
-    __slots__ = ('img', 'cmd', 'mnt', 'env', 'name', 'ref')
+    __slots__ = ('img', 'cmd', 'mnt', 'env', 'name', 'ref', 'depends_on', 'inputs',
+        'timeout')
 
     @classmethod
     def from_config(cls, index, data, environment=None):
@@ -46,33 +111,51 @@ class BuildStep:
                 environment,
                 data.get('env'),
                 data.get('name'),
+                data.get('depends_on'),
+                data.get('inputs'),
+                data.get('timeout'),
             )
         return cls(index, clean_image_name(data))
 
     def __init__(
             self, ref, img, cmd=None, mnt=None,
-            project_env=None, step_env=None, name=None):
+            project_env=None, step_env=None, name=None, depends_on=None,
+            inputs=None, timeout=None):
         self.ref = ref
         self.img = clean_image_name(img)
         self.cmd = cmd if (cmd is None or isinstance(cmd, str)) else tuple(cmd)
         self.mnt = mnt
         self.name = name
-        self.env = EnvDict(
-            (project_env, "project configuration"),
-            (step_env, "step {}".format(str(self)))
-        ).get_combined()
+        self.depends_on = None if depends_on is None else tuple(depends_on)
+        self.inputs = None if inputs is None else tuple(inputs)
+        self.timeout = timeout
+        if not isinstance(project_env, EnvDict):
+            project_env = EnvDict((project_env, "project configuration"))
+        # the project layers are expanded once per EnvDict
+        self.env = project_env.combine(step_env, "step {}".format(str(self)))
 
     def __str__(self):
         return self.name or str(self.ref)
 
+    def uses_input(self, path):
+        """Returns true, if the source file `path` matches the step inputs"""
+        if self.inputs is None:
+            return True
+        return any(fnmatch(path, pattern) or path.startswith(pattern.rstrip('/') + '/')
+            for pattern in self.inputs)
+
 
 class BuildResult:
-    __slots__ = ('code', 'error', 'step')
+    """
+    timings: If not None, BuildTimings of the build
+    """
+    __slots__ = ('code', 'error', 'step', 'timings')
 
-    def __init__(self, code=0, error=None, step=None):
+    def __init__(self, code=0, error=None, step=None, timings=None):
         self.code = code
         self.error = error
         self.step = step
+        self.timings = timings
         assert self.ok or step is not None, "step is required for failed result"
 
     @property
@@ -93,6 +176,24 @@ Environment = namedtuple('Environment', [
 ])
 
 
+def store_step_outputs(task, step, key, before, overlapped):
+    """
+    Stores the files written by `step` to the step cache. If other steps
+    were running at the same time, their files can't be told apart from
+    the outputs of the step, so it is not stored.
+    """
+    if overlapped:
+        logger.debug("Step %s ran at the same time as other steps, so it is "
+            "not stored to the cache", step)
+        return
+    task.cache.store(key, join(task.path, '_build'), before)
+
+
+def record_source_write(task, step, started):
+    if step.mnt and task.source_writes is not None and started is not None:
+        task.source_writes.append((started, time()))
+
+
 class Backend:
     WORK_SIZE = '100M'
     WORK_PATH = '/work'
@@ -100,16 +201,134 @@ class Backend:
 
     def __init__(self, environment: Environment):
         self.environment = environment
+        self._stops = {}
+        self._cancelled = set()
+        self._building = set()
+        self._stops_lock = Lock()
+
+    def get_labels(self):
+        """Returns the labels of a container, used to find and expire them"""
+        now = datetime.now()
+        labels = {
+            '': True,
+            '.created': now,
+            '.expire': now + timedelta(days=1),
+        }
+        return {self.LABEL_PREFIX + k: str(v) for k, v in labels.items()}
 
     def prepare(self, task: BuildTask, observer: BuildObserver):
         raise NotImplementedError
 
     def build(self, task: BuildTask, observer: BuildObserver):
+        """
+            Runs the steps in dependency order, up to task.workers at a time.
+            Returns BuildResult
+        """
+        graph = StepGraph(task.steps)
+        run_step = partial(self._run_step, task, observer=observer,
+            graph=graph, keys={}, overlaps=Overlaps())
+        with self._stops_lock:
+            self._building.add(id(task))
+        try:
+            results = run_graph(graph, run_step,
+                workers=task.workers,
+                stop=lambda result: not result.ok,
+                cancel=partial(self.cancel, task))
+        except KeyboardInterrupt:
+            for step in task.steps:
+                if observer.get_step_state(step).active:
+                    observer.step_cancelled(step)
+            raise
+        finally:
+            with self._stops_lock:
+                self._building.discard(id(task))
+                self._cancelled.discard(id(task))
+        return next((result for _step, result in results if not result.ok),
+            BuildResult())
+
+    def cancel(self, task: BuildTask):
+        """
+            Stops the running steps of `task`, when the build is interrupted.
+            Called from another thread than the steps. Does nothing, if
+            `task` is not being built.
+        """
+        with self._stops_lock:
+            if id(task) not in self._building:
+                return
+            self._cancelled.add(id(task))
+            stops = list(self._stops.get(id(task), ()))
+        for stop in stops:
+            stop()
+
+    @contextmanager
+    def stoppable(self, task, stop):
+        """
+            Calls `stop()`, if `task` is cancelled while in the with block, and
+            raises KeyboardInterrupt after the block, so the step is cancelled.
+        """
+        key = id(task)
+        with self._stops_lock:
+            cancelled = key in self._cancelled
+            if not cancelled:
+                self._stops.setdefault(key, []).append(stop)
+        if cancelled:
+            stop()
+            raise KeyboardInterrupt
+        try:
+            yield
+        finally:
+            with self._stops_lock:
+                stops = self._stops[key]
+                stops.remove(stop)
+                if not stops:
+                    del self._stops[key]
+                cancelled = key in self._cancelled
+        if cancelled:
+            raise KeyboardInterrupt
+
+    def _get_cache_key(self, task, step, dependency_keys):
+        if task.cache is None or step.mnt or not all(dependency_keys):
+            return None
+        image_id = self.get_image_id(step)
+        if not image_id:
+            return None
+        return task.cache.get_key(step, image_id, task.path, dependency_keys)
+
+    def _run_step(self, task, step, observer, graph, keys, overlaps):
+        key = self._get_cache_key(task, step,
+            [keys.get(dep) for dep in graph.dependencies[step]])
+        build_path = join(task.path, '_build')
+        started = None
+        overlaps.start(step)
+        try:
+            if key and task.cache.restore(key, build_path):
+                observer.step_cached(step)
+                keys[step] = key
+                return BuildResult(step=step)
+            before = task.cache.snapshot(build_path) if key else None
+            started = time()
+            result = self.build_step(task, step, observer)
+        finally:
+            overlapped = overlaps.end(step)
+            record_source_write(task, step, started)
+        if key and result.ok:
+            store_step_outputs(task, step, key, before, overlapped)
+            keys[step] = key
+        return result
+
+    def build_step(self, task: BuildTask, step: BuildStep, observer: BuildObserver):
         """
             Returns BuildResult
         """
         raise NotImplementedError
 
+    def get_image_id(self, step: BuildStep):
+        """
+            Returns an identifier for the content of the step image or None,
+            if the backend can't resolve it. Steps without it are not cached.
+        """
+        return None
+
     def verify(self):
         """Verify that connections to backend is working
         Returns:
@@ -0,0 +1,182 @@
+import asyncio
+from os.path import join
+from time import time
+
+from . import (
+    Backend,
+    BuildResult,
+    BuildStep,
+    BuildTask,
+    record_source_write,
+    store_step_outputs,
+)
+from ..observer import BuildObserver
+from ..utils.scheduler import Overlaps, StepGraph
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine in a new event loop and returns its result. On
+    KeyboardInterrupt, the coroutine is cancelled and allowed to clean up
+    before the exception is raised again.
+    """
+    loop = asyncio.new_event_loop()
+    # before python 3.5.3, get_event_loop() doesn't return the running loop
+    asyncio.set_event_loop(loop)
+    try:
+        task = loop.create_task(coro)
+        try:
+            return loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                pass
+            raise
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class AsyncBackend:
+    """
+    The backend protocol with coroutines. All steps and container
+    operations of a build run in one event loop, so many builds and log
+    streams can share a thread. The observer is called from the loop, except
+    for the container output, which LogBuffer may flush from its own thread.
+    """
+    WORK_SIZE = Backend.WORK_SIZE
+    WORK_PATH = Backend.WORK_PATH
+    LABEL_PREFIX = Backend.LABEL_PREFIX
+    get_labels = Backend.get_labels
+
+    def __init__(self, environment):
+        self.environment = environment
+
+    async def prepare(self, task: BuildTask, observer: BuildObserver):
+        raise NotImplementedError
+
+    async def build(self, task: BuildTask, observer: BuildObserver):
+        """
+            Runs the steps in dependency order, up to task.workers at a time.
+            Returns BuildResult
+        """
+        graph = StepGraph(task.steps)
+        semaphore = asyncio.Semaphore(max(1, task.workers or 1))
+        failed = []
+        keys = {}
+        runs = {}
+        overlaps = Overlaps()
+
+        async def run(step):
+            for dep in graph.dependencies[step]:
+                result = await runs[dep]
+                if result is None or not result.ok:
+                    return None
+            async with semaphore:
+                if failed:
+                    return None
+                result = await self._run_step(task, step, observer, graph, keys,
+                    overlaps)
+            if not result.ok:
+                failed.append(result)
+            return result
+
+        for step in graph:
+            runs[step] = asyncio.ensure_future(run(step))
+        try:
+            await asyncio.gather(*runs.values())
+        except asyncio.CancelledError:
+            for run_ in runs.values():
+                run_.cancel()
+            for step in task.steps:
+                if observer.get_step_state(step).active:
+                    observer.step_cancelled(step)
+            raise
+        return failed[0] if failed else BuildResult()
+
+    async def _get_cache_key(self, task, step, dependency_keys):
+        if task.cache is None or step.mnt or not all(dependency_keys):
+            return None
+        image_id = await self.get_image_id(step)
+        if not image_id:
+            return None
+        return task.cache.get_key(step, image_id, task.path, dependency_keys)
+
+    async def _run_step(self, task, step, observer, graph, keys, overlaps):
+        loop = asyncio.get_event_loop()
+        key = await self._get_cache_key(task, step,
+            [keys.get(dep) for dep in graph.dependencies[step]])
+        build_path = join(task.path, '_build')
+        started = None
+        overlaps.start(step)
+        try:
+            if key and await loop.run_in_executor(None, task.cache.restore, key, build_path):
+                observer.step_cached(step)
+                keys[step] = key
+                return BuildResult(step=step)
+            before = (await loop.run_in_executor(None, task.cache.snapshot, build_path)
+                if key else None)
+            started = time()
+            result = await self.build_step(task, step, observer)
+        finally:
+            overlapped = overlaps.end(step)
+            record_source_write(task, step, started)
+        if key and result.ok:
+            await loop.run_in_executor(None, store_step_outputs, task, step, key,
+                before, overlapped)
+            keys[step] = key
+        return result
+
+    async def build_step(self, task: BuildTask, step: BuildStep, observer: BuildObserver):
+        """
+            Returns BuildResult
+        """
+        raise NotImplementedError
+
+    async def get_image_id(self, step: BuildStep):
+        return None
+
+    async def verify(self):
+        raise NotImplementedError
+
+    async def cleanup(self, force=False):
+        pass
+
+    async def version_info(self):
+        pass
+
+
+class SyncBackend(Backend):
+    """
+    Runs an AsyncBackend through the blocking Backend interface. Each call
+    runs in a new event loop, so builds in different threads don't share a
+    loop.
+    """
+    async_backend_class = None
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.backend = self.async_backend_class(environment)
+
+    def prepare(self, task, observer):
+        return run_sync(self.backend.prepare(task, observer))
+
+    def build(self, task, observer):
+        return run_sync(self.backend.build(task, observer))
+
+    def build_step(self, task, step, observer):
+        return run_sync(self.backend.build_step(task, step, observer))
+
+    def get_image_id(self, step):
+        return run_sync(self.backend.get_image_id(step))
+
+    def verify(self):
+        return run_sync(self.backend.verify())
+
+    def cleanup(self, force=False):
+        return run_sync(self.backend.cleanup(force))
+
+    def version_info(self):
+        return run_sync(self.backend.version_info())
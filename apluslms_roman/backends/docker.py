@@ -1,15 +1,27 @@
 import logging
+import shlex
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
 from os.path import join
+from threading import Event, Lock, Thread
 
 import docker
+from apluslms_yamlidator.utils.collections import OrderedDict
 from apluslms_yamlidator.utils.decorator import cached_property
 
+from ..utils.logs import LogBuffer
+from ..utils.scheduler import Deadlines
+from ..utils.timing import clock
+from ..utils.trace import tracer
 from ..utils.translation import _
 from . import (
     Backend,
     BuildResult,
+    clean_image_name,
+    format_pull_progress,
+    parse_repository_tag,
 )
 
 
@@ -18,19 +30,197 @@ Mount = docker.types.Mount
 
 logger = logging.getLogger(__name__)
 
+# keeps a reused container running until it is removed
+IDLE_COMMAND = ['/bin/sh', '-c', 'while :; do sleep 3600; done']
+# empties the work directory of a reused container, keeping the mounts
+CLEAN_WORK_COMMAND = ['/bin/sh', '-c', 'for f in * .[!.]* ..?*; do '
+    'case "$f" in src|build) continue;; esac; '
+    'if [ -e "$f" ] || [ -L "$f" ]; then rm -rf -- "$f" || exit; fi; done']
+WARM_WORKERS = 4
+DEFAULT_WAIT_TIMEOUT = 60
+
+
+@contextmanager
+def _no_measure(stage):
+    yield
+
 
 @contextmanager
-def create_container(client, **opts):
-    container = client.containers.create(**opts)
+def create_container(client, measure=_no_measure, before_start=None, **opts):
+    """
+    Creates and starts a container, which is removed at the end. `measure`
+    returns a context manager timing a stage, e.g. observer.measure.
+    `before_start` is called with the container before it is started.
+    """
+    with measure('create'):
+        container = client.containers.create(**opts)
     try:
-        container.start()
+        if before_start is not None:
+            before_start(container)
+        with measure('start'):
+            container.start()
         yield container
     finally:
+        try:
+            with measure('remove'):
+                container.remove(force=True)
+        except docker.errors.APIError as err:
+            logger.warning("Failed to stop container %s: %s", container, err)
+
+
+def is_true(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+class ContainerExit:
+    """The exit of a container. `code` is None, if the exit code is unknown."""
+    __slots__ = ('_event', 'code')
+
+    def __init__(self):
+        self._event = Event()
+        self.code = None
+
+    def set(self, code):
+        self.code = code
+        self._event.set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class ContainerSupervisor:
+    """
+    Detects the exits of all watched containers from one docker events
+    stream, which is read by a single thread. If the stream can't be opened
+    or it ends, watch() returns None and the pending exits are set as
+    unknown, so callers fall back to container.wait().
+    """
+    def __init__(self, client, label):
+        self._client = client
+        self._label = label
+        self._watched = {}
+        self._lock = Lock()
+        self._stream = None
+        self._failed = False
+
+    def watch(self, container_id):
+        """Call before the container is started, so the exit is not missed"""
+        with self._lock:
+            if self._stream is None and not self._failed:
+                try:
+                    self._stream = self._client.events(decode=True, filters={
+                        'type': 'container', 'event': 'die', 'label': self._label})
+                except docker.errors.APIError as err:
+                    logger.debug("Unable to follow docker events: %s", err)
+                    self._failed = True
+                else:
+                    Thread(target=self._run, args=(self._stream,),
+                        name='docker events', daemon=True).start()
+            if self._failed:
+                return None
+            exit = self._watched[container_id] = ContainerExit()
+            return exit
+
+    def unwatch(self, container_id):
+        with self._lock:
+            self._watched.pop(container_id, None)
+
+    def _run(self, stream):
+        try:
+            for event in stream:
+                actor = event.get('Actor') or {}
+                with self._lock:
+                    exit = self._watched.pop(actor.get('ID') or event.get('id'), None)
+                if exit is not None:
+                    code = (actor.get('Attributes') or {}).get('exitCode')
+                    exit.set(int(code) if code is not None else None)
+        except Exception as err:
+            logger.debug("Docker events stream failed: %s", err)
+        finally:
+            with self._lock:
+                self._failed = True
+                self._stream = None
+                watched, self._watched = self._watched, {}
+            for exit in watched.values():
+                exit.set(None)
+
+    def close(self):
+        with self._lock:
+            stream = self._stream
+        if stream is not None and hasattr(stream, 'close'):
+            stream.close()
+
+
+class ContainerPool:
+    """
+    Long-lived containers, which run step commands via exec. A container is
+    used by one step at a time and returned to the pool after it. Containers
+    can be started in the background before they are needed with prestart().
+    `start` functions return a running container or None, if the image can't
+    keep a container running, in which case the key is not tried again.
+    """
+    def __init__(self, workers=WARM_WORKERS):
+        self._idle = {}
+        self._containers = []
+        self._failed = set()
+        self._lock = Lock()
+        self._workers = workers
+        self._executor = None
+
+    def _start(self, key, start):
+        container = start()
+        with self._lock:
+            if container is None:
+                self._failed.add(key)
+            else:
+                self._containers.append(container)
+        return container
+
+    def prestart(self, key, start):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers)
+            future = self._executor.submit(self._start, key, start)
+            self._idle.setdefault(key, []).append(future)
+
+    def acquire(self, key, start):
+        with self._lock:
+            if key in self._failed:
+                return None
+            idle = self._idle.get(key)
+            container = idle.pop(0) if idle else None
+        if isinstance(container, Future):
+            container = container.result()
+        if container is None:
+            container = self._start(key, start)
+        return container
+
+    def release(self, key, container, broken=False):
+        if not broken:
+            with self._lock:
+                self._idle.setdefault(key, []).append(container)
+            return
+        with self._lock:
+            self._containers.remove(container)
         try:
             container.remove(force=True)
         except docker.errors.APIError as err:
             logger.warning("Failed to stop container %s: %s", container, err)
 
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        with self._lock:
+            containers, self._containers = self._containers, []
+            self._idle = {}
+        for container in containers:
+            try:
+                container.remove(force=True)
+            except docker.errors.APIError as err:
+                logger.warning("Failed to stop container %s: %s", container, err)
+
 
 class DockerBackend(Backend):
     name = 'docker'
@@ -38,6 +228,19 @@ class DockerBackend(Backend):
 Are you in local 'docker' group? Have you logged out and back in after joining?
 You might be able to add yourself to that group with 'sudo adduser docker'.""")
 
+    def __init__(self, environment):
+        super().__init__(environment)
+        env = environment.environ
+        self.reuse_containers = is_true(env.get('DOCKER_REUSE_CONTAINERS', False))
+        self.warm_images = {clean_image_name(img.strip())
+            for img in env.get('DOCKER_WARM_IMAGES', '').split(',') if img.strip()}
+        self.step_timeout = float(env.get('DOCKER_STEP_TIMEOUT') or 0) or None
+        self.wait_timeout = float(env.get('DOCKER_WAIT_TIMEOUT') or DEFAULT_WAIT_TIMEOUT)
+        self._pools = {}
+        self._deadlines = Deadlines('docker timeouts')
+        self._builds = 0
+        self._builds_lock = Lock()
+
     @cached_property
     def _client(self):
         env = self.environment.environ
@@ -50,24 +253,45 @@ You might be able to add yourself to that group with 'sudo adduser docker'.""")
             kwargs['timeout'] = timeout
         return docker.from_env(environment=env, **kwargs)
 
-    def _run_opts(self, task, step):
-        env = self.environment
+    @cached_property
+    def _supervisor(self):
+        return ContainerSupervisor(self._client, self.LABEL_PREFIX)
 
-        now = datetime.now()
-        expire = now + timedelta(days=1)
-        labels = {
-            '': True,
-            '.created': now,
-            '.expire': expire,
-        }
-        labels = {self.LABEL_PREFIX + k: str(v) for k, v in labels.items()}
+    def _set_timeout(self, step, container):
+        """Stops the container after the step timeout, returns a handle or None"""
+        timeout = step.timeout or self.step_timeout
+        if not timeout:
+            return None
+        return timeout, self._deadlines.add(timeout,
+            partial(self._kill, container))
 
+    def _kill(self, container):
+        try:
+            container.kill()
+        except docker.errors.APIError as err:
+            logger.warning("Failed to stop container %s: %s", container, err)
+
+    def _cancel_timeout(self, handle, timed_out):
+        """Cancels the timeout. If it has stopped the container, adds it to `timed_out`."""
+        if handle is not None:
+            timeout, entry = handle
+            if not self._deadlines.cancel(entry):
+                timed_out.append(timeout)
+
+    def _wait_exit(self, container, exit):
+        """Returns the exit status of a container, which output has ended"""
+        if exit is not None and exit.wait(self.wait_timeout) and exit.code is not None:
+            return {'StatusCode': exit.code}
+        return container.wait(timeout=self.wait_timeout)
+
+    def _run_opts(self, task, step):
+        env = self.environment
         opts = dict(
             image=step.img,
             command=step.cmd,
             environment=step.env,
             user='{}:{}'.format(env.uid, env.gid),
-            labels=labels
+            labels=self.get_labels(),
         )
 
         # mounts and workdir
@@ -86,52 +310,301 @@ You might be able to add yourself to that group with 'sudo adduser docker'.""")
 
         return opts
 
+    def _pull_image(self, img, steps, observer):
+        step = steps[0]
+        for step_ in steps:
+            observer.step_running(step_)
+        observer.manager_msg(step, "Downloading image {}".format(img))
+        image, tag = parse_repository_tag(img)
+        layers = {}
+        start = clock()
+        try:
+            for event in self._client.api.pull(image, tag, stream=True, decode=True):
+                if 'error' in event:
+                    raise docker.errors.APIError(event['error'])
+                line = format_pull_progress(event, layers)
+                if line:
+                    observer.manager_msg(step, line)
+        except docker.errors.APIError as err:
+            for step_ in steps:
+                observer.step_timing(step_, 'pull', clock() - start, start)
+                observer.step_failed(step_)
+            return "%s %s" % (err.__class__.__name__, err)
+        for step_ in steps:
+            observer.step_timing(step_, 'pull', clock() - start, start)
+            observer.step_succeeded(step_)
+        return None
+
     def prepare(self, task, observer):
         client = self._client
+        images = OrderedDict()
         for step in task.steps:
             observer.step_preflight(step)
-            image, tag = step.img.split(':', 1)
+            images.setdefault(step.img, []).append(step)
+
+        missing = []
+        for img, steps in images.items():
+            start = clock()
             try:
-                img = client.images.get(step.img)
+                client.images.get(img)
             except docker.errors.ImageNotFound:
-                observer.step_running(step)
-                observer.manager_msg(step, "Downloading image {}".format(step.img))
-                try:
-                    img = client.images.pull(image, tag)
-                except docker.errors.APIError as err:
-                    observer.step_failed(step)
-                    error = "%s %s" % (err.__class__.__name__, err)
-                    return BuildResult(-1, error, step)
-            observer.step_succeeded(step)
+                found = False
+            else:
+                found = True
+            for step in steps:
+                observer.step_timing(step, 'image lookup', clock() - start, start)
+            if not found:
+                missing.append(img)
+            else:
+                for step in steps:
+                    observer.step_succeeded(step)
+        if not missing:
+            return BuildResult()
+
+        # pull all missing images concurrently
+        errors = {}
+        executor = ThreadPoolExecutor(max_workers=len(missing))
+        futures = {executor.submit(self._pull_image, img, images[img], observer): img
+            for img in missing}
+        try:
+            for future in as_completed(futures):
+                error = future.result()
+                if error:
+                    errors[futures[future]] = error
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False)
+            for step in task.steps:
+                if observer.get_step_state(step).active:
+                    observer.step_cancelled(step)
+            raise
+        executor.shutdown()
+
+        for step in task.steps:
+            if step.img in errors:
+                return BuildResult(-1, errors[step.img], step)
         return BuildResult()
 
     def build(self, task, observer):
-        client = self._client
-        for step in task.steps:
-            observer.step_pending(step)
-            opts = self._run_opts(task, step)
-            observer.manager_msg(step, "Starting container {}:".format(opts['image']))
+        with self._builds_lock:
+            self._builds += 1
+        try:
+            return self._build(task, observer)
+        finally:
+            self._close_supervisor()
+
+    def _close_supervisor(self):
+        # the events stream is followed only while builds are running
+        with self._builds_lock:
+            self._builds -= 1
+            if self._builds:
+                return
+            supervisor = self.__dict__.pop('_supervisor', None)
+        if supervisor is not None:
+            supervisor.close()
+
+    def _build(self, task, observer):
+        if not self.reuse_containers:
+            return super().build(task, observer)
+        pool = self._pools[id(task)] = ContainerPool()
+        try:
+            for key, step in OrderedDict(
+                    (self._container_key(task, step), step) for step in task.steps
+                    if step.img in self.warm_images).items():
+                pool.prestart(key, partial(self._start_idle_container, task, step))
+            return super().build(task, observer)
+        finally:
+            del self._pools[id(task)]
+            pool.close()
+
+    def _container_key(self, task, step):
+        # steps with the same image and mounts can share a container
+        return (step.img, step.mnt, task.path)
+
+    def _start_idle_container(self, task, step):
+        opts = self._run_opts(task, step)
+        opts.update(entrypoint=IDLE_COMMAND, command=None, environment=None)
+        try:
+            container = self._client.containers.create(**opts)
+        except docker.errors.APIError as err:
+            logger.debug("Unable to create a container for %s: %s", step.img, err)
+            return None
+        try:
+            container.start()
+            container.reload()
+            if container.status == 'running':
+                return container
+        except docker.errors.APIError as err:
+            logger.debug("Unable to start a container for %s: %s", step.img, err)
+        logger.info("Image %s can't keep a container running, using a "
+            "container per step", step.img)
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError:
+            pass
+        return None
+
+    def _get_command(self, step):
+        """Returns the command of the step as a list including the entrypoint"""
+        config = self._client.images.get(step.img).attrs.get('Config') or {}
+        entrypoint = config.get('Entrypoint') or []
+        if isinstance(entrypoint, str):
+            entrypoint = shlex.split(entrypoint)
+        if step.cmd is None:
+            args = config.get('Cmd') or []
+        elif isinstance(step.cmd, str):
+            args = shlex.split(step.cmd)
+        else:
+            args = list(step.cmd)
+        return list(entrypoint) + list(args)
+
+    def build_step(self, task, step, observer):
+        observer.step_pending(step)
+        pool = self._pools.get(id(task))
+        if pool is not None:
+            result = self._exec_step(pool, task, step, observer)
+            if result is not None:
+                return result
+        return self._run_step_container(task, step, observer)
+
+    def _exec_step(self, pool, task, step, observer):
+        """
+        Runs the step in a container from the pool. Returns None, if the step
+        needs a container of its own.
+        """
+        api = self._client.api
+        measure = partial(observer.measure, step)
+        try:
+            command = self._get_command(step)
+            if not command:
+                return None
+            key = self._container_key(task, step)
+            with measure('acquire'):
+                container = pool.acquire(key,
+                    partial(self._start_idle_container, task, step))
+        except docker.errors.APIError as err:
+            logger.debug("Unable to reuse a container for %s: %s", step.img, err)
+            return None
+        if container is None:
+            return None
+        opts = self._run_opts(task, step)
+        observer.manager_msg(step, "Running in container {} {}:".format(
+            container.short_id, opts['image']))
+        timed_out = []
+        clean = False
+        try:
+            observer.step_running(step)
+            timeout = self._set_timeout(step, container)
             try:
-                with create_container(client, **opts) as container:
-                    observer.step_running(step)
-                    for line in container.logs(stderr=True, stream=True):
-                        observer.container_msg(step, line.decode('utf-8'))
-                    ret = container.wait(timeout=10)
-            except docker.errors.APIError as err:
+                with measure('exec'), \
+                        self.stoppable(task, partial(self._kill, container)):
+                    exec_id = api.exec_create(container.id, command,
+                        user=opts['user'], environment=step.env,
+                        workdir=opts['working_dir'])['Id']
+                    with LogBuffer(partial(observer.container_msg, step)) as logs:
+                        for chunk in api.exec_start(exec_id, stream=True):
+                            logs.feed(chunk)
+                    code = api.exec_inspect(exec_id).get('ExitCode')
+            finally:
+                self._cancel_timeout(timeout, timed_out)
+            clean = not timed_out and self._clean_work(container, step, opts)
+        except docker.errors.APIError as err:
+            observer.step_failed(step)
+            if timed_out:
+                return self._timed_out(step, timed_out[0])
+            error = "%s %s" % (err.__class__.__name__, err)
+            return BuildResult(-1, error, step)
+        except KeyboardInterrupt:
+            observer.step_cancelled(step)
+            raise
+        finally:
+            # a stopped or dirty container can't be used by the next steps
+            pool.release(key, container, broken=not clean)
+        if code == 0:
+            observer.step_succeeded(step)
+            return BuildResult(step=step)
+        observer.step_failed(step)
+        # the timeout may fire after the command has already exited
+        if timed_out:
+            return self._timed_out(step, timed_out[0])
+        if code is None:
+            return BuildResult(-1, _("The exit code of the command is unknown"), step)
+        return BuildResult(code, None, step)
+
+    def _clean_work(self, container, step, opts):
+        """
+        Removes the files left by the step in the work directory of a pooled
+        container, except the mounted sources and build. Returns false, if
+        the container can't be cleaned.
+        """
+        if step.mnt:
+            return True
+        api = self._client.api
+        try:
+            exec_id = api.exec_create(container.id, CLEAN_WORK_COMMAND,
+                user=opts['user'], workdir=self.WORK_PATH)['Id']
+            api.exec_start(exec_id)
+            code = api.exec_inspect(exec_id).get('ExitCode')
+        except docker.errors.APIError as err:
+            logger.debug("Unable to clean container %s: %s", container, err)
+            return False
+        return code == 0
+
+    def _run_step_container(self, task, step, observer):
+        client = self._client
+        supervisor = self._supervisor
+        opts = self._run_opts(task, step)
+        observer.manager_msg(step, "Starting container {}:".format(opts['image']))
+        measure = partial(observer.measure, step)
+        exits = []
+        timed_out = []
+        def watch(container):
+            exits.append(supervisor.watch(container.id))
+        try:
+            with create_container(client, measure, watch, **opts) as container, \
+                    self.stoppable(task, partial(self._kill, container)):
+                observer.step_running(step)
+                timeout = self._set_timeout(step, container)
+                try:
+                    with measure('logs'), \
+                            LogBuffer(partial(observer.container_msg, step)) as logs:
+                        for chunk in container.logs(stderr=True, stream=True):
+                            logs.feed(chunk)
+                    with measure('wait'):
+                        ret = self._wait_exit(container, exits[0])
+                finally:
+                    self._cancel_timeout(timeout, timed_out)
+                    supervisor.unwatch(container.id)
+        except docker.errors.APIError as err:
+            observer.step_failed(step)
+            if timed_out:
+                return self._timed_out(step, timed_out[0])
+            error = "%s %s" % (err.__class__.__name__, err)
+            return BuildResult(-1, error, step)
+        except KeyboardInterrupt:
+            observer.step_cancelled(step)
+            raise
+        else:
+            code = ret.get('StatusCode', None)
+            error = ret.get('Error', None)
+            if code or error:
                 observer.step_failed(step)
-                error = "%s %s" % (err.__class__.__name__, err)
-                return BuildResult(-1, error, step)
-            except KeyboardInterrupt:
-                observer.step_cancelled(step)
-                raise
-            else:
-                code = ret.get('StatusCode', None)
-                error = ret.get('Error', None)
-                if code or error:
-                    observer.step_failed(step)
-                    return BuildResult(code, error, step)
-                observer.step_succeeded(step)
-        return BuildResult()
+                # the timeout may fire after the command has already exited
+                if timed_out:
+                    return self._timed_out(step, timed_out[0])
+                return BuildResult(code, error, step)
+            observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+    def _timed_out(self, step, timeout):
+        return BuildResult(-1, _("The step was stopped after the timeout of {} "
+            "seconds").format(timeout), step)
+
+    def get_image_id(self, step):
+        try:
+            with tracer.span('image id', cat='docker', args={'image': step.img}):
+                return self._client.images.get(step.img).id
+        except docker.errors.APIError:
+            return None
 
     def verify(self):
         try:
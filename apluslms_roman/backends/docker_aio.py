@@ -0,0 +1,406 @@
+import asyncio
+import json
+import logging
+import re
+import shlex
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+from os.path import join
+from struct import unpack
+from urllib.parse import quote, urlencode, urlsplit
+
+from ..utils.logs import LineDecoder, LogBuffer
+from ..utils.translation import _
+from . import BuildResult, format_pull_progress, parse_repository_tag
+from .aio import AsyncBackend, SyncBackend
+
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = '1.30'
+DEFAULT_HOST = 'unix:///var/run/docker.sock'
+DEFAULT_WAIT_TIMEOUT = 60
+SIZE_RE = re.compile(r'^(\d+)([kmg]?)b?$', re.I)
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_size(size):
+    match = SIZE_RE.match(str(size).strip())
+    if not match:
+        raise ValueError("Invalid size: {}".format(size))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+
+class StreamDemuxer:
+    """
+    Splits the multiplexed stream of a container without a tty. Each frame
+    has an 8 byte header with the stream number and the payload size.
+    """
+    def __init__(self):
+        self._buffer = b''
+
+    def feed(self, data):
+        buffer = self._buffer + data
+        frames = []
+        while len(buffer) >= 8:
+            size = unpack('>I', buffer[4:8])[0]
+            if len(buffer) < 8 + size:
+                break
+            frames.append((buffer[0], buffer[8:8 + size]))
+            buffer = buffer[8 + size:]
+        self._buffer = buffer
+        return frames
+
+
+class AsyncDockerClient:
+    """
+    A minimal client for the Docker Engine API over a Unix socket or tcp
+    using asyncio streams. Every request uses a new connection, so requests
+    can run concurrently. TLS is not supported.
+    """
+    def __init__(self, host=None, version=API_VERSION, timeout=None):
+        url = urlsplit(host or DEFAULT_HOST)
+        if url.scheme in ('unix', 'http+unix'):
+            self.address = ('unix', url.path)
+        elif url.scheme in ('tcp', 'http'):
+            self.address = ('tcp', (url.hostname, url.port or 2375))
+        else:
+            raise ValueError(_("Unsupported docker host: {}").format(host))
+        self.version = version
+        self.timeout = timeout
+
+    async def _connect(self):
+        kind, address = self.address
+        if kind == 'unix':
+            return await asyncio.open_unix_connection(address)
+        return await asyncio.open_connection(*address)
+
+    async def request(self, method, path, params=None, body=None, on_data=None):
+        """
+        Sends a request and returns the status and the body. When `on_data`
+        is given, it's called with each chunk of a successful response as it
+        arrives and the returned body is empty. Raises DockerAPIError for
+        error responses. Requests without `on_data` time out after `timeout`.
+        """
+        coro = self._request(method, path, params, body, on_data)
+        if on_data is None and self.timeout:
+            return await asyncio.wait_for(coro, self.timeout)
+        return await coro
+
+    async def _request(self, method, path, params, body, on_data):
+        if params:
+            path += '?' + urlencode([(k, v) for k, v in params.items() if v is not None])
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        head = [
+            '%s /v%s%s HTTP/1.1' % (method, self.version, path),
+            'Host: docker',
+            'Connection: close',
+            'Content-Length: %d' % (len(data),),
+        ]
+        if body is not None:
+            head.append('Content-Type: application/json')
+        reader, writer = await self._connect()
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+            status, headers = await self._read_head(reader)
+            chunks = []
+            if on_data is None or status >= 400:
+                on_data = chunks.append
+            await self._read_body(reader, status, headers, on_data)
+        finally:
+            writer.close()
+        content = b''.join(chunks)
+        if status >= 400:
+            try:
+                message = json.loads(content.decode('utf-8'))['message']
+            except (ValueError, KeyError, TypeError):
+                message = content.decode('utf-8', 'replace').strip()
+            raise DockerAPIError(status, "%d: %s" % (status, message))
+        return status, content
+
+    async def _read_head(self, reader):
+        line = await reader.readline()
+        parts = line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise DockerAPIError(0, "Invalid response from docker: %r" % (line,))
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _sep, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        return int(parts[1]), headers
+
+    async def _read_body(self, reader, status, headers, on_data):
+        if status in (204, 304) or 100 <= status < 200:
+            return
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+                if not size:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                on_data(await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length:
+                on_data(await reader.readexactly(length))
+        else:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    return
+                on_data(data)
+
+    async def get_json(self, path, params=None):
+        _status, content = await self.request('GET', path, params)
+        return json.loads(content.decode('utf-8'))
+
+    async def post_json(self, path, body=None, params=None):
+        _status, content = await self.request('POST', path, params, body)
+        return json.loads(content.decode('utf-8')) if content else None
+
+
+class AsyncDockerBackend(AsyncBackend):
+    name = 'docker'
+    debug_hint = _("""Is docker running and is its API available at the
+DOCKER_HOST or at /var/run/docker.sock? Are you in the local 'docker' group?""")
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        env = environment.environ
+        timeout = env.get('DOCKER_TIMEOUT')
+        self.client = AsyncDockerClient(env.get('DOCKER_HOST'),
+            env.get('DOCKER_VERSION') or API_VERSION,
+            float(timeout) if timeout else None)
+        self.step_timeout = float(env.get('DOCKER_STEP_TIMEOUT') or 0) or None
+        self.wait_timeout = float(env.get('DOCKER_WAIT_TIMEOUT') or DEFAULT_WAIT_TIMEOUT)
+
+    def _create_body(self, task, step):
+        env = self.environment
+        cmd = step.cmd
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        elif cmd is not None:
+            cmd = list(cmd)
+        if step.mnt:
+            mounts = [{'Type': 'bind', 'Source': task.path, 'Target': step.mnt,
+                'ReadOnly': False}]
+            workdir = step.mnt
+        else:
+            wpath = self.WORK_PATH
+            mounts = [
+                {'Type': 'tmpfs', 'Target': wpath,
+                    'TmpfsOptions': {'SizeBytes': parse_size(self.WORK_SIZE)}},
+                {'Type': 'bind', 'Source': task.path, 'Target': join(wpath, 'src'),
+                    'ReadOnly': True},
+                {'Type': 'bind', 'Source': join(task.path, '_build'),
+                    'Target': join(wpath, 'build'), 'ReadOnly': False},
+            ]
+            workdir = wpath
+        return {
+            'Image': step.img,
+            'Cmd': cmd,
+            'Env': ['%s=%s' % item for item in (step.env or {}).items()],
+            'User': '{}:{}'.format(env.uid, env.gid),
+            'Labels': self.get_labels(),
+            'WorkingDir': workdir,
+            'HostConfig': {'Mounts': mounts},
+        }
+
+    async def _image_exists(self, img):
+        try:
+            await self.client.get_json('/images/%s/json' % (quote(img, safe='/:@'),))
+        except DockerAPIError as err:
+            if err.status == 404:
+                return False
+            raise
+        return True
+
+    async def _pull_image(self, img, steps, observer):
+        step = steps[0]
+        for step_ in steps:
+            observer.step_running(step_)
+        observer.manager_msg(step, "Downloading image {}".format(img))
+        image, tag = parse_repository_tag(img)
+        params = {'fromImage': image}
+        if tag is not None:
+            params['tag'] = tag
+        layers = {}
+        lines = LineDecoder()
+        errors = []
+
+        def on_data(data):
+            for line in lines.decode(data).splitlines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if 'error' in event:
+                    errors.append(event['error'])
+                    continue
+                text = format_pull_progress(event, layers)
+                if text:
+                    observer.manager_msg(step, text)
+
+        with observer.measure(step, 'pull'):
+            try:
+                await self.client.request('POST', '/images/create', params,
+                    on_data=on_data)
+            except (DockerAPIError, OSError, ValueError) as err:
+                errors.append("%s %s" % (err.__class__.__name__, err))
+        for step_ in steps:
+            if errors:
+                observer.step_failed(step_)
+            else:
+                observer.step_succeeded(step_)
+        return errors[0] if errors else None
+
+    async def prepare(self, task, observer):
+        images = OrderedDict()
+        for step in task.steps:
+            observer.step_preflight(step)
+            images.setdefault(step.img, []).append(step)
+
+        async def lookup(img):
+            with observer.measure(images[img][0], 'image lookup'):
+                return await self._image_exists(img)
+
+        try:
+            found = await asyncio.gather(*[lookup(img) for img in images])
+        except (DockerAPIError, OSError) as err:
+            step = task.steps[0]
+            observer.step_failed(step)
+            return BuildResult(-1, "%s %s" % (err.__class__.__name__, err), step)
+        missing = []
+        for (img, steps), exists in zip(images.items(), found):
+            if exists:
+                for step in steps:
+                    observer.step_succeeded(step)
+            else:
+                missing.append(img)
+
+        # pull all missing images concurrently
+        errors = await asyncio.gather(*[self._pull_image(img, images[img], observer)
+            for img in missing])
+        errors = {img: error for img, error in zip(missing, errors) if error}
+        for step in task.steps:
+            if step.img in errors:
+                return BuildResult(-1, errors[step.img], step)
+        return BuildResult()
+
+    async def _follow(self, container, step, observer, measure):
+        demuxer = StreamDemuxer()
+
+        with measure('logs'), LogBuffer(partial(observer.container_msg, step)) as logs:
+            def on_data(data):
+                for _stream, payload in demuxer.feed(data):
+                    logs.feed(payload)
+
+            await self.client.request('GET', '/containers/%s/logs' % (container,),
+                {'follow': 1, 'stdout': 1, 'stderr': 1}, on_data=on_data)
+        with measure('wait'):
+            try:
+                return await asyncio.wait_for(
+                    self.client.post_json('/containers/%s/wait' % (container,)),
+                    self.wait_timeout)
+            except asyncio.TimeoutError:
+                # returned, so it is not taken for the step timeout
+                return None
+
+    async def build_step(self, task, step, observer):
+        client = self.client
+        observer.step_pending(step)
+        observer.manager_msg(step, "Starting container {}:".format(step.img))
+        measure = partial(observer.measure, step)
+        timeout = step.timeout or self.step_timeout
+        try:
+            with measure('create'):
+                container = (await client.post_json('/containers/create',
+                    self._create_body(task, step)))['Id']
+            try:
+                with measure('start'):
+                    await client.request('POST', '/containers/%s/start' % (container,))
+                observer.step_running(step)
+                try:
+                    ret = await asyncio.wait_for(
+                        self._follow(container, step, observer, measure), timeout)
+                except asyncio.TimeoutError:
+                    observer.step_failed(step)
+                    return BuildResult(-1, _("The step was stopped after the timeout "
+                        "of {} seconds").format(timeout), step)
+                if ret is None:
+                    observer.step_failed(step)
+                    return BuildResult(-1, _("The exit code of the container "
+                        "was not received in {} seconds").format(self.wait_timeout), step)
+            finally:
+                with measure('remove'):
+                    try:
+                        await client.request('DELETE', '/containers/%s' % (container,),
+                            {'force': 1})
+                    except (DockerAPIError, OSError) as err:
+                        logger.warning("Failed to stop container %s: %s", container, err)
+        except (DockerAPIError, OSError) as err:
+            observer.step_failed(step)
+            return BuildResult(-1, "%s %s" % (err.__class__.__name__, err), step)
+        except asyncio.CancelledError:
+            observer.step_cancelled(step)
+            raise
+        code = ret.get('StatusCode')
+        error = ret.get('Error')
+        if isinstance(error, dict):
+            error = error.get('Message')
+        if code or error:
+            observer.step_failed(step)
+            return BuildResult(code, error or None, step)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+    async def get_image_id(self, step):
+        try:
+            image = await self.client.get_json('/images/%s/json' % (quote(step.img, safe='/:@'),))
+        except (DockerAPIError, OSError):
+            return None
+        return image.get('Id')
+
+    async def verify(self):
+        try:
+            await self.client.request('GET', '/_ping')
+        except Exception as e:
+            return "{}: {}".format(e.__class__.__name__, e)
+
+    async def cleanup(self, force=False):
+        containers = await self.client.get_json('/containers/json', {
+            'all': 1, 'filters': json.dumps({'label': [self.LABEL_PREFIX]})})
+        if not force:
+            now = str(datetime.now())
+            expire_label = self.LABEL_PREFIX + '.expire'
+            containers = [c for c in containers
+                if now > (c.get('Labels') or {}).get(expire_label, now)]
+        await asyncio.gather(*[self.client.request('DELETE',
+            '/containers/%s' % (c['Id'],), {'force': 1}) for c in containers])
+
+    async def version_info(self):
+        version = await self.client.get_json('/version')
+        out = ["Docker Engine:"]
+        for key in ('Version', 'ApiVersion', 'MinAPIVersion', 'GoVersion',
+                'GitCommit', 'Os', 'Arch', 'KernelVersion'):
+            if key in version:
+                out.append("  {}: {}".format(key, version[key]))
+        return '\n'.join(out)
+
+
+class DockerAsyncBackend(SyncBackend):
+    """AsyncDockerBackend for the blocking Backend interface"""
+    name = 'docker'
+    async_backend_class = AsyncDockerBackend
+    debug_hint = AsyncDockerBackend.debug_hint
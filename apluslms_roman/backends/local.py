@@ -0,0 +1,135 @@
+import logging
+import os
+import platform
+import shlex
+import signal
+import subprocess
+from functools import partial
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from ..utils.env import to_str
+from ..utils.logs import LogBuffer
+from ..utils.scheduler import Deadlines
+from ..utils.translation import _
+from . import Backend, BuildResult
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend(Backend):
+    """
+    Runs the step commands as processes on this machine, with the tools
+    installed here instead of the step images. Steps with `mnt` run in the
+    project directory. Other steps run in a temporary directory with the
+    links `src` to the project and `build` to its _build directory, like the
+    WORK_PATH of a container. The source is not made read-only.
+    """
+    name = 'local'
+    debug_hint = _("""The local backend runs the step commands directly, so the
+commands and the tools they use must be installed on this machine.""")
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self._deadlines = Deadlines('local timeouts')
+
+    def prepare(self, task, observer):
+        for step in task.steps:
+            observer.step_preflight(step)
+        for step in task.steps:
+            if step.cmd is None:
+                observer.step_failed(step)
+                return BuildResult(-1, _("Step {} has no cmd. The local backend "
+                    "can't run the default command of the image {}.")
+                    .format(step, step.img), step)
+            observer.step_succeeded(step)
+        return BuildResult()
+
+    def _get_env(self, step):
+        env = dict(os.environ)
+        for key, value in (step.env or {}).items():
+            # lists and mappings are passed as JSON, like in the expansions
+            value = to_str(value)
+            if value is None:
+                env.pop(key, None)
+            else:
+                env[key] = value
+        return env
+
+    def _kill(self, process):
+        try:
+            if hasattr(os, 'killpg'):
+                # the step commands may have started processes of their own
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass
+
+    def _run(self, task, step, cwd, observer, timed_out):
+        cmd = step.cmd
+        args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        with observer.measure(step, 'start'):
+            process = subprocess.Popen(args, cwd=cwd, env=self._get_env(step),
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, start_new_session=hasattr(os, 'killpg'))
+        observer.step_running(step)
+        timeout = None
+        if step.timeout:
+            timeout = self._deadlines.add(step.timeout, partial(self._kill, process))
+        try:
+            with observer.measure(step, 'run'), \
+                    self.stoppable(task, partial(self._kill, process)), \
+                    LogBuffer(partial(observer.container_msg, step)) as logs:
+                fd = process.stdout.fileno()
+                while True:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        break
+                    logs.feed(data)
+                return process.wait()
+        except BaseException:
+            self._kill(process)
+            process.wait()
+            raise
+        finally:
+            if timeout is not None and not self._deadlines.cancel(timeout):
+                timed_out.append(step.timeout)
+            process.stdout.close()
+
+    def build_step(self, task, step, observer):
+        observer.step_pending(step)
+        observer.manager_msg(step, "Running locally: {}".format(
+            step.cmd if isinstance(step.cmd, str) else ' '.join(map(shlex.quote, step.cmd))))
+        timed_out = []
+        try:
+            if step.mnt:
+                code = self._run(task, step, task.path, observer, timed_out)
+            else:
+                with TemporaryDirectory(prefix='roman-') as work:
+                    os.symlink(task.path, join(work, 'src'))
+                    os.symlink(join(task.path, '_build'), join(work, 'build'))
+                    code = self._run(task, step, work, observer, timed_out)
+        except OSError as err:
+            observer.step_failed(step)
+            return BuildResult(-1, "%s %s" % (err.__class__.__name__, err), step)
+        except KeyboardInterrupt:
+            observer.step_cancelled(step)
+            raise
+        if timed_out:
+            observer.step_failed(step)
+            return BuildResult(-1, _("The step was stopped after the timeout "
+                "of {} seconds").format(timed_out[0]), step)
+        if code:
+            observer.step_failed(step)
+            return BuildResult(code, None, step)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+    def verify(self):
+        return None
+
+    def version_info(self):
+        return "Local processes:\n  Platform: {}\n  Python: {}".format(
+            platform.platform(), platform.python_version())
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from itertools import chain
+from os import makedirs, walk
+from os.path import abspath, basename, join
+from time import monotonic
+
+from apluslms_yamlidator.validator import ValidationError, render_error
+
+from .backends import BuildResult, BuildTask
+from .configuration import ProjectConfig, ProjectConfigError
+from .observer import StepState, StreamObserver
+from .utils.env import EnvDict, EnvError
+from .utils.scheduler import StepGraphError
+from .utils.translation import _
+
+
+def find_projects(root):
+    """Yields directories under `root`, which contain a project configuration"""
+    for dir_, dirs, files in walk(root):
+        try:
+            ProjectConfig.find_file(dir_)
+        except (FileNotFoundError, ProjectConfigError):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '_')))
+        else:
+            dirs[:] = []
+            yield dir_
+
+
+def read_project_list(path):
+    """Reads project directories from a file, one per line. # starts a comment."""
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+
+class ProjectResult:
+    __slots__ = ('path', 'result', 'error', 'duration', 'log')
+
+    def __init__(self, path, result=None, error=None, duration=0.0, log=None):
+        self.path = path
+        self.result = result
+        self.error = error
+        self.duration = duration
+        self.log = log
+
+    @property
+    def ok(self):
+        return self.error is None and self.result is not None and self.result.ok
+
+    def __str__(self):
+        if self.error is not None:
+            return "Error: {}".format(self.error.splitlines()[0] if self.error else '')
+        return str(self.result)
+
+
+class BatchBuilder:
+    """
+    Builds many projects with one engine. Images for all projects are
+    prepared once before the builds and then up to `workers` projects are
+    built at the same time.
+    """
+    def __init__(self, engine, paths, environment=None, workers=1,
+            clean_build=False, use_cache=None, log_dir=None, observer=None,
+            history=None):
+        self.engine = engine
+        self.paths = [abspath(path) for path in paths]
+        self.environment = environment or []
+        self.workers = workers
+        self.clean_build = clean_build
+        self.use_cache = use_cache
+        self.log_dir = log_dir
+        self.observer = observer or StreamObserver()
+        self.history = history
+
+    def load(self, path):
+        try:
+            return ProjectConfig.find_from(path, cached=True), None
+        except ValidationError as err:
+            return None, '\n'.join(render_error(err))
+        except (OSError, ProjectConfigError) as err:
+            return None, str(err)
+
+    def get_builder(self, config, observer):
+        environment = EnvDict(
+            (self.environment, 'global settings'),
+            (config.mlget('environment', []), 'project configuration'),
+        )
+        return self.engine.create_builder(config, observer=observer,
+            environment=environment, history=self.history)
+
+    def prepare(self, steps):
+        """
+        Prepares the distinct images of all projects. Returns the BuildResult
+        and a set of the images, which weren't prepared.
+        """
+        images = {}
+        for step in steps:
+            images.setdefault(step.img, step)
+        observer = self.observer
+        observer.enter_prepare()
+        task = BuildTask(None, list(images.values()), 1, None)
+        result = self.engine.backend.prepare(task, observer)
+        observer.result_msg(result)
+        if result.ok:
+            return result, set()
+        # backends may stop at the first failure, so unfinished steps fail too
+        failed = {step.img for step in task.steps
+            if observer.get_step_state(step) != StepState.SUCCEEDED}
+        if result.step is not None:
+            failed.add(result.step.img)
+        return result, failed
+
+    def _log_stream(self, path):
+        if self.log_dir:
+            makedirs(self.log_dir, exist_ok=True)
+            name = path.strip('/').replace('/', '_') or basename(path)
+            return open(join(self.log_dir, name + '.log'), 'w')
+        return StringIO()
+
+    def build_project(self, path, config):
+        start = monotonic()
+        stream = self._log_stream(path)
+        builder = self.get_builder(config, StreamObserver(stream))
+        try:
+            result = builder.build(clean_build=self.clean_build,
+                use_cache=self.use_cache, prepare=False)
+        except EnvError as err:
+            return ProjectResult(path, error=str(err), duration=monotonic() - start)
+        except Exception as err:
+            # one broken project must not stop the others
+            return ProjectResult(path, error="%s %s" % (err.__class__.__name__, err),
+                duration=monotonic() - start)
+        finally:
+            log = stream.getvalue() if isinstance(stream, StringIO) else None
+            stream.close()
+        return ProjectResult(path, result, duration=monotonic() - start, log=log)
+
+    def build(self):
+        """Returns ProjectResult for each project in the order of paths"""
+        results = {}
+        projects = {}
+        for path in self.paths:
+            config, error = self.load(path)
+            if error is None:
+                try:
+                    steps = self.get_builder(config, self.observer).get_steps()
+                except (KeyError, IndexError) as err:
+                    error = _("Invalid step reference {}").format(err.args[0])
+                except (EnvError, StepGraphError) as err:
+                    error = str(err)
+            if error is not None:
+                results[path] = ProjectResult(path, error=error)
+            elif not steps:
+                results[path] = ProjectResult(path, BuildResult())
+            else:
+                projects[path] = (config, steps)
+
+        if projects:
+            result, failed = self.prepare(chain.from_iterable(
+                steps for _config, steps in projects.values()))
+            if not result.ok:
+                # projects using other images can still be built
+                for path, (_config, steps) in list(projects.items()):
+                    images = [step.img for step in steps if step.img in failed]
+                    if result.step is not None and result.step.img in images:
+                        error = str(result)
+                    elif images:
+                        error = _("Image {} couldn't be prepared").format(images[0])
+                    else:
+                        continue
+                    results[path] = ProjectResult(path, error=error)
+                    del projects[path]
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = {path: executor.submit(self.build_project, path, config)
+                for path, (config, _steps) in projects.items()}
+            for path, future in futures.items():
+                results[path] = future.result()
+        return [results[path] for path in self.paths]
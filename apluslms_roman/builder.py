@@ -1,59 +1,231 @@
+import logging
 from os import environ, getuid, getegid, mkdir
-from os.path import isdir
+from os.path import isdir, join, relpath
 from shutil import rmtree
+from threading import Lock
+from time import time
 
 from apluslms_yamlidator.utils.decorator import cached_property
 from apluslms_yamlidator.utils.collections import OrderedDict
+from apluslms_yamlidator.validator import ValidationError, render_error
 
-from .backends import BACKENDS, BuildTask, BuildStep, Environment
+from .backends import BACKENDS, BuildResult, BuildTask, BuildStep, Environment
+from .configuration import ProjectConfigError
 from .observer import StreamObserver
+from .utils.env import EnvDict
 from .utils.importing import import_string
+from .utils.scheduler import StepGraph
+from .utils.timing import clock
+from .utils.trace import tracer
 from .utils.translation import _
 
+
+logger = logging.getLogger(__name__)
+
+
 class Builder:
-    def __init__(self, engine, config, observer=None, environment=None):
+    def __init__(self, engine, config, observer=None, environment=None,
+            history=None):
         if not isdir(config.dir):
             raise ValueError(_("config.dir isn't a directory."))
         self.config = config
         self.path = config.dir
         self._engine = engine
         self._observer = observer or StreamObserver()
-        self._environment = environment or []
+        self._environment = environment if environment is not None else []
+        self._history = history
+        self._lock = Lock()
+        self._task = None
+        self._cancelled = False
 
 
     def get_steps(self, refs: list = None):
-        steps = [BuildStep.from_config(i, step, self._environment)
-            for i, step in enumerate(self.config.steps)]
-        if refs:
-            name_dict = {step.name: step for step in steps}
-            refs = [int(ref) if ref.isdigit() else ref.lower() for ref in refs]
+        environment = self._environment
+        if not isinstance(environment, EnvDict):
+            environment = EnvDict((environment, "project configuration"))
+        with tracer.span('expand environment'):
+            steps = [BuildStep.from_config(i, step, environment)
+                for i, step in enumerate(self.config.steps)]
+        name_dict = {step.name.lower(): step for step in steps if step.name}
+
+        def get_step(ref):
+            if isinstance(ref, str):
+                ref = int(ref) if ref.isdigit() else ref.lower()
             # NOTE: May raise KeyError or IndexError
-            steps = [steps[ref] if isinstance(ref, int) else name_dict[ref] for ref in refs]
+            return steps[ref] if isinstance(ref, int) else name_dict[ref]
+
+        for step in steps:
+            if step.depends_on is not None:
+                step.depends_on = tuple(get_step(ref).ref for ref in step.depends_on)
+        if refs:
+            steps = [get_step(ref) for ref in refs]
             steps = list(OrderedDict.fromkeys(steps))
+        StepGraph(steps) # NOTE: may raise StepGraphError
         return steps
 
-    def build(self, step_refs: list = None, clean_build=False):
+    def get_cache(self, use_cache=None):
+        options = self.config.get('cache', {})
+        if use_cache is None:
+            use_cache = options.get('enabled', False)
+        if not use_cache:
+            return None
+        from .cache import DEFAULT_MAX_BYTES, StepCache
+        max_size = options.get('max_size')
+        return StepCache(ignore=options.get('ignore', ()),
+            max_bytes=float(max_size) * 1e6 if max_size is not None else DEFAULT_MAX_BYTES)
+
+    def build(self, step_refs: list = None, clean_build=False, workers=1,
+            use_cache=None, prepare=True, source_writes=None):
         backend = self._engine.backend
         observer = self._observer
         steps = self.get_steps(step_refs) # NOTE: may raise KeyError or IndexError
 
-        task = BuildTask(self.path, steps)
-        observer.enter_prepare()
-        result = backend.prepare(task, observer)
-        observer.result_msg(result)
+        task = BuildTask(self.path, steps, workers, self.get_cache(use_cache),
+            source_writes)
+        with self._lock:
+            self._cancelled = False
+        if self._history is not None:
+            observer.set_expected(self.get_expected_durations(steps))
+        started, start = time(), clock()
+        if prepare:
+            observer.enter_prepare()
+            result = backend.prepare(task, observer)
+            observer.result_msg(result)
+        else:
+            result = BuildResult()
         if result.ok:
             observer.enter_build()
             # FIXME: add support for other build paths
+            build_path = join(self.path, '_build')
             if clean_build:
-                if isdir('_build'):
-                    rmtree('_build')
-            if clean_build or not isdir('_build'):
-                mkdir('_build')
-            result = backend.build(task, observer)
+                if isdir(build_path):
+                    rmtree(build_path)
+            if clean_build or not isdir(build_path):
+                mkdir(build_path)
+            with self._lock:
+                if self._cancelled:
+                    raise KeyboardInterrupt
+                self._task = task
+            try:
+                result = backend.build(task, observer)
+            finally:
+                with self._lock:
+                    self._task = None
             observer.result_msg(result)
         observer.done(result)
+        result.timings = observer.timings
+        if self._history is not None:
+            self.record_history(steps, result, started, clock() - start)
         return result
 
+    def cancel(self):
+        """
+        Stops the running build from another thread. The build raises
+        KeyboardInterrupt, like when it is interrupted.
+        """
+        with self._lock:
+            self._cancelled = True
+            task = self._task
+        if task is not None:
+            self._engine.backend.cancel(task)
+
+    def get_expected_durations(self, steps):
+        """Returns the expected durations of the steps from the build history"""
+        try:
+            durations = self._history.expected_durations(self.path)
+        except self._history.errors as err:
+            logger.warning(_("Unable to read the build history %s: %s"),
+                self._history.path, err)
+            return {}
+        return {step: durations[str(step)] for step in steps
+            if str(step) in durations}
+
+    def record_history(self, steps, result, started, duration):
+        observer = self._observer
+        images = {}
+        digests = {}
+        for step in steps:
+            if step in observer.states:
+                if step.img not in images:
+                    images[step.img] = self._engine.backend.get_image_id(step)
+                digests[step] = images[step.img]
+        try:
+            self._history.record(self.path, steps, result, started, duration,
+                states=observer.states, log_bytes=observer.log_bytes,
+                digests=digests)
+        except self._history.errors as err:
+            logger.warning(_("Unable to record the build to the history %s: %s"),
+                self._history.path, err)
+
+    def get_changed_steps(self, steps, changes):
+        """
+        Returns the steps, which inputs match any of the changed paths, and
+        the steps depending on those.
+        """
+        graph = StepGraph(steps)
+        changed = set()
+        for step in graph:
+            if (any(dep in changed for dep in graph.dependencies[step])
+                    or any(step.uses_input(path) for path in changes)):
+                changed.add(step)
+        return [step for step in steps if step in changed]
+
+    def reload_config(self):
+        try:
+            config = self.config.load(self.config.path)
+        except ValidationError as err:
+            logger.error("%s", '\n'.join(render_error(err)))
+            return False
+        except ProjectConfigError as err:
+            logger.error(_("Invalid project configuration: %s"), err)
+            return False
+        self.config = config
+        env = self._environment
+        if isinstance(env, EnvDict) and 'project configuration' in env.envs:
+            env.add_env(config.get('environment', []), 'project configuration')
+        return True
+
+    def watch(self, step_refs: list = None, clean_build=False, workers=1,
+            use_cache=None, watcher=None, delay=0.5):
+        """
+        Builds the project and then rebuilds the steps affected by changes
+        in the project directory, until interrupted. Changes to the project
+        configuration reload it and rebuild all steps. Files written by the
+        steps with `mnt` during a build don't cause a rebuild, but other
+        changes made during a build do.
+        Yields BuildResult after each build.
+        """
+        if step_refs is not None:
+            step_refs = list(step_refs)
+        from .utils.watch import ALL_CHANGED, get_edits, get_watcher, iter_changes
+        if watcher is None:
+            watcher = get_watcher(self.path)
+        config_file = relpath(self.config.path, self.path)
+        with watcher:
+            refs = step_refs
+            while True:
+                before = watcher.scan()
+                writes = []
+                yield self.build(refs, clean_build, workers, use_cache,
+                    source_writes=writes)
+                clean_build = False
+                watcher.reset()
+                changes = get_edits(before, watcher.scan(), writes)
+                while True:
+                    if not changes:
+                        changes = next(iter_changes(watcher, delay))
+                    logger.debug("Changed files: %s", ', '.join(sorted(changes)))
+                    if config_file in changes or ALL_CHANGED in changes:
+                        if self.reload_config():
+                            refs = step_refs
+                            break
+                    else:
+                        steps = self.get_changed_steps(self.get_steps(step_refs), changes)
+                        if steps:
+                            refs = [str(step.ref) for step in steps]
+                            break
+                    changes = None
+
 
 class Engine:
     def __init__(self, backend_class=None, settings=None):
@@ -0,0 +1,201 @@
+import logging
+import tarfile
+from fnmatch import fnmatch
+from functools import partial
+from hashlib import sha1
+from json import dumps as to_json
+from os import lstat, readlink, remove, utime, walk
+from os.path import getmtime, getsize, isdir, isfile, islink, join, normpath, relpath
+from stat import S_ISLNK
+
+from apluslms_yamlidator.utils.files import atomic_write
+
+from . import CACHE_DIR
+from .utils.translation import _
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IGNORE = ('_build', '.git', '.hg', '.svn', '__pycache__')
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def hash_file(path):
+    digest = sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, 1 << 16), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def iter_tree(path, ignore=()):
+    """
+    Yields (relative path, full path) of the files under `path` in a stable
+    order. Entries matching any of the glob patterns in `ignore` are skipped.
+    A pattern is matched against the relative path and the base name.
+    """
+    def ignored(rel, name):
+        return any(fnmatch(rel, p) or fnmatch(name, p) for p in ignore)
+
+    for root, dirs, files in walk(path):
+        base = relpath(root, path)
+        dirs[:] = sorted(d for d in dirs
+            if not ignored(normpath(join(base, d)), d))
+        for name in sorted(files):
+            rel = normpath(join(base, name))
+            if not ignored(rel, name):
+                yield rel, join(root, name)
+
+
+def hash_tree(path, ignore=()):
+    """Returns a hex digest of file names and contents under `path`"""
+    digest = sha1()
+    for rel, full in iter_tree(path, ignore):
+        digest.update(rel.encode('utf-8', 'surrogateescape') + b'\0')
+        if islink(full):
+            digest.update(b'L' + readlink(full).encode('utf-8', 'surrogateescape'))
+        else:
+            digest.update(b'F' + hash_file(full))
+    return digest.hexdigest()
+
+
+def tree_state(path, ignore=()):
+    """Returns the names, sizes and mtimes of the files hashed by hash_tree()"""
+    state = []
+    for rel, full in iter_tree(path, ignore):
+        try:
+            st = lstat(full)
+        except OSError:
+            # removed while walking
+            continue
+        state.append((rel, st.st_size, st.st_mtime_ns))
+    return tuple(state)
+
+
+def snapshot(path):
+    """
+    Returns the state of the files and links under `path`: a dict from the
+    relative paths to (size, mtime, link target) tuples.
+    """
+    files = {}
+    for root, dirs, names in walk(path):
+        for name in names + [d for d in dirs if islink(join(root, d))]:
+            full = join(root, name)
+            try:
+                st = lstat(full)
+                target = readlink(full) if S_ISLNK(st.st_mode) else None
+            except OSError:
+                # removed while walking
+                continue
+            files[relpath(full, path)] = (st.st_size, st.st_mtime_ns, target)
+    return files
+
+
+class StepCache:
+    """
+    Content addressed cache for the files a step writes to the build directory.
+
+    A key covers the image, the command, the environment, the source tree and
+    the keys of the steps the step depends on. The outputs of a step are the
+    files added or changed compared to a snapshot() taken before the step. On
+    a hit, they are extracted to the build directory. Files removed by a step
+    are not removed on a hit. The least recently used entries are removed,
+    when the cache takes more than `max_bytes`.
+    """
+    def __init__(self, path=None, ignore=(), max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or join(CACHE_DIR, 'steps')
+        self.ignore = DEFAULT_IGNORE + tuple(ignore)
+        self.max_bytes = max_bytes
+        self._source_hashes = {}
+
+    def source_hash(self, path):
+        # steps with a mount may change the sources during a build, so the
+        # hash is reused only while the files are unchanged
+        state = tree_state(path, self.ignore)
+        cached = self._source_hashes.get(path)
+        if cached is None or cached[0] != state:
+            logger.debug("Hashing the source tree %s", path)
+            cached = self._source_hashes[path] = (state, hash_tree(path, self.ignore))
+        return cached[1]
+
+    def get_key(self, step, image_id, source_path, dependency_keys=()):
+        data = {
+            'img': image_id,
+            'cmd': step.cmd,
+            'env': step.env,
+            'src': self.source_hash(source_path),
+            'deps': list(dependency_keys),
+        }
+        return sha1(to_json(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _archive(self, key):
+        return join(self.path, key[:2], key + '.tar.gz')
+
+    def __contains__(self, key):
+        return isfile(self._archive(key))
+
+    def restore(self, key, build_path):
+        archive = self._archive(key)
+        if not isfile(archive):
+            return False
+        logger.debug("Restoring %s from %s", build_path, archive)
+        try:
+            with tarfile.open(archive, 'r:gz') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(build_path, filter='data')
+                else:
+                    tar.extractall(build_path)
+        except (OSError, tarfile.TarError) as err:
+            logger.warning(_("Failed to restore cached step %s: %s"), key, err)
+            return False
+        try:
+            # the modification time orders the entries for prune()
+            utime(archive)
+        except OSError:
+            pass
+        return True
+
+    def snapshot(self, build_path):
+        return snapshot(build_path) if isdir(build_path) else {}
+
+    def store(self, key, build_path, before):
+        """Stores the files changed since the snapshot `before`"""
+        if not isdir(build_path):
+            return
+        after = snapshot(build_path)
+        outputs = sorted(name for name, state in after.items()
+            if before.get(name) != state)
+        archive = self._archive(key)
+        try:
+            with atomic_write(archive, 'wb') as tmp, \
+                    tarfile.open(fileobj=tmp, mode='w:gz') as tar:
+                for name in outputs:
+                    tar.add(join(build_path, name), arcname=name, recursive=False)
+        except (OSError, tarfile.TarError) as err:
+            logger.warning(_("Failed to store step %s to the cache: %s"), key, err)
+        else:
+            logger.debug("Stored %d files of %s to %s", len(outputs), build_path, archive)
+            self.prune()
+
+    def prune(self):
+        """Removes the least recently used entries over `max_bytes`"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for root, _dirs, names in walk(self.path):
+            for name in names:
+                if name.endswith('.tar.gz'):
+                    full = join(root, name)
+                    try:
+                        entries.append((getmtime(full), getsize(full), full))
+                    except OSError:
+                        pass
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -1,24 +1,33 @@
 import argparse
+import json
 import logging
+import re
 from collections import namedtuple
 from functools import partial
 from glob import glob
 from itertools import chain
 from os import chdir, getcwd
-from os.path import abspath, expanduser, expandvars, join as path_join
+from os.path import abspath, dirname, expanduser, expandvars, join as path_join
 from sys import exit as _exit, stderr, stdout
-
-from apluslms_yamlidator.document import Document
-from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
-from apluslms_yamlidator.validator import ValidationError, render_error
-
-from . import __version__
-from .builder import Engine
-from .configuration import ProjectConfig, ProjectConfigError
-from .settings import GlobalSettings
+from time import localtime, strftime, time
+
+from . import DAEMON_SOCKET, __version__
+from .observer import (
+    FanOutObserver,
+    JsonLinesObserver,
+    ObserverSink,
+    Overflow,
+    StreamObserver,
+)
 from .utils.env import EnvDict, EnvError
+from .utils.scheduler import StepGraphError
+from .utils.timing import format_duration, format_timings
+from .utils.trace import tracer
 from .utils.translation import _
 
+# NOTE: the subsystems (builder, daemon, history, yaml, schemas, ...) are
+# imported in the actions using them, so e.g. 'roman --version' starts fast
+
 
 LOG_LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
 logger = logging.getLogger(__name__)
@@ -152,6 +161,8 @@ def configure_logging():
 
 def create_parser(version=__version__,
                   **kwargs):
+    from .settings import GlobalSettings
+
     # the parser
     kwargs.setdefault('description', _("A project material builder"))
     #parser = argparse.ArgumentParser(**kwargs)
@@ -195,7 +206,23 @@ def create_parser(version=__version__,
     return parser
 
 
+def print_version(args=None, version=__version__):
+    """
+    Prints the version and exits, if it is asked. The full parser reads the
+    settings schema, so this is checked first with a parser of its own.
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument('-V', '--version',
+        action='version',
+        version="%%(prog)s %s" % (version,))
+    parser.parse_known_args(args=args)
+
+
 def parse_actioncontext(parser, *, args=None):
+    from apluslms_yamlidator.remote import remote_schemas
+    from apluslms_yamlidator.validator import ValidationError, render_error
+    from .settings import GlobalSettings
+
     args = parser.parse_args(args=args)
 
     # set logging level
@@ -227,6 +254,7 @@ def parse_actioncontext(parser, *, args=None):
         warning(_("File {} doesn't exist.").format(args.config))
 
     settings.update_from_namespace(args)
+    remote_schemas.configure(**settings.get('schemas', {}))
 
     # post process rest of the args
     if args.steps and any(step == '?' for step in args.steps):
@@ -238,6 +266,8 @@ def parse_actioncontext(parser, *, args=None):
 # parser configuration for roman cli
 
 def add_cli_actions(parser):
+    from .history import PERIODS
+
     def add_env_args(env):
         env.add_argument('-d', '--delete', action='append',
             help=_("delete value from environment"))
@@ -269,12 +299,122 @@ def add_cli_actions(parser):
     build.add_argument('-s', '--steps', nargs='+',
         help=_("select which steps to build and in which "
             "order (use either index or step name)"))
+    build.add_argument('-j', '--jobs', type=int, default=1, metavar=_('N'),
+        help=_("run up to N independent steps at the same time"))
+    build.add_argument('--cache', action='store_true', default=None,
+        help=_("reuse results of steps, which inputs have not changed"))
+    build.add_argument('--no-cache', action='store_false', dest='cache',
+        help=_("run all steps even if the step cache is enabled in "
+            "the project configuration"))
+    build.add_argument('-w', '--watch', action='store_true',
+        help=_("keep rebuilding the steps affected by changed files "
+            "until interrupted"))
+    build.add_argument('--timings', action='store_true',
+        help=_("print how long each phase, step and stage of a step took"))
+    build.add_argument('--trace', metavar=_('FILE'),
+        help=_("write a timeline of the build to FILE in the Chrome trace "
+            "format (open in chrome://tracing or Perfetto)"))
+    build.add_argument('--no-history', action='store_false', dest='history',
+        help=_("don't record the build to the build history"))
+    build.add_argument('--no-logs', action='store_false', dest='logs',
+        help=_("don't store the container output for 'roman logs'"))
+    build.add_argument('--output-format', choices=('text', 'jsonl'), default='text',
+        help=_("print the build as text or as JSON objects, one per line "
+            "(default: %(default)s)"))
+    build.add_argument('--output-overflow', default=Overflow.BLOCK.value,
+        choices=[policy.value for policy in Overflow], metavar=_('POLICY'),
+        help=_("what to do with container output, when the terminal can't "
+            "keep up: block the build, drop the oldest lines or summarize "
+            "the dropped lines (block, drop or summarize, default: %(default)s)"))
+    build.add_argument('--daemon', nargs='?', const=DAEMON_SOCKET,
+        metavar=_('SOCKET'),
+        help=_("send the build to a running roman daemon "
+            "(default socket: %(const)s)"))
 
     # build is the default callback. set defaults for it
     build.copy_defaults_to(parser)
     parser.set_callback(build_action)
 
 
+    build_all = parser.add_parser('build-all',
+        callback=build_all_action,
+        help=_("build many projects found under directories or "
+            "listed in a file"))
+    build_all.add_argument('paths', metavar='DIR', nargs='*',
+        help=_("directories to search for projects "
+            "(default: the current directory)"))
+    build_all.add_argument('-l', '--list', dest='project_list',
+        metavar=_('FILE'),
+        help=_("read project directories from FILE, one per line"))
+    build_all.add_argument('-j', '--jobs', type=int, default=1, metavar=_('N'),
+        help=_("build up to N projects at the same time"))
+    build_all.add_argument('--clean', action='store_true',
+        help=_("delete old build files before building"))
+    build_all.add_argument('--cache', action='store_true', default=None,
+        help=_("reuse results of steps, which inputs have not changed"))
+    build_all.add_argument('--no-cache', action='store_false', dest='cache',
+        help=_("run all steps even if the step cache is enabled"))
+    build_all.add_argument('--log-dir', metavar=_('DIR'),
+        help=_("write the output of each project to a file in DIR"))
+
+
+    history = parser.add_parser('history',
+        callback=history_builds_action,
+        help=_("show past builds and step durations"))
+    history.add_argument('-a', '--all', action='store_true', dest='all_projects',
+        help=_("include all projects instead of the current one"))
+    history.add_argument('--days', type=float, metavar=_('N'),
+        help=_("only include builds from the last N days"))
+    history.add_argument('-n', '--limit', type=int, metavar=_('N'),
+        help=_("list at most N builds or steps"))
+
+    with history.use_subparsers(title=_("History actions")):
+        history.add_parser('builds', aliases=['ls'],
+            callback=history_builds_action,
+            help=_("list the latest builds (default action)"))
+        history.add_parser('slowest',
+            callback=history_slowest_action,
+            help=_("list the slowest step runs"))
+        stats = history.add_parser('stats',
+            callback=history_stats_action,
+            help=_("show the median and the 95th percentile duration "
+                "of each step"))
+        stats.add_argument('--by', choices=sorted(PERIODS), dest='period',
+            help=_("show the durations per day, week or month"))
+        history.add_parser('clear',
+            callback=history_clear_action,
+            help=_("delete the recorded builds"))
+
+
+    logs = parser.add_parser('logs',
+        callback=logs_action,
+        help=_("show the stored container output of builds"))
+    logs.add_argument('build', nargs='?', metavar=_('BUILD'),
+        help=_("the id of the build (default: the latest build of the project)"))
+    logs.add_argument('step', nargs='?', metavar=_('STEP'),
+        help=_("show only the output of the step"))
+    logs.add_argument('-l', '--list', action='store_true',
+        help=_("list the stored builds"))
+    logs.add_argument('-a', '--all', action='store_true', dest='all_projects',
+        help=_("include all projects instead of the current one"))
+    logs.add_argument('-n', '--tail', type=int, metavar=_('N'),
+        help=_("show the last N lines of each step"))
+    logs.add_argument('-g', '--grep', metavar=_('REGEX'),
+        help=_("show only the lines matching REGEX"))
+    logs.add_argument('--since', metavar=_('TIME'),
+        help=_("show only the output since TIME, which is relative "
+            "(e.g. 10m, 2h or 1d) or a local time (YYYY-MM-DD HH:MM)"))
+
+
+    daemon = parser.add_parser('daemon',
+        callback=daemon_action,
+        help=_("run a build server, which keeps the backend and "
+            "configurations loaded between builds"))
+    daemon.add_argument('-S', '--socket', default=DAEMON_SOCKET,
+        metavar=_('SOCKET'),
+        help=_("the Unix socket to listen on (default: %(default)s)"))
+
+
     parser.add_parser('init',
         callback=init_action,
         help=("create roman settings file in current directory"))
@@ -359,6 +499,15 @@ def add_cli_actions(parser):
             help=_("the name of a schema for validation"))
         validate_schema.add_argument('data_files', metavar='file', nargs='+',
             help=_("a YAML/JSON file(s) to be validated"))
+        validate_schema.add_argument('-j', '--jobs', type=int, default=1,
+            metavar=_('N'),
+            help=_("validate files in N processes at the same time"))
+        validate_schema.add_argument('--unordered', action='store_true',
+            help=_("print results as files are validated instead of "
+                "in the order of arguments"))
+        validate_schema.add_argument('--summary', metavar=_('FILE'),
+            help=_("write a JSON summary of the results to FILE "
+                "('-' for stdout)"))
 
     backend = parser.add_parser('backend',
         help=_("backend actions"))
@@ -387,6 +536,7 @@ def main(*, args=None):
     3. exit with the code from the action
     """
     configure_logging()
+    print_version(args)
     parser = create_parser()
     add_cli_actions(parser)
     context = parse_actioncontext(parser, args=args)
@@ -401,6 +551,7 @@ def main(*, args=None):
 # action utils
 
 def get_engine(context):
+    from .builder import Engine
     try:
         return Engine(settings=context.settings)
     except ImportError:
@@ -408,14 +559,39 @@ def get_engine(context):
             context.settings.get('backend', 'docker')))
 
 
-def get_config(context):
+def get_log_store(context):
+    from .logstore import DEFAULT_MAX_BYTES, DEFAULT_MAX_DAYS, LogStore
+    options = context.settings.get('logs', {})
+    max_size = options.get('max_size')
+    max_days = options.get('max_days')
+    return LogStore(
+        max_bytes=float(max_size) * 1e6 if max_size is not None else DEFAULT_MAX_BYTES,
+        max_days=float(max_days) if max_days is not None else DEFAULT_MAX_DAYS)
+
+
+def get_config_path(context):
+    from .configuration import ProjectConfig, ProjectConfigError
+    try:
+        if context.args.project_config:
+            return ProjectConfig.resolve_file(abspath(expanduser(
+                expandvars(context.args.project_config))))
+        return ProjectConfig.find_file(getcwd())
+    except FileNotFoundError as err:
+        exit(1, str(err))
+    except ProjectConfigError as e:
+        exit(1, _("Invalid project configuration: {}").format(e))
+
+
+def get_config(context, cached=False):
+    from apluslms_yamlidator.validator import ValidationError, render_error
+    from .configuration import ProjectConfig, ProjectConfigError
     try:
         if context.args.project_config:
             project_config = abspath(expanduser(
                 expandvars(context.args.project_config)))
-            return ProjectConfig.load_from(project_config)
+            return ProjectConfig.load_from(project_config, cached=cached)
         try:
-            return ProjectConfig.find_from(getcwd())
+            return ProjectConfig.find_from(getcwd(), cached=cached)
         except FileNotFoundError as err:
             exit(1, str(err) + _("\nYou can create a "
                 "configuration file with 'roman init'."))
@@ -436,6 +612,7 @@ def check_env(env):
 # TODO?: if file has been 'edited' but values haven't
 # changed, the outcome is 'file successfully edited'
 def report_save(output):
+    from apluslms_yamlidator.document import Document
     if output == Document.SaveOutput.NO_SAVE:
         print("No changes in the file.")
     elif output == Document.SaveOutput.SAVED_CHANGES:
@@ -444,7 +621,7 @@ def report_save(output):
         print("File created.")
 
 
-def verify_engine(engine, only_when_error=False):
+def verify_engine(engine, only_when_error=False, file=None):
     error = engine.verify()
     if error:
         print(_(
@@ -453,9 +630,9 @@ def verify_engine(engine, only_when_error=False):
                 engine.backend.__module__,
                 engine.backend.__class__.__name__,
                 error,
-        ))
+        ), file=file)
         if hasattr(engine.backend, 'debug_hint'):
-            print("\n" + engine.backend.debug_hint)
+            print("\n" + engine.backend.debug_hint, file=file)
         return False
     if not only_when_error:
         print(_(
@@ -542,19 +719,63 @@ def env_add(env, args):
 # actions
 
 def build_action(context):
-    config = get_config(context)
-    engine = get_engine(context)
-    builder = engine.create_builder(config,
-        environment=get_project_environment(context, config))
+    if context.args.daemon and not getattr(context.args, 'list_steps', False):
+        return daemon_build(context)
 
     if hasattr(context.args, 'list_steps') and context.args.list_steps:
         step_list_action(context)
         return 0
 
-    if not verify_engine(engine, only_when_error=True):
+    if context.args.trace:
+        tracer.start()
+        try:
+            return run_build(context)
+        finally:
+            try:
+                tracer.write(context.args.trace)
+            except OSError as err:
+                warning(_("Unable to write the trace to {}: {}")
+                    .format(context.args.trace, err))
+    return run_build(context)
+
+
+def run_build(context):
+    from .history import BuildHistory
+    from .logstore import LogObserver
+    with tracer.span('load config'):
+        config = get_config(context, cached=True)
+    engine = get_engine(context)
+    jsonl = context.args.output_format == 'jsonl'
+    output = JsonLinesObserver() if jsonl else StreamObserver()
+    observers = [output]
+    if context.args.logs:
+        # the log store must get all lines, so its queue never drops any
+        observers.append(ObserverSink(LogObserver(get_log_store(context), config.dir)))
+    observer = FanOutObserver(observers,
+        overflow=Overflow(context.args.output_overflow))
+    builder = engine.create_builder(config, observer=observer,
+        environment=get_project_environment(context, config),
+        history=BuildHistory() if context.args.history else None)
+
+    try:
+        return build_and_report(context, config, engine, builder, output if jsonl else None)
+    finally:
+        # stops the threads of the sinks, also on early returns
+        observer.close()
+
+
+def build_and_report(context, config, engine, builder, jsonl_output=None):
+    # with JSON Lines, stdout has only JSON objects and the details go to stderr
+    if not verify_engine(engine, only_when_error=True,
+            file=stderr if jsonl_output is not None else None):
+        if jsonl_output is not None:
+            jsonl_output.write_error(_("Container backend connection failed."))
         return 1
     if not config.steps:
-        print("Nothing to build.")
+        if jsonl_output is not None:
+            jsonl_output.write_error(_("Nothing to build."))
+        else:
+            print("Nothing to build.")
         return 1
 
     # build project
@@ -562,21 +783,332 @@ def build_action(context):
     if steps:
         steps = chain.from_iterable(step.split(',') for step in steps)
 
+    build_kwargs = dict(step_refs=steps, clean_build=context.args.clean,
+        workers=context.args.jobs, use_cache=context.args.cache)
     try:
-        result = builder.build(step_refs=steps, clean_build=context.args.clean)
+        if context.args.watch:
+            return watch_build(builder, timings=context.args.timings,
+                write_result=jsonl_output.write_result if jsonl_output else None,
+                **build_kwargs)
+        result = builder.build(**build_kwargs)
     except KeyError as err:
         exit(1, _("No step named {}.").format(err.args[0]))
     except IndexError as err:
         exit(1, _("Index {} is out of range. There are {} steps. Indexing "
             "begins at 0.").format(err.args[0], len(config.steps)))
     except EnvError as err:
+        exit(1, render_env_error(context, config, err))
+    except StepGraphError as err:
         exit(1, str(err))
 
+    if jsonl_output is not None:
+        jsonl_output.write_result(result)
+        return result.code
+    print(result)
+    if context.args.timings:
+        print_timings(result)
+    return result.code
+
+
+def print_timings(result):
+    if result.timings is None:
+        return
+    print()
+    print(_("Timings:"))
+    for line in format_timings(result.timings):
+        print("  " + line)
+
+
+def render_env_error(context, config, err):
+    """
+    Returns the message for an EnvError. A cached configuration has no line
+    info, so the full configuration is parsed again to point at the source.
+    """
+    if not getattr(config, 'cached', False):
+        return str(err)
+    from .builder import Builder
+    config = get_config(context)
+    try:
+        Builder(None, config,
+            environment=get_project_environment(context, config)).get_steps()
+    except EnvError as full_err:
+        return str(full_err)
+    except (KeyError, IndexError, StepGraphError):
+        pass
+    return str(err)
+
+
+def watch_build(builder, timings=False, write_result=None, **kwargs):
+    result = None
+    try:
+        for result in builder.watch(**kwargs):
+            if write_result is not None:
+                write_result(result)
+                continue
+            print(result)
+            if timings:
+                print_timings(result)
+            print(_("Watching {} for changes. Press Ctrl-C to stop.")
+                .format(builder.path))
+    except KeyboardInterrupt:
+        if write_result is None:
+            print()
+    return result.code if result is not None else 0
+
+
+def build_all_action(context):
+    from .batch import BatchBuilder, find_projects, read_project_list
+    from .history import BuildHistory
+    args = context.args
+    paths = []
+    if args.project_list:
+        try:
+            paths.extend(read_project_list(args.project_list))
+        except OSError as err:
+            exit(1, str(err))
+    if args.paths or not args.project_list:
+        for root in args.paths or [getcwd()]:
+            paths.extend(find_projects(root))
+    if not paths:
+        print(_("No projects found."))
+        return 1
+
+    engine = get_engine(context)
+    if not verify_engine(engine, only_when_error=True):
+        return 1
+    environment = context.settings.get('environment', [])
+    builder = BatchBuilder(engine, paths,
+        environment=environment,
+        workers=args.jobs,
+        clean_build=args.clean,
+        use_cache=args.cache,
+        log_dir=args.log_dir,
+        history=BuildHistory())
+    results = builder.build()
+
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        if r.log:
+            print("\n--- %s" % (r.path,))
+            print(r.log.rstrip())
+        elif r.error and '\n' in r.error:
+            print("\n--- %s\n%s" % (r.path, r.error))
+    print()
+    path_len = max(len(r.path) for r in results)
+    for r in results:
+        print("%-*s  %-6s %7.1fs  %s" % (path_len, r.path,
+            'ok' if r.ok else 'FAILED', r.duration, r))
+    print(_("Built {} projects: {} ok, {} failed.").format(
+        len(results), len(results) - len(failed), len(failed)))
+    return 1 if failed else 0
+
+
+def daemon_build(context):
+    from .daemon import DaemonClient, DaemonError
+    args = context.args
+    # these work only, when the build runs in this process
+    unsupported = [flag for flag, used in (
+            ('--watch', args.watch),
+            ('--trace', args.trace),
+            ('--output-overflow', args.output_overflow != Overflow.BLOCK.value),
+        ) if used]
+    if unsupported:
+        exit(1, _("{} can't be used with --daemon.").format(', '.join(unsupported)))
+    steps = context.args.steps
+    if steps:
+        steps = list(chain.from_iterable(step.split(',') for step in steps))
+    environment = context.settings.get('environment', [])
+    if hasattr(environment, 'get_data'):
+        environment = environment.get_data()
+    client = DaemonClient(context.args.daemon)
+    jsonl_output = JsonLinesObserver() if context.args.output_format == 'jsonl' else None
+    request = dict(
+        config=abspath(get_config_path(context)),
+        environment=list(environment),
+        steps=steps,
+        clean=context.args.clean,
+        workers=context.args.jobs,
+        cache=context.args.cache,
+        history=context.args.history,
+        logs=context.args.logs,
+    )
+    try:
+        result = client.build(observer=jsonl_output, **request)
+    except DaemonError as err:
+        exit(1, str(err))
+    except OSError as err:
+        exit(1, _("Unable to connect to the roman daemon at {}: {}")
+            .format(context.args.daemon, err))
+    if jsonl_output is not None:
+        jsonl_output.write_result(result)
+        return result.code
     print(result)
+    if context.args.timings:
+        print_timings(result)
     return result.code
 
 
+def daemon_action(context):
+    from .daemon import BuildDaemon, DaemonError
+    from .history import BuildHistory
+    try:
+        server = BuildDaemon(context.args.socket, settings=context.settings,
+            history=BuildHistory(), log_store=get_log_store(context))
+    except (DaemonError, OSError) as err:
+        exit(1, str(err))
+    if not verify_engine(server.engine, only_when_error=True):
+        server.server_close()
+        return 1
+    print(_("Listening on {}. Press Ctrl-C to stop.").format(context.args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+    return 0
+
+
+def get_history_filter(context):
+    args = context.args
+    project = None if args.all_projects else dirname(abspath(get_config_path(context)))
+    since = time() - args.days * 24 * 60 * 60 if args.days is not None else None
+    return project, since
+
+
+def format_time(timestamp):
+    return strftime('%Y-%m-%d %H:%M', localtime(timestamp))
+
+
+def history_builds_action(context):
+    from .history import BuildHistory
+    project, since = get_history_filter(context)
+    builds = BuildHistory().builds(project, since, context.args.limit or 20)
+    if not builds:
+        print(_("No builds recorded."))
+        return 0
+    for build in reversed(builds):
+        status = 'ok' if build.code == 0 and build.error is None else 'FAILED'
+        line = "%s  %-6s %8s" % (format_time(build.started), status,
+            format_duration(build.duration or 0))
+        if project is None:
+            line += "  " + build.project
+        if status != 'ok' and build.step is not None:
+            line += "  " + _("step {}: {}").format(build.step,
+                build.error or _("exit code {}").format(build.code))
+        print(line)
+    return 0
+
+
+def history_slowest_action(context):
+    from .history import BuildHistory
+    project, since = get_history_filter(context)
+    steps = BuildHistory().slowest_steps(project, since, context.args.limit or 10)
+    if not steps:
+        print(_("No steps recorded."))
+        return 0
+    name_len = max(4, max(len(s.step) for s in steps))
+    for step in steps:
+        line = "%9.1fs  %-*s  %s  %s" % (step.duration, name_len, step.step,
+            format_time(step.started), step.image)
+        if project is None:
+            line += "  " + step.project
+        print(line)
+    return 0
+
+
+def history_stats_action(context):
+    from .history import BuildHistory
+    project, since = get_history_filter(context)
+    stats = BuildHistory().step_stats(project, since, context.args.period)
+    if not stats:
+        print(_("No steps recorded."))
+        return 0
+    name_len = max(4, max(len(s.step) for s in stats))
+    period_len = max(len(s.period or '') for s in stats)
+    if period_len:
+        period_len = max(6, period_len)
+    row_fmt = "%-*s  %-*s%5s %9s %9s %9s"
+    last_project = None
+    for s in stats:
+        if s.project != last_project:
+            if project is None:
+                print("%s%s:" % ('\n' if last_project else '', s.project))
+            print(row_fmt % (name_len, 'STEP', period_len, 'PERIOD' if period_len else '',
+                'RUNS', 'P50', 'P95', 'MAX'))
+            last_project = s.project
+        print(row_fmt % (name_len, s.step, period_len, s.period or '', s.count,
+            "%.1fs" % s.p50, "%.1fs" % s.p95, "%.1fs" % s.max))
+    return 0
+
+
+def history_clear_action(context):
+    from .history import BuildHistory
+    project, _since = get_history_filter(context)
+    BuildHistory().clear(project)
+    print(_("Build history cleared."))
+    return 0
+
+
+def logs_action(context):
+    from .logstore import parse_since
+    args = context.args
+    build_id, step_name = args.build, args.step
+    if build_id is not None and not build_id.isdigit():
+        # a single name is a step of the latest build
+        if step_name is not None:
+            exit(1, _("Invalid build id: {}").format(build_id))
+        build_id, step_name = None, build_id
+    project = None if args.all_projects else dirname(abspath(get_config_path(context)))
+    store = get_log_store(context)
+
+    if args.list:
+        builds = store.builds(project)
+        if not builds:
+            print(_("No build logs stored."))
+            return 0
+        for build in reversed(builds[:args.tail or 20]):
+            info = build.info
+            status = 'ok' if info.code == 0 and info.error is None else (
+                'FAILED' if info.duration is not None else '-')
+            line = "%5d  %s  %-6s %8s %9s" % (info.id, format_time(info.started),
+                status, format_duration(info.duration or 0),
+                "%.1f MB" % (info.size / 1e6))
+            if project is None:
+                line += "  " + info.project
+            print(line)
+        return 0
+
+    build = store.get(int(build_id)) if build_id is not None else store.latest(project)
+    if build is None:
+        exit(1, _("No build logs found."))
+    if step_name is not None:
+        step = build.step(step_name)
+        if step is None:
+            exit(1, _("Build {} has no output from step {}.").format(build.id, step_name))
+        steps = [step]
+    else:
+        steps = build.steps()
+    try:
+        since = parse_since(args.since) if args.since else None
+    except ValueError:
+        exit(1, _("Invalid time: {}").format(args.since))
+    try:
+        pattern = re.compile(args.grep) if args.grep else None
+    except re.error as err:
+        exit(1, _("Invalid regular expression: {}").format(err))
+
+    prefix = len(steps) > 1
+    for step in steps:
+        lines = step.read(since=since, tail=args.tail, pattern=pattern)
+        text = ''.join([(step.name + " >> " if prefix else '') + line.text + '\n'
+            for line in lines])
+        stdout.write(text)
+    return 0
+
+
 def init_action(context):
+    from .configuration import ProjectConfig
     project_config = context.args.project_config
     try:
         if project_config:
@@ -610,6 +1142,7 @@ def init_action(context):
 
 
 def config_print_action(context):
+    from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
     all_ = not any(getattr(context.args, k, False) for k in ('global_', 'project'))
     if context.args.debug:
         print("---\n# arguments:")
@@ -644,6 +1177,7 @@ def config_env_action(context):
 
 
 def config_env_print(context):
+    from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
     if context.args.global_ and not context.args.project:
         env = EnvDict(
             (context.settings.get('environment', []), 'global settings'))
@@ -698,7 +1232,7 @@ def config_rm_action(context):
 
 
 def step_list_action(context):
-    steps = get_config(context).steps
+    steps = get_config(context, cached=True).steps
     if not steps:
         print("The project config has no steps.")
         return
@@ -713,6 +1247,7 @@ def step_list_action(context):
 
 
 def step_add_action(context):
+    from apluslms_yamlidator.validator import ValidationError, render_error
     args = context.args
     env = args.env
     check_env(env)
@@ -738,6 +1273,8 @@ def step_add_action(context):
 
 
 def step_rm_action(context):
+    from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
+
     def confirm_del(step):
         print('step:')
         print('  {}'.format(yaml_dump(step.get_data()).replace('\n', '\n  ')))
@@ -787,6 +1324,7 @@ def step_env_action(context):
 
 
 def step_env_print(context, config, step):
+    from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
     try:
         env = get_project_environment(context, config)
         if not isinstance(step, str):
@@ -803,49 +1341,43 @@ def step_env_print(context, config, step):
 
 
 def validate_schema_action(context):
-    Container = Document.bind(schema=context.args.schema_name).Container
-    files = chain.from_iterable(glob(s) for s in context.args.data_files)
-    max_version = context.args.schema_version
+    from .validation import validate_files
+    args = context.args
+    files = chain.from_iterable(glob(s) for s in args.data_files)
+    results = validate_files(files, args.schema_name,
+        max_version=args.schema_version,
+        workers=args.jobs,
+        ordered=not args.unordered)
 
     def print2(msg):
         print(" ", msg)
 
-    if max_version is None:
-        get_docs = lambda x: x
-    else:
-        def get_docs(container):
-            try:
-                doc = container.get_latest(max_version, validate=False)
-            except KeyError:
-                print2(_("No elements with max version %s found!")
-                    % max_version)
-                return ()
-            if doc.version is None:
-                doc.version = max_version
-            return (doc,)
-
+    summary = []
     errors = 0
     documents = 0
-    for file_ in files:
-        container = Container(file_)
-        print("%s:" % (container.path,))
-        if not container:
-            print2(_("The data file is empty!"))
-            continue
-
-        for doc in get_docs(container):
-            try:
-                doc.validate(quiet=True)
-            except ValidationError as e:
+    for result in results:
+        summary.append(result.as_dict())
+        print("%s:" % (result.path,))
+        if result.error is not None:
+            print2(_("Failed to read the data file: %s") % (result.error,))
+            errors += 1
+        elif result.message is not None:
+            print2(result.message)
+        for doc in result.documents:
+            if doc.error is not None:
                 print2(_("Document %d failed against %s")
-                    % (doc.index, doc.validator_id))
-                print('\n'+'\n'.join('    '+s for s in render_error(e))+'\n')
+                    % (doc.index, doc.schema_id))
+                print('\n'+'\n'.join('    '+s for s in doc.error)+'\n')
                 errors += 1
             else:
                 print2(_("Document %d validates against %s")
-                    % (doc.index, doc.validator_id))
+                    % (doc.index, doc.schema_id))
             documents += 1
         print()
+
+    if args.summary:
+        write_validation_summary(args.summary, args.schema_name, summary,
+            documents, errors)
     if errors > 0:
         print(_("Found total of %d errors in %d documents.")
             % (errors, documents))
@@ -854,6 +1386,23 @@ def validate_schema_action(context):
     return 0
 
 
+def write_validation_summary(path, schema_name, files, documents, errors):
+    data = {
+        'schema': schema_name,
+        'files': len(files),
+        'documents': documents,
+        'errors': errors,
+        'invalid_files': [f['path'] for f in files if not f['ok']],
+        'results': files,
+    }
+    if path == '-':
+        json.dump(data, stdout, indent=2)
+        print()
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
 def backend_test_action(context, verbose=False):
     engine = get_engine(context)
     if not verify_engine(engine):
@@ -1,15 +1,24 @@
+import json
+import logging
 from collections import Counter
 from itertools import chain
 from os import listdir
 from os.path import basename, join, isdir, isfile
 
-from apluslms_yamlidator.document import Document
+from apluslms_yamlidator.document import Document, hash as content_hash
 from apluslms_yamlidator.utils.collections import Mapping
+from apluslms_yamlidator.utils.files import atomic_write
 from apluslms_yamlidator.utils.version import Version
 
+from . import CACHE_DIR, __version__
+from . import schemas # register our schemas
+from .utils.trace import tracer
 from .utils.translation import _
 
 
+logger = logging.getLogger(__name__)
+
+
 class ProjectConfigError(Exception):
     pass
 
@@ -21,10 +30,10 @@ class ProjectConfig(Document):
     DEFAULT_NAMES = ('roman', 'course')
     DEFAULT_PREFIXES = ('yml', 'yaml', 'json')
     DEFAULT_FILENAME = '%s.%s' % (DEFAULT_NAMES[0], DEFAULT_PREFIXES[0])
+    cached = False
 
     @classmethod
-    def find_from(cls, path):
-
+    def find_file(cls, path):
         files = [
             ['%s.%s' % (name, prefix) for prefix in cls.DEFAULT_PREFIXES]
             for name in cls.DEFAULT_NAMES
@@ -36,29 +45,80 @@ class ProjectConfig(Document):
                 _("Path {} doesn't exist or is not a directory").format(path)
             )
 
-        file_ = next((file_ for file_ in files if isfile(file_)), None)
+        file_ = next((file_ for file_ in files if isfile(join(path, file_))), None)
         config = join(path, file_) if file_ else None
         if not config or not isfile(config):
             raise FileNotFoundError((
                 _("Couldn't find project configuration from {}."
                 "\nExpected to find one of these: {}")
             ).format(path, ', '.join(files)))
+        return config
 
-        return cls.load(config)
+    @classmethod
+    def find_from(cls, path, cached=False):
+        path = cls.find_file(path)
+        return cls.load_cached(path) if cached else cls.load(path)
 
     @classmethod
-    def load_from(cls, config):
+    def resolve_file(cls, config):
         if isfile(config):
-            return cls.load(config)
+            return config
         if '.' not in basename(config):
             for prefix in cls.DEFAULT_PREFIXES:
                 filename = '%s.%s' % (config, prefix)
                 if isfile(filename):
-                    return cls.load(filename)
+                    return filename
         raise FileNotFoundError("Given file '{}' doesn't exist.".format(config))
 
+    @classmethod
+    def load_from(cls, config, cached=False):
+        path = cls.resolve_file(config)
+        return cls.load_cached(path) if cached else cls.load(path)
+
+    @classmethod
+    def get_cache_path(cls, digest):
+        return join(CACHE_DIR, 'configs', '%s-%s-%s-%s.json' % (
+            digest, cls.name, cls.version, __version__))
+
+    @classmethod
+    def load_cached(cls, path):
+        """
+        Returns a validated configuration for read-only use. The result of
+        parsing and validation is cached per file content, so unchanged
+        files are loaded from a JSON file. The cached documents don't have
+        line and column information or comments, so use `load` when the
+        configuration is modified or errors are rendered with the source.
+        """
+        with open(path, 'r') as f:
+            digest = content_hash(f.read())
+        cache_path = cls.get_cache_path(digest.hex())
+        try:
+            with open(cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        else:
+            container = cls.Container.from_data(path, [data], digest)
+            document = container.get_latest(max_version=cls.version, validate=False)
+            document.cached = True
+            return document
+
+        document = cls.load(path)
+        cls._write_cache(cache_path, document._data.get_data())
+        return document
+
+    @staticmethod
+    def _write_cache(path, data):
+        try:
+            with atomic_write(path) as f:
+                json.dump(data, f, separators=(',', ':'))
+        except (OSError, TypeError, ValueError) as err:
+            logger.warning(_("Failed to cache the project configuration to %s: %s"),
+                path, err)
+
     def validate(self, *args, **kwargs):
-        super().validate(*args, **kwargs)
+        with tracer.span('validate config', args={'path': self.path}):
+            super().validate(*args, **kwargs)
         if not self.steps:
             return
         names = Counter((s['name'].lower() for s in self.steps if 'name' in s))
@@ -0,0 +1,271 @@
+"""
+A build daemon, which keeps the backend connection, schema validators and
+project configurations loaded between builds.
+
+The protocol is JSON lines over a Unix stream socket. A client sends a single
+request object and the daemon responds with a stream of objects:
+
+    {"type": "message", "phase": ..., "msg": ..., "step": ..., "state": ..., "data": ...}
+    {"type": "result", "code": ..., "error": ..., "step": ...}
+    {"type": "error", "error": ...}
+
+The last object of a response is either a result or an error.
+"""
+import json
+import logging
+import socket
+from os import makedirs, remove
+from os.path import dirname, exists, getmtime, getsize
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from threading import Lock
+from time import time
+
+from apluslms_yamlidator.validator import ValidationError, render_error
+
+from . import DAEMON_SOCKET
+from .backends import BuildResult
+from .builder import Engine
+from .configuration import ProjectConfig, ProjectConfigError
+from .logstore import LogObserver
+from .observer import (
+    BuildObserver,
+    FanOutObserver,
+    Message,
+    ObserverSink,
+    Phase,
+    StepState,
+    StreamObserver,
+)
+from .utils.env import EnvDict, EnvError
+from .utils.scheduler import StepGraphError
+from .utils.translation import _
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = DAEMON_SOCKET
+
+
+class DaemonError(Exception):
+    pass
+
+
+def dump_message(obj):
+    return (json.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class SocketObserver(BuildObserver):
+    """
+    Writes observer messages to a daemon client. When the client has
+    disconnected, the messages are dropped and `on_disconnect` is called once.
+    """
+    def __init__(self, wfile, on_disconnect=None):
+        super().__init__()
+        self._wfile = wfile
+        self._lock = Lock()
+        self.on_disconnect = on_disconnect
+        self.disconnected = False
+
+    def write(self, obj):
+        data = dump_message(obj)
+        with self._lock:
+            if self.disconnected:
+                return
+            try:
+                self._wfile.write(data)
+                self._wfile.flush()
+                return
+            except ConnectionError as err:
+                logger.debug("The client disconnected: %s", err)
+                self.disconnected = True
+        if self.on_disconnect is not None:
+            self.on_disconnect()
+
+    def _message(self, phase, type_, step=None, state=None, data=None):
+        self._timed_message(phase, type_, step, state, data, time())
+
+    def _timed_message(self, phase, type_, step, state, data, timestamp):
+        self.write({
+            'type': 'message',
+            'phase': phase.name,
+            'msg': type_.name,
+            'step': str(step) if step is not None else None,
+            'state': state.name if state is not None else None,
+            'data': data,
+            'time': timestamp,
+        })
+
+
+class DaemonRequestHandler(StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            action = getattr(self.server, 'action_' + request.get('action', ''), None)
+            if action is None:
+                raise DaemonError(_("Unknown action: {}").format(request.get('action')))
+            action(request, self.wfile)
+        except Exception as err:
+            if isinstance(err, (DaemonError, ValueError)):
+                logger.debug("Request failed: %s", err)
+            else:
+                logger.exception("Request failed")
+            try:
+                self.wfile.write(dump_message({'type': 'error', 'error': str(err)}))
+            except OSError:
+                pass
+
+
+class BuildDaemon(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, settings=None, history=None,
+            log_store=None):
+        self.settings = settings
+        self.engine = Engine(settings=settings)
+        self.history = history
+        self.log_store = log_store
+        self._configs = {}
+        self._locks = {}
+        self._lock = Lock()
+        makedirs(dirname(path), exist_ok=True)
+        if exists(path):
+            # a stale socket from a daemon that did not exit cleanly
+            if DaemonClient(path).ping():
+                raise DaemonError(_("A daemon is already listening at {}").format(path))
+            remove(path)
+        super().__init__(path, DaemonRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if exists(self.server_address):
+            remove(self.server_address)
+
+    def get_config(self, path):
+        """Returns a cached project configuration, if the file has not changed"""
+        key = (getmtime(path), getsize(path))
+        with self._lock:
+            cached = self._configs.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+        config = ProjectConfig.load_from(path, cached=True)
+        with self._lock:
+            self._configs[path] = (key, config)
+        return config
+
+    def get_project_lock(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, Lock())
+
+    def action_ping(self, request, wfile):
+        wfile.write(dump_message({'type': 'result', 'code': 0, 'error': None, 'step': None}))
+
+    def action_build(self, request, wfile):
+        path = request.get('config')
+        if not path:
+            raise DaemonError(_("Missing the project configuration path"))
+        try:
+            config = self.get_config(path)
+        except ValidationError as err:
+            raise DaemonError('\n'.join(render_error(err)))
+        except ProjectConfigError as err:
+            raise DaemonError(_("Invalid project configuration: {}").format(err))
+        environment = EnvDict(
+            (request.get('environment') or [], 'global settings'),
+            (config.mlget('environment', []), 'project configuration'),
+        )
+        client = observer = SocketObserver(wfile)
+        if self.log_store is not None and request.get('logs', True):
+            observer = FanOutObserver([client,
+                ObserverSink(LogObserver(self.log_store, config.dir))])
+        builder = self.engine.create_builder(config, observer=observer,
+            environment=environment,
+            history=self.history if request.get('history', True) else None)
+        # a build without anyone to report to is not worth finishing
+        client.on_disconnect = builder.cancel
+        with self.get_project_lock(config.dir):
+            try:
+                result = builder.build(
+                    step_refs=request.get('steps'),
+                    clean_build=request.get('clean', False),
+                    workers=request.get('workers', 1),
+                    use_cache=request.get('cache'))
+            except KeyboardInterrupt:
+                if not client.disconnected:
+                    raise
+                logger.info("The client disconnected, cancelled the build of %s",
+                    config.dir)
+                return
+            except KeyError as err:
+                raise DaemonError(_("No step named {}.").format(err.args[0]))
+            except IndexError as err:
+                raise DaemonError(_("Index {} is out of range.").format(err.args[0]))
+            except (EnvError, StepGraphError) as err:
+                raise DaemonError(str(err))
+            finally:
+                if observer is not client:
+                    observer.close()
+        client.write({
+            'type': 'result',
+            'code': result.code,
+            'error': result.error,
+            'step': str(result.step) if result.step is not None else None,
+        })
+
+
+class DaemonClient:
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, **request):
+        """Sends a request and yields the response objects"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+            sock.sendall(dump_message(request))
+            with sock.makefile('rb') as f:
+                for line in f:
+                    yield json.loads(line.decode('utf-8'))
+        finally:
+            sock.close()
+
+    def ping(self):
+        try:
+            return any(r.get('type') == 'result' for r in self.request(action='ping'))
+        except OSError:
+            return False
+
+    def build(self, observer=None, **request):
+        """
+        Requests a build and passes the messages to `observer`.
+        Returns BuildResult or raises DaemonError.
+        """
+        if observer is None:
+            observer = StreamObserver()
+        for response in self.request(action='build', **request):
+            type_ = response.get('type')
+            if type_ == 'message':
+                step = response['step']
+                state = response['state']
+                data = response['data']
+                msg = Message[response['msg']]
+                if isinstance(data, list):
+                    data = tuple(data)
+                if msg == Message.TIMING_MSG:
+                    timings = (observer.timings.phases if step is None
+                        else observer.timings.step(step))
+                    timings.add(*data)
+                observer._timed_message(
+                    Phase[response['phase']],
+                    msg,
+                    step,
+                    StepState[state] if state is not None else None,
+                    data,
+                    response.get('time') or time())
+            elif type_ == 'result':
+                return BuildResult(response['code'], response['error'], response['step'],
+                    timings=observer.timings)
+            elif type_ == 'error':
+                raise DaemonError(response['error'])
+        raise DaemonError(_("The daemon closed the connection without a result"))
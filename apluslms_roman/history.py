@@ -0,0 +1,223 @@
+import logging
+from collections import OrderedDict, namedtuple
+from contextlib import closing
+from datetime import date
+from os import makedirs
+from os.path import dirname, join
+from time import time
+
+from . import DATA_DIR
+from .observer import StepState
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL,
+    code INTEGER,
+    error TEXT,
+    step TEXT
+);
+CREATE INDEX IF NOT EXISTS builds_project ON builds (project, started);
+CREATE TABLE IF NOT EXISTS steps (
+    build_id INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    step TEXT NOT NULL,
+    image TEXT,
+    digest TEXT,
+    state TEXT,
+    duration REAL,
+    code INTEGER,
+    log_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS steps_build ON steps (build_id);
+"""
+
+PERIODS = {
+    'day': lambda d: d.isoformat(),
+    'week': lambda d: '%d-W%02d' % d.isocalendar()[:2],
+    'month': lambda d: '%d-%02d' % (d.year, d.month),
+}
+
+
+BuildRecord = namedtuple('BuildRecord', [
+    'id', 'project', 'started', 'duration', 'code', 'error', 'step',
+])
+StepRecord = namedtuple('StepRecord', [
+    'project', 'started', 'step', 'image', 'state', 'duration',
+])
+StepStats = namedtuple('StepStats', [
+    'project', 'step', 'period', 'count', 'p50', 'p95', 'max',
+])
+
+
+def percentile(values, p):
+    """Returns the p:th percentile of sorted `values` with linear interpolation"""
+    if not values:
+        return None
+    pos = (len(values) - 1) * p / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class BuildHistory:
+    """
+    Records builds to an SQLite database: the project, the steps with their
+    images and image digests, durations, exit codes and log sizes. Stored
+    durations are used for the expected step durations of the next builds.
+    The database is opened for each call, so an instance can be shared by
+    threads and processes.
+    """
+    def __init__(self, path=None):
+        self.path = path or join(DATA_DIR, 'history.sqlite3')
+        self._initialized = False
+
+    @property
+    def errors(self):
+        # sqlite3 is imported on first use, so the cli starts fast
+        import sqlite3
+        return (sqlite3.Error, OSError)
+
+    def _connect(self):
+        import sqlite3
+        if not self._initialized:
+            makedirs(dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA foreign_keys = ON')
+        if not self._initialized:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                with conn:
+                    conn.executescript(SCHEMA)
+                    conn.execute('PRAGMA user_version = %d' % (SCHEMA_VERSION,))
+            self._initialized = True
+        return conn
+
+    def record(self, project, steps, result, started=None, duration=None,
+            states=None, log_bytes=None, digests=None):
+        """
+        Stores a build of `steps` with BuildResult `result`. `states`,
+        `log_bytes` and `digests` are dicts keyed by the step. Step durations
+        are read from the result timings. Returns the id of the build.
+        """
+        if started is None:
+            started = time()
+        states = states or {}
+        log_bytes = log_bytes or {}
+        digests = digests or {}
+        timings = result.timings
+        failed = str(result.step) if result.step is not None and not result.ok else None
+        rows = []
+        for step in steps:
+            state = states.get(step, StepState.NOTSTARTED)
+            seconds = None
+            if timings is not None and step in timings.steps:
+                seconds = timings.steps[step].get('build')
+            if state == StepState.SUCCEEDED or state == StepState.CACHED:
+                code = 0
+            elif str(step) == failed:
+                code = result.code
+            else:
+                code = None
+            rows.append((str(step), step.img, digests.get(step), state.name,
+                seconds, code, log_bytes.get(step)))
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                'INSERT INTO builds (project, started, duration, code, error, step) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (project, started, duration, result.code, result.error, failed))
+            build_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO steps (build_id, step, image, digest, state, '
+                'duration, code, log_bytes) VALUES (%d, ?, ?, ?, ?, ?, ?, ?)'
+                % (build_id,), rows)
+        return build_id
+
+    def _where(self, project=None, since=None, state=None):
+        clauses, params = [], []
+        if project is not None:
+            clauses.append('b.project = ?')
+            params.append(project)
+        if since is not None:
+            clauses.append('b.started >= ?')
+            params.append(since)
+        if state is not None:
+            clauses.append('s.state = ?')
+            params.append(state.name)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def builds(self, project=None, since=None, limit=20):
+        """Returns the latest builds, newest first"""
+        where, params = self._where(project, since)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT id, project, started, duration, code, error, step '
+                'FROM builds b%s ORDER BY started DESC LIMIT ?' % (where,),
+                params + [limit]).fetchall()
+        return [BuildRecord(*row) for row in rows]
+
+    def slowest_steps(self, project=None, since=None, limit=10):
+        """Returns the slowest successful step runs, slowest first"""
+        where, params = self._where(project, since, StepState.SUCCEEDED)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT b.project, b.started, s.step, s.image, s.state, s.duration '
+                'FROM steps s JOIN builds b ON s.build_id = b.id%s '
+                'AND s.duration IS NOT NULL ORDER BY s.duration DESC LIMIT ?'
+                % (where,), params + [limit]).fetchall()
+        return [StepRecord(*row) for row in rows]
+
+    def _durations(self, project=None, since=None):
+        # (project, step, started, duration) of successful runs, newest first
+        where, params = self._where(project, since, StepState.SUCCEEDED)
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                'SELECT b.project, s.step, b.started, s.duration '
+                'FROM steps s JOIN builds b ON s.build_id = b.id%s '
+                'AND s.duration IS NOT NULL ORDER BY b.started DESC'
+                % (where,), params).fetchall()
+
+    def step_stats(self, project=None, since=None, period=None):
+        """
+        Returns StepStats with the median and the 95th percentile of the
+        successful runs of each step. With `period` ('day', 'week' or
+        'month'), the runs are grouped by the period they were started in.
+        """
+        key = PERIODS[period] if period else None
+        groups = OrderedDict()
+        for project_, step, started, seconds in reversed(self._durations(project, since)):
+            label = key(date.fromtimestamp(started)) if key else None
+            groups.setdefault((project_, step, label), []).append(seconds)
+        stats = []
+        for (project_, step, label), values in groups.items():
+            values.sort()
+            stats.append(StepStats(project_, step, label, len(values),
+                percentile(values, 50), percentile(values, 95), values[-1]))
+        stats.sort(key=lambda s: (s.project, s.step, s.period or ''))
+        return stats
+
+    def expected_durations(self, project, samples=5):
+        """
+        Returns a dict of step names to the median duration of their latest
+        `samples` successful runs in `project`.
+        """
+        durations = OrderedDict()
+        for _project, step, _started, seconds in self._durations(project):
+            values = durations.setdefault(step, [])
+            if len(values) < samples:
+                values.append(seconds)
+        return {step: percentile(sorted(values), 50)
+            for step, values in durations.items()}
+
+    def clear(self, project=None):
+        """Deletes the builds of `project` or all builds"""
+        with closing(self._connect()) as conn, conn:
+            if project is None:
+                conn.execute('DELETE FROM builds')
+            else:
+                conn.execute('DELETE FROM builds WHERE project = ?', (project,))
@@ -0,0 +1,343 @@
+import json
+import logging
+import re
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from os import listdir, makedirs
+from os.path import getsize, join
+from shutil import rmtree
+from struct import Struct
+from threading import Lock
+from time import time
+from urllib.parse import quote
+
+from . import DATA_DIR
+from .observer import BuildObserver, Message, Phase
+
+
+logger = logging.getLogger(__name__)
+
+# A step log is a file of zlib compressed segments and an index file with a
+# record per segment: the offset and the size of the segment in the log
+# file, the number of its first line, its line count and the time of its
+# first line. A segment holds the lines received in SEGMENT_SECONDS or up to
+# SEGMENT_BYTES of text, so single segments can be read for --tail and
+# --since.
+SEGMENT_BYTES = 256 * 1024
+SEGMENT_SECONDS = 1.0
+INDEX = Struct('<QIQId')
+
+DEFAULT_MAX_BYTES = 1 << 30
+DEFAULT_MAX_DAYS = 30
+
+
+Segment = namedtuple('Segment', ['offset', 'size', 'first_line', 'lines', 'time'])
+LogLine = namedtuple('LogLine', ['number', 'time', 'text'])
+BuildInfo = namedtuple('BuildInfo', [
+    'id', 'project', 'started', 'duration', 'code', 'error', 'step', 'steps', 'size',
+])
+
+
+def step_filename(step):
+    return quote(str(step), safe='')
+
+
+class StepLogWriter:
+    def __init__(self, path):
+        self._data = open(path + '.log', 'ab')
+        self._index = open(path + '.idx', 'ab')
+        self._offset = self._data.tell()
+        self._line = 0
+        self._lines = []
+        self._size = 0
+        self._time = None
+
+    def write(self, lines, now):
+        if self._lines and now - self._time >= SEGMENT_SECONDS:
+            self._flush()
+        if not self._lines:
+            self._time = now
+        self._lines.extend(lines)
+        self._size += sum(len(line) + 1 for line in lines)
+        if self._size >= SEGMENT_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if not self._lines:
+            return
+        data = zlib.compress(('\n'.join(self._lines) + '\n').encode('utf-8'))
+        self._data.write(data)
+        self._index.write(INDEX.pack(self._offset, len(data), self._line,
+            len(self._lines), self._time))
+        self._offset += len(data)
+        self._line += len(self._lines)
+        self._lines = []
+        self._size = 0
+
+    def close(self):
+        self._flush()
+        self._data.close()
+        self._index.close()
+
+
+class StepLog:
+    """Reads the log of one step. Only the segments needed are decompressed."""
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    @property
+    def size(self):
+        try:
+            return getsize(self.path + '.log') + getsize(self.path + '.idx')
+        except OSError:
+            return 0
+
+    def segments(self):
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        # a partial record is left, if the build was interrupted while writing
+        end = len(data) - len(data) % INDEX.size
+        return [Segment(*record) for record in INDEX.iter_unpack(data[:end])]
+
+    def _read(self, f, segment, pattern):
+        f.seek(segment.offset)
+        text = zlib.decompress(f.read(segment.size)).decode('utf-8', 'replace')
+        lines = text.split('\n')[:segment.lines]
+        return [LogLine(segment.first_line + i, segment.time, line)
+            for i, line in enumerate(lines)
+            if pattern is None or pattern.search(line)]
+
+    def read(self, since=None, tail=None, pattern=None):
+        """
+        Returns LogLines. `since` skips the segments started before it,
+        `pattern` is a compiled regex for the lines to include and `tail`
+        limits the result to the last lines. With `tail`, the segments are
+        read from the end until enough lines are found.
+        """
+        segments = self.segments()
+        if since is not None:
+            segments = [s for s in segments if s.time >= since]
+        if not segments or tail == 0:
+            return []
+        with open(self.path + '.log', 'rb') as f:
+            if tail is None:
+                return [line for segment in segments
+                    for line in self._read(f, segment, pattern)]
+            found = []
+            count = 0
+            for segment in reversed(segments):
+                lines = self._read(f, segment, pattern)
+                found.append(lines)
+                count += len(lines)
+                if count >= tail:
+                    break
+        lines = [line for lines in reversed(found) for line in lines]
+        return lines[-tail:]
+
+
+class BuildLog:
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+
+    @property
+    def id(self):
+        return self.info.id
+
+    def steps(self):
+        return [StepLog(join(self.path, step_filename(step)), step)
+            for step in self.info.steps]
+
+    def step(self, name):
+        for step in self.steps():
+            if step.name == name:
+                return step
+        return None
+
+
+class BuildLogWriter:
+    """Writes the container output of the steps of a build. Thread-safe."""
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.id = meta['id']
+        self._writers = {}
+        self._lock = Lock()
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(join(self.path, 'build.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    def write(self, step, lines, now=None):
+        if now is None:
+            now = time()
+        name = str(step)
+        with self._lock:
+            writer = self._writers.get(name)
+            if writer is None:
+                writer = self._writers[name] = StepLogWriter(
+                    join(self.path, step_filename(name)))
+                self.meta['steps'].append(name)
+                self._write_meta()
+            writer.write(lines, now)
+
+    def close(self, code=None, error=None, step=None):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+            self.meta.update(duration=time() - self.meta['started'], code=code,
+                error=error, step=str(step) if step is not None else None)
+            self._write_meta()
+
+
+class LogStore:
+    """
+    Stores the container output of builds under `path`, a directory per
+    build. Old builds are removed by prune(), when there are more than
+    `max_bytes` of logs or the builds are older than `max_days`.
+    """
+    errors = (OSError, ValueError)
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, max_days=DEFAULT_MAX_DAYS):
+        self.path = path or join(DATA_DIR, 'logs')
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+
+    def _ids(self):
+        try:
+            names = listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def create(self, project, started=None):
+        """Returns a BuildLogWriter for a new build of `project`"""
+        makedirs(self.path, exist_ok=True)
+        ids = self._ids()
+        build_id = ids[-1] + 1 if ids else 1
+        while True:
+            path = join(self.path, str(build_id))
+            try:
+                makedirs(path)
+            except FileExistsError:
+                # created by a concurrent build
+                build_id += 1
+                continue
+            break
+        return BuildLogWriter(path, {'id': build_id, 'project': project,
+            'started': started if started is not None else time(),
+            'duration': None, 'code': None, 'error': None, 'step': None, 'steps': []})
+
+    def get(self, build_id):
+        path = join(self.path, str(build_id))
+        try:
+            with open(join(path, 'build.json')) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # removed or still being created
+            return None
+        size = sum(getsize(join(path, name)) for name in listdir(path))
+        return BuildLog(path, BuildInfo(size=size, **meta))
+
+    def builds(self, project=None):
+        """Returns BuildLogs of `project` or all projects, newest first"""
+        builds = []
+        for build_id in reversed(self._ids()):
+            build = self.get(build_id)
+            if build is not None and (project is None or build.info.project == project):
+                builds.append(build)
+        return builds
+
+    def latest(self, project=None):
+        builds = self.builds(project)
+        return builds[0] if builds else None
+
+    def delete(self, build_id):
+        rmtree(join(self.path, str(build_id)), ignore_errors=True)
+
+    def prune(self, keep=None):
+        """
+        Deletes builds older than `max_days` and then the oldest builds until
+        the logs take at most `max_bytes`. The build with id `keep` is kept.
+        """
+        builds = self.builds()
+        now = time()
+        total = sum(build.info.size for build in builds)
+        for build in reversed(builds):
+            if build.id == keep:
+                continue
+            too_old = (self.max_days is not None
+                and now - build.info.started > self.max_days * 24 * 60 * 60)
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if too_old or too_big:
+                self.delete(build.id)
+                total -= build.info.size
+
+
+class LogObserver(BuildObserver):
+    """
+    Writes the container output of builds of `project` to a LogStore. It
+    only handles messages, so it works well behind a FanOutObserver.
+    """
+    def __init__(self, store, project):
+        super().__init__()
+        self.store = store
+        self.project = project
+        self.build = None
+        self._result = (None, None, None)
+
+    def _message(self, phase, type_, step=None, state=None, data=None):
+        try:
+            if type_ == Message.PHASE_UPDATE:
+                if phase == Phase.DONE:
+                    self._close()
+                elif self.build is None:
+                    self.build = self.store.create(self.project)
+                    self._result = (None, None, None)
+            elif type_ == Message.CONTAINER_MSG and self.build is not None:
+                self.build.write(step, data)
+            elif type_ == Message.RESULT_MSG:
+                self._result = data + (step,)
+        except self.store.errors as err:
+            logger.warning("Unable to store the build log: %s", err)
+            build, self.build = self.build, None
+            if build is not None:
+                try:
+                    build.close(*self._result)
+                except self.store.errors:
+                    pass
+
+    def _close(self):
+        build, self.build = self.build, None
+        if build is not None:
+            build.close(*self._result)
+            self.store.prune(keep=build.id)
+
+
+SINCE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd])$')
+SINCE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_since(value, now=None):
+    """
+    Returns a timestamp for a relative time, e.g. '90s', '5m', '2h' or '1d',
+    or for an absolute local time 'YYYY-MM-DD[ HH:MM[:SS]]'.
+    """
+    match = SINCE_RE.match(value.strip())
+    if match:
+        seconds = float(match.group(1)) * SINCE_UNITS[match.group(2)]
+        return (now if now is not None else time()) - seconds
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S',
+            '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value.strip(), fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(value)
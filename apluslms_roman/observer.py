@@ -1,5 +1,17 @@
+import json
+import logging
 import sys
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from enum import Enum
+from threading import Condition, Lock, Thread
+from time import time
+
+from .utils.timing import BuildTimings, clock, format_duration
+from .utils.trace import tracer
+
+
+logger = logging.getLogger(__name__)
 
 
 class Phase(Enum):
@@ -22,6 +34,7 @@ class StepState(Enum):
     SUCCEEDED = 7
     FAILED = 8
     CANCELLED = 9
+    CACHED = 10
 
     @property
     def active(self):
@@ -34,11 +47,12 @@ class StepState(Enum):
 
 class Message(Enum):
     PHASE_UPDATE = 0
-    STATE_UPDATE = 1
+    STATE_UPDATE = 1   # data is None or a tuple (expected: float, eta: float)
 
     MANAGER_MSG = 11   # data is a list of strings
     CONTAINER_MSG = 12 # data is a list of strings
     RESULT_MSG = 13    # data is a tuple (code: int, error: str)
+    TIMING_MSG = 14    # data is a tuple (stage: str, seconds: float)
 
 
 # Step states in different phases
@@ -64,15 +78,32 @@ class Message(Enum):
 #   succeeded   - the step returned 0
 #   failed      - the step returned non-zero status
 #   cancelled   - the build was cancelled, before this step was completed
+#   cached      - the step was skipped and its results were restored from the cache
 #
 # done:
 #   - build has entered done phase
+#
+# Timings:
+#   When a phase ends, its duration is sent as a timing message without a
+#   step. When a step completes, its duration in the phase is sent with the
+#   phase name as the stage. Backends send the durations of the stages inside
+#   a step, e.g. 'pull' or 'wait'. All of them are collected to `timings`.
+#
+# A build starts, when a phase is entered from none or done. The timings,
+# the final step states of the build phase in `states` and the container log
+# sizes in `log_bytes` are reset then.
 
 
 class BuildObserver:
     def __init__(self):
         self._phase = Phase.NONE
         self._states = {}
+        self._phase_start = None
+        self._step_starts = {}
+        self._expected = {}
+        self.timings = BuildTimings()
+        self.states = {}
+        self.log_bytes = {}
 
     def get_step_state(self, step):
         return self._states.get(step, StepState.UNKNOWN)
@@ -80,10 +111,31 @@ class BuildObserver:
     def _message(self, phase, type_, step=None, state=None, data=None):
         raise NotImplementedError
 
+    def _timed_message(self, phase, type_, step, state, data, timestamp):
+        """
+        Handles a message, which was sent at `timestamp`, but is delivered
+        later, e.g. through an ObserverSink. By default, the time is ignored.
+        """
+        self._message(phase, type_, step, state, data)
+
     # Phase transitions, synchronous
 
     def _phase_update(self, phase):
         if self._phase != phase:
+            now = clock()
+            if self._phase in (Phase.NONE, Phase.DONE):
+                self.timings = BuildTimings()
+                self.states = {}
+                self.log_bytes = {}
+            if self._phase_start is not None:
+                seconds = now - self._phase_start
+                self.timings.phases.add(self._phase.name.lower(), seconds)
+                tracer.complete(self._phase.name.lower(), self._phase_start, seconds,
+                    cat='phase')
+                self._send_message(Message.TIMING_MSG, None,
+                    (self._phase.name.lower(), seconds))
+            self._phase_start = now if phase != Phase.DONE else None
+            self._step_starts = {}
             self._phase = phase
             self._states = {step: StepState.NOTSTARTED for step in self._states}
             self._message(self._phase, Message.PHASE_UPDATE)
@@ -97,6 +149,33 @@ class BuildObserver:
     def done(self, data=None):
         self._phase_update(Phase.DONE)
 
+    # Expected durations
+
+    def set_expected(self, durations):
+        """Sets the expected durations of the steps in the build phase"""
+        self._expected = dict(durations)
+
+    def get_expected(self, step):
+        return self._expected.get(step)
+
+    def eta(self):
+        """
+        Returns the estimated seconds left in the build phase, assuming the
+        steps run one after another, or None if there are no expectations.
+        """
+        if self._phase != Phase.BUILD or not self._expected:
+            return None
+        now = clock()
+        left = 0.0
+        for step, seconds in self._expected.items():
+            if self.get_step_state(step).completed:
+                continue
+            start = self._step_starts.get(step)
+            if start is not None:
+                seconds -= now - start
+            left += max(seconds, 0.0)
+        return left
+
     # Step transitions, can be async
 
     def _state_update(self, step, state):
@@ -106,7 +185,24 @@ class BuildObserver:
                 % (self.__class__.__name__, state, step))
         if self.get_step_state(step) != state:
             self._states[step] = state
-            self._message(self._phase, Message.STATE_UPDATE, step, state)
+            data = None
+            if state == StepState.RUNNING and self._phase == Phase.BUILD:
+                expected = self.get_expected(step)
+                if expected is not None:
+                    data = (expected, self.eta())
+            self._message(self._phase, Message.STATE_UPDATE, step, state, data)
+            if state.active:
+                if step not in self._step_starts:
+                    self._step_starts[step] = clock()
+            elif state.completed:
+                if self._phase == Phase.BUILD:
+                    self.states[step] = state
+                if step in self._step_starts:
+                    start = self._step_starts.pop(step)
+                    seconds = clock() - start
+                    tracer.complete("step %s" % (step,), start, seconds, cat='step',
+                        args={'phase': self._phase.name.lower(), 'state': state.name})
+                    self._add_step_timing(step, self._phase.name.lower(), seconds)
 
     def step_preflight(self, step):
         self._state_update(step, StepState.PREFLIGHT)
@@ -132,6 +228,9 @@ class BuildObserver:
     def step_cancelled(self, step):
         self._state_update(step, StepState.CANCELLED)
 
+    def step_cached(self, step):
+        self._state_update(step, StepState.CACHED)
+
     # In step state messages
 
     def _send_message(self, type_, step, msg):
@@ -147,12 +246,35 @@ class BuildObserver:
         self._send_message(Message.MANAGER_MSG, step, msg)
 
     def container_msg(self, step, msg):
+        size = len(msg.encode('utf-8', 'replace'))
+        total = self.log_bytes[step] = self.log_bytes.get(step, 0) + size
+        if tracer.enabled:
+            tracer.counter("log %s" % (step,), {'bytes': total}, cat='log')
         msg = msg.rstrip().splitlines()
         self._send_message(Message.CONTAINER_MSG, step, msg)
 
     def result_msg(self, result):
         self._send_message(Message.RESULT_MSG, result.step, (result.code, result.error))
 
+    def _add_step_timing(self, step, stage, seconds):
+        self.timings.step(step).add(stage, seconds)
+        self._send_message(Message.TIMING_MSG, step, (stage, seconds))
+
+    def step_timing(self, step, stage, seconds, start=None):
+        if start is None:
+            start = clock() - seconds
+        tracer.complete(stage, start, seconds, cat='stage', args={'step': str(step)})
+        self._add_step_timing(step, stage, seconds)
+
+    @contextmanager
+    def measure(self, step, stage):
+        """Sends the time spent in the with block as a timing of `stage`"""
+        start = clock()
+        try:
+            yield
+        finally:
+            self.step_timing(step, stage, clock() - start, start)
+
 
 ENTER_STATE_TEXTS = {
     StepState.PREFLIGHT: "Pre-Flight tasks..",
@@ -161,6 +283,7 @@ ENTER_STATE_TEXTS = {
     StepState.POSTFLIGHT: "Post-Flight tasks..",
     StepState.FAILED: "Failed!",
     StepState.CANCELLED: "\rCancelled..",
+    StepState.CACHED: "Restored from cache.",
 }
 class StreamObserver(BuildObserver):
     def __init__(self, stream=None):
@@ -168,21 +291,219 @@ class StreamObserver(BuildObserver):
         self.stream = stream or sys.stdout
 
     def _message(self, phase, type_, step=None, state=None, data=None):
-        fmt = "%s %s\n"
+        sep = " "
         if type_ == Message.STATE_UPDATE:
-            data = ENTER_STATE_TEXTS.get(state)
-            if data is None:
+            text = ENTER_STATE_TEXTS.get(state)
+            if text is None:
                 return
+            if data:
+                text = "%s (usually %s, about %s left)" % (text,
+                    format_duration(data[0]), format_duration(data[1]))
+            data = text
         elif type_ == Message.CONTAINER_MSG:
-            fmt = "%s >> %s\n"
+            sep = " >> "
         elif type_ == Message.MANAGER_MSG:
-            fmt = "%s : %s\n"
+            sep = " : "
         else:
             return
-        phase_s = phase.name
+        prefix = phase.name
         if step is not None:
-            phase_s += ' ' + str(step)
+            prefix += ' ' + str(step)
+        prefix += sep
         if isinstance(data, str):
             data = (data,)
-        for line in data:
-            self.stream.write(fmt % (phase_s, line))
+        # one write per message, as container messages may hold many lines
+        self.stream.write(''.join([prefix + line + '\n' for line in data]))
+
+
+class JsonLinesObserver(BuildObserver):
+    """
+    Writes each message as a compact JSON object on its own line:
+    {"type": "message", "phase": "BUILD", "msg": "CONTAINER_MSG",
+    "step": "html", "ref": 0, "state": "RUNNING", "data": ["line 1", "line 2"],
+    "time": 1600000000.1}. The keys are the same as in the messages of the
+    build daemon. Container messages hold batches of lines. The time is when
+    the message was sent, also behind a FanOutObserver. The stream is flushed
+    after other messages and at most every FLUSH_INTERVAL seconds after
+    container messages.
+    """
+    FLUSH_INTERVAL = 0.5
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def __init__(self, stream=None):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self._lock = Lock()
+        self._flushed = clock()
+
+    def write(self, obj, timestamp=None, flush=True):
+        obj['time'] = round(timestamp if timestamp is not None else time(), 6)
+        line = self._encode(obj) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            now = clock()
+            if flush or now - self._flushed >= self.FLUSH_INTERVAL:
+                self.stream.flush()
+                self._flushed = now
+
+    def write_result(self, result):
+        """Writes the final result of a build with its timings"""
+        self.write({
+            'type': 'result',
+            'code': result.code,
+            'error': result.error,
+            'step': str(result.step) if result.step is not None else None,
+            'timings': result.timings.as_dict() if result.timings is not None else None,
+        })
+
+    def write_error(self, error, code=1):
+        """Writes the result of a build, which wasn't started"""
+        self.write({
+            'type': 'result',
+            'code': code,
+            'error': error,
+            'step': None,
+            'timings': None,
+        })
+
+    def _message(self, phase, type_, step=None, state=None, data=None):
+        self._timed_message(phase, type_, step, state, data, time())
+
+    def _timed_message(self, phase, type_, step, state, data, timestamp):
+        self.write({
+            'type': 'message',
+            'phase': phase.name,
+            'msg': type_.name,
+            'step': str(step) if step is not None else None,
+            'ref': getattr(step, 'ref', None),
+            'state': state.name if state is not None else None,
+            'data': data,
+        }, timestamp, flush=type_ != Message.CONTAINER_MSG)
+
+
+class Overflow(Enum):
+    BLOCK = 'block'          # wait for space in the queue
+    DROP_OLDEST = 'drop'     # drop the oldest queued container message
+    SUMMARIZE = 'summarize'  # drop new container messages and report their line count
+
+
+class ObserverSink:
+    """
+    Passes messages to `observer._timed_message` from a worker thread through
+    a queue of `maxsize` messages. When the queue is full, container messages
+    are handled by the `overflow` policy. Other messages are never dropped and
+    only wait for space with Overflow.BLOCK.
+    """
+    def __init__(self, observer, maxsize=1024, overflow=Overflow.BLOCK):
+        self.observer = observer
+        self.maxsize = maxsize
+        self.overflow = Overflow(overflow)
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = Condition()
+        self._summaries = OrderedDict()
+        self._unfinished = 0
+        self._closed = False
+        self._thread = Thread(target=self._run, daemon=True,
+            name="observer %s" % (observer.__class__.__name__,))
+        self._thread.start()
+
+    def put(self, message):
+        droppable = message[1] == Message.CONTAINER_MSG
+        with self._cond:
+            if self._closed:
+                return
+            full = len(self._queue) >= self.maxsize
+            if full and droppable and self.overflow == Overflow.SUMMARIZE:
+                self._drop(message)
+                return
+            if full and droppable and self.overflow == Overflow.DROP_OLDEST:
+                for i, item in enumerate(self._queue):
+                    if item[1] == Message.CONTAINER_MSG:
+                        del self._queue[i]
+                        self._unfinished -= 1
+                        self.dropped += len(item[4])
+                        break
+            elif self.overflow == Overflow.BLOCK:
+                while len(self._queue) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+            if self._summaries:
+                self._add_summaries()
+            self._append(message)
+
+    def _append(self, message):
+        self._queue.append(message)
+        self._unfinished += 1
+        self._cond.notify_all()
+
+    def _drop(self, message):
+        phase, _type, step, state, data, _timestamp = message
+        self.dropped += len(data)
+        summary = self._summaries.get(step)
+        self._summaries[step] = (phase, state, (summary[2] if summary else 0) + len(data))
+
+    def _add_summaries(self):
+        for step, (phase, state, count) in self._summaries.items():
+            self._append((phase, Message.MANAGER_MSG, step, state,
+                ["%d lines of output were dropped" % (count,)], time()))
+        self._summaries.clear()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                message = self._queue.popleft()
+                self._cond.notify_all()
+            try:
+                self.observer._timed_message(*message)
+            except Exception:
+                logger.exception("Observer %r failed to handle a message", self.observer)
+            with self._cond:
+                self._unfinished -= 1
+                self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Waits until the queued messages are handled"""
+        with self._cond:
+            if self._summaries:
+                self._add_summaries()
+            return self._cond.wait_for(lambda: not self._unfinished, timeout)
+
+    def close(self):
+        self.join()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class FanOutObserver(BuildObserver):
+    """
+    Sends the messages to several observers without waiting for them. Each
+    observer gets its own ObserverSink, so a slow one delays only itself.
+    The state and the timings of the build are kept here. Observers are
+    called via `_message`, like observers receiving messages from a daemon.
+    The queues are drained, when the build is done.
+    """
+    def __init__(self, observers, maxsize=1024, overflow=Overflow.BLOCK):
+        super().__init__()
+        self.sinks = [obs if isinstance(obs, ObserverSink)
+            else ObserverSink(obs, maxsize, overflow) for obs in observers]
+
+    def _message(self, phase, type_, step=None, state=None, data=None):
+        # the time is taken now, as the sinks deliver the message later
+        message = (phase, type_, step, state, data, time())
+        for sink in self.sinks:
+            sink.put(message)
+
+    def done(self, data=None):
+        super().done(data)
+        for sink in self.sinks:
+            sink.join()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
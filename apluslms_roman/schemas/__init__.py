@@ -1,6 +1,10 @@
 from os.path import join
+from apluslms_yamlidator.compiler import validator_compiler
 from apluslms_yamlidator.schemas import schema_registry
 from .. import CACHE_DIR
 
 schema_registry.register_module(__name__)
 schema_registry.register_cache(join(CACHE_DIR, 'schemas'))
+validator_compiler.register(
+    ('roman_project', 'roman_settings', 'roman_environment'),
+    join(CACHE_DIR, 'validators'))
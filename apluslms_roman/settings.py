@@ -6,6 +6,7 @@ from apluslms_yamlidator.utils.collections import OrderedDefaultDict, OrderedDic
 from apluslms_yamlidator.utils.version import Version
 
 from . import CONFIG_DIR
+from . import schemas # register our schemas
 from .utils.translation import _
 
 
@@ -120,6 +121,8 @@ class GlobalSettings(ArgumentSettings):
     ARGUMENT_GROUPS = (
         # name, title, description
         ('backend', _("Backend"), _("Backend driver configuration")),
+        ('logs', _("Build logs"), _("Stored build log configuration")),
+        ('schemas', _("Schemas"), _("Remote schema cache configuration")),
     )
 
     ARGUMENTS = (
@@ -127,4 +130,13 @@ class GlobalSettings(ArgumentSettings):
         ('backend', 'backend', _('MODULE')),
         ('docker.host', 'backend', _('URL')),
         ('docker.timeout', 'backend'),
+        ('docker.step_timeout', 'backend', _('SECONDS')),
+        ('docker.wait_timeout', 'backend', _('SECONDS')),
+        ('docker.reuse_containers', 'backend'),
+        ('docker.warm_images', 'backend', _('IMAGES')),
+        ('logs.max_size', 'logs', _('MB')),
+        ('logs.max_days', 'logs', _('DAYS')),
+        ('schemas.offline', 'schemas'),
+        ('schemas.ttl', 'schemas', _('SECONDS')),
+        ('schemas.timeout', 'schemas', _('SECONDS')),
     )
@@ -1,5 +1,6 @@
 import re
 from collections.abc import MutableMapping, Sequence
+from functools import lru_cache
 
 from json import dumps as to_json
 
@@ -11,7 +12,8 @@ from .translation import _
 
 
 # simple variables with no substitutions, e.g. ${PATH}
-var_rgx = r'\$\{[a-zA-Z_][a-zA-Z0-9_]*\}'
+name_rgx = r'[a-zA-Z_][a-zA-Z0-9_]*'
+var_rgx = r'\$\{%s\}' % (name_rgx,)
 # if a var doesn't match the above regex but matches this one, it
 # either has some sort of substitution syntax or is a variable
 # with forbidden characters. e.g. ${PATH:-$HOME} (substitution)
@@ -34,13 +36,6 @@ class EnvError(Exception):
     pass
 
 
-def find_separator(pattern):
-    separator = [s for s in SEPARATORS if s in pattern]
-    if not separator:
-        raise EnvError(_("Unrecognized parameter substitution pattern"))
-    return min(separator, key=lambda s: pattern.index(s))
-
-
 def to_str(data):
     if data is None or isinstance(data, str):
         return data
@@ -86,6 +81,7 @@ SEPARATORS = OrderedDict((
 ))
 
 
+@lru_cache(256)
 def parse_replacement_pattern(pattern):
     matches = [rgx for rgx in replacement_rgxs if re.fullmatch(rgx, pattern)]
     if not matches:
@@ -129,52 +125,169 @@ def update(env, key, value):
     env[key] = value
 
 
-def get_val(env, key, value):
-    references_self = _("Variable {} references itself")
-    not_defined = _("{} hasn't been defined")
+# the start of a reference
+var_start_rgx = re.compile(r'\$\{')
+# a reference or a brace in a substitution operand
+operand_token_rgx = re.compile(r'\$\{|[{}]')
+# the end of a name in a reference: a separator, '}' or an invalid brace
+name_end_rgx = re.compile(r'\$\{|[{}]|:-|:\+|//?')
 
-    if isinstance(value, int):
-        return value
-    value = to_str(value)
+
+class Var:
+    """${name}"""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, env, key):
+        if self.name not in env:
+            raise_not_defined(self.name, key)
+        return env[self.name]
+
+
+class Substitution:
+    """${name<separator>operand}, where the operand may contain references"""
+    __slots__ = ('name', 'sep', 'operand')
+
+    def __init__(self, name, sep, operand):
+        self.name = name
+        self.sep = sep
+        self.operand = operand
+
+    def evaluate(self, env, key):
+        operand = join_parts(self.operand, env, key)
+        val = env.get(self.name, None)
+        if val is None and not SEPARATORS[self.sep]['allow_missing']:
+            raise_not_defined(self.name, key)
+        return SEPARATORS[self.sep]['func'](val, operand)
+
+
+def raise_not_defined(name, key):
+    if name == key:
+        raise EnvError(_("Variable {} references itself").format(key))
+    raise EnvError(_("{} hasn't been defined").format(name))
+
+
+def join_parts(parts, env, key):
+    return ''.join(part if isinstance(part, str) else to_str(part.evaluate(env, key))
+        for part in parts)
+
+
+def parse_parts(value, pos=0, nested=False):
+    """
+    Parses text and references in `value` starting at `pos`.
+    A nested part is an operand, which ends at '}'.
+    Returns (parts, end) or None, when an operand is not closed or
+    contains a brace, i.e. the reference is plain text.
+    """
+    parts = []
+    text_start = pos
     while True:
-        var = re.search(sub_rgx, value)
-        if not var:
+        match = (operand_token_rgx if nested else var_start_rgx).search(value, pos)
+        if match is None:
+            if nested:
+                return None
+            pos = len(value)
+            break
+        pos = match.start()
+        token = match.group()
+        if token == '${':
+            parsed = parse_reference(value, pos)
+            if parsed is None:
+                if nested:
+                    return None
+                pos += 2
+                continue
+            if text_start < pos:
+                parts.append(value[text_start:pos])
+            node, pos = parsed
+            parts.append(node)
+            text_start = pos
+        elif token == '}':
             break
-        var = var.group(0)
-        if not re.fullmatch(var_rgx, var):
-            # ${var} -> var
-            content = var[2:-1]
-            sep = find_separator(content)
-
-            parts = content.partition(sep)[::2]
-            val = env.get(parts[0], None)
-            if val is None and not SEPARATORS[sep]['allow_missing']:
-                if key == parts[0]:
-                    raise EnvError(references_self.format(key))
-                raise EnvError(not_defined.format(parts[0]))
-            val = SEPARATORS[sep]['func'](val, parts[1])
-            if value == var:
-                return val
-            value = value.replace(var, val)
         else:
-            val = var[2:-1]
-            if val not in env:
-                if val == key:
-                    raise EnvError(references_self.format(key))
-                raise EnvError(not_defined.format(val))
-            val = env[val]
-            if value == var:
-                return val
-            val = to_str(val)
-            value = value.replace(var, val)
+            return None
+    if text_start < pos:
+        parts.append(value[text_start:pos])
+    return parts, pos
+
+
+def parse_reference(value, pos):
+    """
+    Parses a reference starting with '${' at `pos`.
+    Returns (node, end) or None, when the text is not a reference.
+    """
+    start = pos + 2
+    match = name_end_rgx.search(value, start)
+    if match is None:
+        return None
+    token = match.group()
+    name = value[start:match.start()]
+    if token == '${':
+        # a reference inside the name, e.g. ${${A}x}, is not supported
+        if closes_after_reference(value, match.start()):
+            raise EnvError(_("Unrecognized parameter substitution pattern"))
+        return None
+    if token == '}':
+        if not name:
+            return None
+        if not re.fullmatch(name_rgx, name):
+            raise EnvError(_("Unrecognized parameter substitution pattern"))
+        return Var(name), match.end()
+    if token in SEPARATORS:
+        parsed = parse_parts(value, match.end(), nested=True)
+        if parsed is None:
+            return None
+        operand, end = parsed
+        return Substitution(name, token, tuple(operand)), end + 1
+    return None
+
+
+def closes_after_reference(value, pos):
+    """
+    Returns true, if the references starting at `pos` are followed by the
+    end of the name of the reference containing them.
+    """
+    while True:
+        parsed = parse_reference(value, pos)
+        if parsed is None:
+            return False
+        match = name_end_rgx.search(value, parsed[1])
+        if match is None or match.group() == '{':
+            return False
+        if match.group() != '${':
+            return True
+        pos = match.start()
+
+
+@lru_cache(4096)
+def compile_value(value):
+    """
+    Parses `value` once into a tuple of strings and reference nodes.
+    Nested references are evaluated before the reference containing them.
+    """
+    return tuple(parse_parts(value)[0])
 
-    return value
+
+def get_val(env, key, value):
+    if isinstance(value, int):
+        return value
+    value = to_str(value)
+    if value is None:
+        return value
+    parts = compile_value(value)
+    if len(parts) == 1 and not isinstance(parts[0], str):
+        # a plain reference keeps the type of the value, e.g. a list
+        return parts[0].evaluate(env, key)
+    return join_parts(parts, env, key)
 
 
 class EnvDict(OrderedDict):
 
     def __init__(self, *args):
         self.envs = OrderedDict()
+        self._combined = None
         for env in args:
             self.add_env(*env)
         super().__init__()
@@ -183,6 +296,12 @@ class EnvDict(OrderedDict):
         return "%s(%s)" % (self.__class__.__name__, super().__str__())
 
     def add_env(self, environment, name):
+        self._combined = None
+        if isinstance(environment, EnvDict):
+            # keep the layers of a nested EnvDict, so they are expanded
+            # in order and errors refer to the original sources
+            self.envs.update(environment.envs)
+            return
         self.envs[name] = environment or []
 
     def get_env(self, name):
@@ -195,6 +314,7 @@ class EnvDict(OrderedDict):
             or (isinstance(item, str) and key == item.split('=')[0])]
 
     def set_in_env(self, name, key, val):
+        self._combined = None
         env = self.envs[name]
         item = '{}={}'.format(key, val)
         matches = self.find_in_env(name, key)
@@ -210,6 +330,7 @@ class EnvDict(OrderedDict):
         self.envs[name] = env
 
     def delete_from_env(self, name, key, delete_unset=False):
+        self._combined = None
         if key.isdigit():
             self.envs[name].pop(int(key))
         else:
@@ -223,37 +344,56 @@ class EnvDict(OrderedDict):
             return True
 
     def add_to_env(self, name, val):
+        self._combined = None
         self.envs[name].append(val)
 
     def get_combined(self):
-        combined = OrderedDict()
+        """
+        Returns the variables of all layers expanded in order. The result is
+        memoized until the layers are changed via this object, thus it must
+        not be modified. Use `combine` to expand a layer on top of it.
+        """
+        if self._combined is None:
+            combined = OrderedDict()
+            for name, env in self.envs.items():
+                self._expand(combined, env, name)
+            self._combined = combined
+        return self._combined
+
+    def combine(self, environment, name):
+        """
+        Returns the variables of all layers with `environment` expanded on top.
+        The layers are expanded only once and the result is copied, so the
+        caller may modify it without changing the memoized variables.
+        """
+        combined = OrderedDict(self.get_combined())
+        if environment:
+            self._expand(combined, environment, name)
+        return combined
 
-        def expand_env(item, env_name, env_idx):
+    def _expand(self, combined, env, env_name):
+        for idx, item in enumerate(env):
+            if isinstance(item, str):
+                key, _, val = item.partition('=')
+                item = {key: val}
             if 'name' in item:
                 if 'unset' in item:
                     if to_bool(item['unset']) and item['name'] in combined:
                         del combined[item['name']]
-                        return
-                else:
-                    item = {item['name']: item['value']}
+                    continue
+                item = {item['name']: item['value']}
             for key in item:
                 try:
                     update(combined, key, item[key])
                 except EnvError as err:
-                    self._raise_err(str(err), env_idx, env_name)
-
-        for name, env in self.envs.items():
-            for idx, item in enumerate(env):
-                if isinstance(item, str):
-                    key, _, val = item.partition('=')
-                    item = {key: val}
-                expand_env(item, name, idx)
-        return combined
+                    self._raise_err(str(err), idx, env_name, env)
 
     # env_idx is used when env is a list
-    def _raise_err(self, message, idx, env_name):
-        env = self.envs[env_name]
-        if hasattr(env, 'get_root'):
+    def _raise_err(self, message, idx, env_name, env=None):
+        if env is None:
+            env = self.envs[env_name]
+        # documents loaded from the configuration cache have no line info
+        if hasattr(env, 'get_root') and hasattr(env.get_data(), 'lc'):
             source_file = env.get_root().path
             file_info = "{} ({})".format(env_name, source_file)
 
@@ -0,0 +1,102 @@
+from codecs import getincrementaldecoder
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .scheduler import Deadlines
+
+
+MAX_BYTES = 64 * 1024
+MAX_DELAY = 0.1
+FLUSH_WORKERS = 4
+
+_deadlines = Deadlines('log flush')
+# the delayed writes may block, e.g. on a full observer queue, so they are
+# not done in the deadlines thread. threads are started on first use
+_flushers = ThreadPoolExecutor(max_workers=FLUSH_WORKERS)
+
+
+class LineDecoder:
+    """
+    Decodes a stream of byte chunks incrementally. Chunks may end in the
+    middle of a line or of a multi-byte character. The rest is kept until
+    the next chunk.
+    """
+    def __init__(self, encoding='utf-8'):
+        self._decoder = getincrementaldecoder(encoding)('replace')
+        self._rest = ''
+
+    def decode(self, data, final=False):
+        """Returns the complete lines in `data`, or all text if `final` is true"""
+        text = self._rest + self._decoder.decode(data, final)
+        if final:
+            self._rest = ''
+            return text
+        end = text.rfind('\n') + 1
+        self._rest = text[end:]
+        return text[:end]
+
+
+class LogBuffer:
+    """
+    Collects the output of a step into multi-line messages. The lines are
+    passed to `write` when `max_bytes` bytes are buffered or at most
+    `max_delay` seconds after the first of them arrived. The delayed writes
+    are done from the threads of `executor`, so `write` must be thread-safe.
+    """
+    def __init__(self, write, max_bytes=MAX_BYTES, max_delay=MAX_DELAY,
+            encoding='utf-8', deadlines=None, executor=None):
+        self.write = write
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._encoding = encoding
+        self._decoder = LineDecoder(encoding)
+        self._deadlines = deadlines or _deadlines
+        self._executor = executor or _flushers
+        self._lock = Lock()
+        self._parts = []
+        self._size = 0
+        self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def feed(self, data):
+        self._add(self._decoder.decode(data))
+
+    def _add(self, text):
+        if not text:
+            return
+        with self._lock:
+            self._parts.append(text)
+            self._size += len(text.encode(self._encoding, 'replace'))
+            if self._size >= self.max_bytes or self.max_delay <= 0:
+                self._flush()
+            elif self._handle is None:
+                self._handle = self._deadlines.add(self.max_delay, self._flush_later)
+
+    def _flush_later(self):
+        # called by the deadlines thread, which must not wait for `write`
+        self._executor.submit(self.flush)
+
+    def _flush(self):
+        # called with the lock held, so the writes stay in order
+        if self._handle is not None:
+            self._deadlines.cancel(self._handle)
+            self._handle = None
+        if self._parts:
+            text = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.write(text)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Writes the buffered text and the last line without a newline"""
+        self._add(self._decoder.decode(b'', final=True))
+        self.flush()
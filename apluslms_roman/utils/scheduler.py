@@ -0,0 +1,200 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Lock, Thread
+
+from .timing import clock
+from .translation import _
+
+
+logger = logging.getLogger(__name__)
+
+
+class StepGraphError(ValueError):
+    pass
+
+
+class StepGraph:
+    """
+    Dependency graph of build steps.
+
+    A step with `depends_on` set to None depends on the step before it, which
+    keeps the sequential behaviour of configurations without dependencies.
+    Otherwise, `depends_on` is a sequence of step refs. References to steps
+    that are not part of the graph are ignored, as those are not built.
+    """
+    def __init__(self, steps):
+        self.steps = list(steps)
+        by_ref = {step.ref: step for step in self.steps}
+        self.dependencies = {}
+        prev = None
+        for step in self.steps:
+            deps = getattr(step, 'depends_on', None)
+            if deps is None:
+                deps = (prev,) if prev is not None else ()
+            else:
+                deps = tuple(by_ref[ref] for ref in deps if ref in by_ref)
+            self.dependencies[step] = deps
+            prev = step
+        self.order = self._sort()
+
+    def _sort(self):
+        order = []
+        done = set()
+        remaining = list(self.steps)
+        while remaining:
+            ready = [step for step in remaining
+                if all(dep in done for dep in self.dependencies[step])]
+            if not ready:
+                raise StepGraphError(_("Steps have circular dependencies: {}")
+                    .format(', '.join(str(step) for step in remaining)))
+            order.extend(ready)
+            done.update(ready)
+            remaining = [step for step in remaining if step not in done]
+        return order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+
+def run_graph(graph, func, workers=1, stop=None, cancel=None):
+    """
+    Call `func(step)` for every step in `graph` after all of its dependencies
+    have completed. Up to `workers` calls are executed concurrently.
+
+    If `stop(result)` returns true, no new steps are started and the function
+    returns after the running ones have completed.
+
+    If the calling thread is interrupted, e.g. with KeyboardInterrupt, while
+    calls are running in other threads, `cancel()` is called to stop them and
+    the exception is raised after they have returned.
+
+    Returns a list of (step, result) tuples in the order of completion.
+    """
+    results = []
+    if not workers or workers <= 1:
+        for step in graph:
+            result = func(step)
+            results.append((step, result))
+            if stop and stop(result):
+                break
+        return results
+
+    done = set()
+    waiting = list(graph)
+    running = {}
+    stopped = False
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            if not stopped:
+                for step in list(waiting):
+                    if len(running) >= workers:
+                        break
+                    if all(dep in done for dep in graph.dependencies[step]):
+                        waiting.remove(step)
+                        running[executor.submit(func, step)] = step
+            if not running:
+                break
+            finished, _pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                result = future.result()
+                results.append((step, result))
+                done.add(step)
+                if stop and stop(result):
+                    stopped = True
+    except BaseException:
+        for future in running:
+            future.cancel()
+        if cancel is not None:
+            cancel()
+        executor.shutdown()
+        raise
+    executor.shutdown()
+    return results
+
+
+class Overlaps:
+    """
+    Tracks whether a task ran at the same time as other tasks, e.g. whether
+    other steps wrote to the build directory while a step was running.
+    """
+    def __init__(self):
+        self._running = {}
+        self._lock = Lock()
+
+    def start(self, task):
+        with self._lock:
+            for other in self._running:
+                self._running[other] = True
+            self._running[task] = bool(self._running)
+
+    def end(self, task):
+        """Returns true, if other tasks were running after start(task)"""
+        with self._lock:
+            return self._running.pop(task)
+
+
+class Deadlines:
+    """
+    Calls functions after a delay from a single thread, which is started on
+    first use. Callbacks should return quickly, as they delay the later ones.
+    """
+    def __init__(self, name='deadlines'):
+        self._heap = []
+        self._counter = count()
+        self._cond = Condition()
+        self._thread = None
+        self._name = name
+
+    def add(self, seconds, callback):
+        """Calls `callback` after `seconds`. Returns a handle for cancel()."""
+        entry = [clock() + seconds, next(self._counter), callback]
+        with self._cond:
+            heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        """
+        Cancels the callback. Returns false, if it has already been called
+        or it is being called.
+        """
+        with self._cond:
+            callback, entry[2] = entry[2], None
+            return callback is not None
+
+    def _next(self):
+        # called with the lock held, returns a due callback or None after waiting
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heappop(heap)
+        if not heap:
+            self._cond.wait()
+            return None
+        delay = heap[0][0] - clock()
+        if delay > 0:
+            self._cond.wait(delay)
+            return None
+        entry = heappop(heap)
+        # taken, so cancel() can tell that the callback will run
+        callback, entry[2] = entry[2], None
+        return callback
+
+    def _run(self):
+        while True:
+            with self._cond:
+                callback = self._next()
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Deadline callback %r failed", callback)
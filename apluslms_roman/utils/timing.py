@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+clock = perf_counter
+
+
+class Timings:
+    """
+    Durations of named stages in seconds, in the order the stages were first
+    recorded. Recording the same stage again adds to its duration.
+    """
+    def __init__(self):
+        self._stages = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.add(stage, clock() - start)
+
+    def get(self, stage, default=None):
+        return self._stages.get(stage, default)
+
+    def __getitem__(self, stage):
+        return self._stages[stage]
+
+    def __contains__(self, stage):
+        return stage in self._stages
+
+    def __iter__(self):
+        return iter(self._stages)
+
+    def __len__(self):
+        return len(self._stages)
+
+    def items(self):
+        return list(self._stages.items())
+
+    def as_dict(self):
+        return OrderedDict(self._stages)
+
+
+class BuildTimings:
+    """
+    Timings of a build: `phases` contains the duration of each phase and
+    `steps` contains Timings for each step, e.g. the duration of the step in
+    each phase and of the stages inside it, like 'pull' or 'wait'.
+    """
+    def __init__(self):
+        self.phases = Timings()
+        self.steps = OrderedDict()
+        self._lock = Lock()
+
+    def step(self, step):
+        with self._lock:
+            timings = self.steps.get(step)
+            if timings is None:
+                timings = self.steps[step] = Timings()
+            return timings
+
+    def as_dict(self):
+        return {
+            'phases': self.phases.as_dict(),
+            'steps': OrderedDict((str(step), timings.as_dict())
+                for step, timings in self.steps.items()),
+        }
+
+
+def format_duration(seconds):
+    """Returns a short text like '45s', '2m 05s' or '1h 02m'"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "%ds" % (seconds,)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return "%dm %02ds" % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "%dh %02dm" % (hours, minutes)
+
+
+def format_timings(timings):
+    """Returns lines with a table of the phase and step timings"""
+    lines = []
+    for phase, seconds in timings.phases.items():
+        lines.append("%-24s %9.3fs" % (phase, seconds))
+    for step, step_timings in timings.steps.items():
+        lines.append("step %s:" % (step,))
+        for stage, seconds in step_timings.items():
+            lines.append("  %-22s %9.3fs" % (stage, seconds))
+    return lines
@@ -0,0 +1,88 @@
+import json
+from contextlib import contextmanager
+from os import getpid
+from threading import Lock, current_thread, get_ident
+
+from .timing import clock
+
+
+class Tracer:
+    """
+    Collects events in the Chrome Trace Event Format, which can be opened in
+    chrome://tracing or Perfetto. Tracing is off until start() is called and
+    the methods do nothing while it's off.
+    """
+    def __init__(self):
+        self._events = None
+        self._threads = set()
+        self._origin = 0.0
+        self._lock = Lock()
+        self._pid = getpid()
+
+    @property
+    def enabled(self):
+        return self._events is not None
+
+    def start(self):
+        with self._lock:
+            self._events = []
+            self._threads = set()
+            self._origin = clock()
+
+    def stop(self):
+        with self._lock:
+            events, self._events = self._events, None
+        return events or []
+
+    def _ts(self, time):
+        return round((time - self._origin) * 1e6, 3)
+
+    def _add(self, event):
+        tid = get_ident()
+        event['pid'] = self._pid
+        event['tid'] = tid
+        with self._lock:
+            if self._events is None:
+                return
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._events.append({'ph': 'M', 'name': 'thread_name',
+                    'pid': self._pid, 'tid': tid,
+                    'args': {'name': current_thread().name}})
+            self._events.append(event)
+
+    def complete(self, name, start, seconds, cat='roman', args=None):
+        """Adds a span, which started at `start` (utils.timing.clock) and took `seconds`"""
+        if self._events is None:
+            return
+        event = {'ph': 'X', 'name': name, 'cat': cat,
+            'ts': self._ts(start), 'dur': round(seconds * 1e6, 3)}
+        if args:
+            event['args'] = args
+        self._add(event)
+
+    @contextmanager
+    def span(self, name, cat='roman', args=None):
+        if self._events is None:
+            yield
+            return
+        start = clock()
+        try:
+            yield
+        finally:
+            self.complete(name, start, clock() - start, cat, args)
+
+    def counter(self, name, values, cat='roman'):
+        if self._events is None:
+            return
+        self._add({'ph': 'C', 'name': name, 'cat': cat,
+            'ts': self._ts(clock()), 'args': values})
+
+    def write(self, path):
+        """Writes the collected events to `path` and stops tracing"""
+        data = {'traceEvents': self.stop(), 'displayTimeUnit': 'ms'}
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+tracer = Tracer()
@@ -0,0 +1,236 @@
+import logging
+import struct
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from fnmatch import fnmatch
+from os import close, fsencode, fsdecode, read, stat, strerror, walk
+from os.path import join, normpath, relpath
+from select import select
+from time import monotonic, sleep
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IGNORE = ('_build', '.git', '.hg', '.svn', '__pycache__', '*.swp', '*~')
+# reported, when changes were lost and any file may have changed
+ALL_CHANGED = '.'
+# seconds, some file systems store the modification times in seconds
+MTIME_SLACK = 1.0
+
+
+class Watcher:
+    """
+    Base for watchers. `wait(timeout)` blocks until files under `path`
+    change or the timeout (seconds, None for forever) passes and returns the
+    set of changed paths relative to `path`. The set contains ALL_CHANGED,
+    when the changes could not be tracked.
+    """
+    def __init__(self, path, ignore=DEFAULT_IGNORE):
+        self.path = path
+        self.ignore = tuple(ignore)
+
+    def is_ignored(self, rel):
+        name = rel.rpartition('/')[2]
+        return any(fnmatch(rel, p) or fnmatch(name, p) for p in self.ignore)
+
+    def iter_dirs(self, top=None):
+        for root, dirs, files in walk(top or self.path):
+            base = normpath(relpath(root, self.path))
+            dirs[:] = [d for d in dirs if not self.is_ignored(normpath(join(base, d)))]
+            yield root, base, files
+
+    def scan(self):
+        """Returns (mtime, size) of the watched files by the relative paths"""
+        state = {}
+        for root, base, files in self.iter_dirs():
+            for name in files:
+                rel = normpath(join(base, name))
+                if self.is_ignored(rel):
+                    continue
+                try:
+                    st = stat(join(root, name))
+                except OSError:
+                    continue
+                state[rel] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def wait(self, timeout=None):
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget changes that happened since the last wait"""
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, path, ignore=DEFAULT_IGNORE, interval=1.0):
+        super().__init__(path, ignore)
+        self.interval = interval
+        self._state = self.scan()
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            state = self.scan()
+            old, self._state = self._state, state
+            changes = {rel for rel in old.keys() | state.keys()
+                if old.get(rel) != state.get(rel)}
+            if changes:
+                return changes
+            if deadline is not None:
+                left = deadline - monotonic()
+                if left <= 0:
+                    return set()
+                sleep(min(self.interval, left))
+            else:
+                sleep(self.interval)
+
+    def reset(self):
+        self._state = self.scan()
+
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, path, ignore=DEFAULT_IGNORE):
+        super().__init__(path, ignore)
+        libname = find_library('c')
+        if not libname:
+            raise OSError("libc not found")
+        self._libc = libc = CDLL(libname, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not supported")
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno))
+        self._dirs = {}
+        self._add_tree(path)
+
+    def _add_tree(self, path):
+        for root, base, files in self.iter_dirs(path):
+            wd = self._libc.inotify_add_watch(self._fd, fsencode(root), IN_WATCH_MASK)
+            if wd >= 0:
+                self._dirs[wd] = base
+            else:
+                logger.debug("Failed to watch %s: %s", root, strerror(get_errno()))
+
+    def _read(self):
+        changes = set()
+        try:
+            data = read(self._fd, 65536)
+        except BlockingIOError:
+            return changes
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                changes.add(ALL_CHANGED)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            base = self._dirs.get(wd)
+            if base is None or not name:
+                continue
+            rel = normpath(join(base, name))
+            if self.is_ignored(rel):
+                continue
+            changes.add(rel)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(join(self.path, rel))
+        return changes
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            left = None if deadline is None else max(0, deadline - monotonic())
+            ready, _w, _x = select([self._fd], [], [], left)
+            if not ready:
+                return set()
+            changes = self._read()
+            if changes:
+                return changes
+
+    def reset(self):
+        while select([self._fd], [], [], 0)[0]:
+            self._read()
+
+    def close(self):
+        if self._fd >= 0:
+            close(self._fd)
+            self._fd = -1
+
+
+def get_watcher(path, ignore=DEFAULT_IGNORE):
+    """Returns an inotify based watcher when supported, else a polling one"""
+    try:
+        return InotifyWatcher(path, ignore)
+    except (OSError, AttributeError) as err:
+        logger.debug("Using a polling watcher, because inotify failed: %s", err)
+        return PollingWatcher(path, ignore)
+
+
+def get_edits(before, after, writes=()):
+    """
+    Returns the paths changed between the scans `before` and `after`, except
+    the files modified during any of the (start, end) times in `writes`.
+    Removed files are returned only, if there are no `writes`.
+    """
+    edits = set()
+    for rel in before.keys() | after.keys():
+        state = after.get(rel)
+        if state == before.get(rel):
+            continue
+        if state is None:
+            if not writes:
+                edits.add(rel)
+            continue
+        mtime = state[0] / 1e9
+        if not any(start - MTIME_SLACK <= mtime <= end + MTIME_SLACK
+                for start, end in writes):
+            edits.add(rel)
+    return edits
+
+
+def iter_changes(watcher, delay=0.5):
+    """
+    Yields sets of changed paths. Changes are collected until there has been
+    no new changes for `delay` seconds, so a burst of edits is yielded once.
+    """
+    while True:
+        changes = watcher.wait()
+        if not changes:
+            continue
+        while True:
+            more = watcher.wait(delay)
+            if not more:
+                break
+            changes |= more
+        yield changes
@@ -0,0 +1,142 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from ruamel.yaml import YAMLError
+
+from apluslms_yamlidator.document import Document
+from apluslms_yamlidator.remote import remote_schemas
+from apluslms_yamlidator.validator import ValidationError, Validator, render_error
+
+from . import schemas # register our schemas
+from .utils.translation import _
+
+
+DocumentResult = namedtuple('DocumentResult', ('index', 'schema_id', 'error'))
+
+
+class FileResult:
+    """
+    Validation result of a data file. Contains only plain data, so it can be
+    returned from a worker process. `message` is a note about the file
+    (e.g. it's empty) and `error` tells why the file could not be read.
+    The error of a document is a list of lines from render_error.
+    """
+    __slots__ = ('path', 'documents', 'message', 'error')
+
+    def __init__(self, path, documents=(), message=None, error=None):
+        self.path = path
+        self.documents = list(documents)
+        self.message = message
+        self.error = error
+
+    @property
+    def invalid(self):
+        return [doc for doc in self.documents if doc.error is not None]
+
+    @property
+    def ok(self):
+        return self.error is None and not self.invalid
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'ok': self.ok,
+            'message': self.message,
+            'error': self.error,
+            'documents': [{
+                'index': doc.index,
+                'schema': doc.schema_id,
+                'ok': doc.error is None,
+                'error': '\n'.join(doc.error).strip() if doc.error else None,
+            } for doc in self.documents],
+        }
+
+
+class FileValidator:
+    def __init__(self, schema_name, max_version=None):
+        self.schema_name = schema_name
+        self.max_version = max_version
+        self.Container = Document.bind(schema=schema_name).Container
+
+    def warm(self):
+        """Creates the validators for all versions of the schema beforehand"""
+        validator = Validator.get_default()
+        for version in validator.get_versions(self.schema_name):
+            validator.get_validator(self.schema_name, version.major, version.minor)
+
+    def get_documents(self, container):
+        if self.max_version is None:
+            return container, None
+        try:
+            doc = container.get_latest(self.max_version, validate=False)
+        except KeyError:
+            return (), _("No elements with max version %s found!") % self.max_version
+        if doc.version is None:
+            doc.version = self.max_version
+        return (doc,), None
+
+    def validate(self, path):
+        try:
+            container = self.Container(path)
+        except (OSError, ValueError, YAMLError) as err:
+            return FileResult(path, error=str(err))
+        if not container:
+            return FileResult(container.path, message=_("The data file is empty!"))
+
+        documents, message = self.get_documents(container)
+        results = []
+        for doc in documents:
+            try:
+                doc.validate(quiet=True)
+            except ValidationError as e:
+                error = render_error(e)
+            else:
+                error = None
+            results.append(DocumentResult(doc.index, doc.validator_id, error))
+        return FileResult(container.path, results, message)
+
+
+_worker_validator = None
+_worker_key = None
+
+
+def _validate_in_worker(schema_name, max_version, remote_settings, path):
+    # the validator is created and warmed once per worker process. a spawned
+    # worker doesn't inherit the settings of the parent, so they are passed
+    global _worker_validator, _worker_key
+    key = (schema_name, max_version, remote_settings)
+    if _worker_validator is None or _worker_key != key:
+        remote_schemas.configure(**remote_settings)
+        _worker_validator = FileValidator(schema_name, max_version)
+        _worker_validator.warm()
+        _worker_key = key
+    return _worker_validator.validate(path)
+
+
+def validate_files(paths, schema_name, max_version=None, workers=1, ordered=True):
+    """
+    Validates the data files against the schema and yields a FileResult for
+    each file. With more than one worker, the files are validated in a
+    process pool and the results are yielded in the order of paths, or as
+    they complete when `ordered` is false.
+    """
+    paths = list(paths)
+    if workers <= 1 or len(paths) <= 1:
+        validator = FileValidator(schema_name, max_version)
+        for path in paths:
+            yield validator.validate(path)
+        return
+
+    workers = min(workers, len(paths))
+    validate = partial(_validate_in_worker, schema_name, max_version,
+        remote_schemas.get_settings())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            # bigger chunks cut the overhead with thousands of small files
+            chunksize = max(1, min(32, len(paths) // (workers * 4)))
+            yield from executor.map(validate, paths, chunksize=chunksize)
+        else:
+            futures = [executor.submit(validate, path) for path in paths]
+            for future in as_completed(futures):
+                yield future.result()
@@ -6,8 +6,9 @@ import sys
 import tkinter as tk
 from collections import OrderedDict
 from configparser import ConfigParser
+from itertools import accumulate
 from os import makedirs, pathsep
-from os.path import expanduser, exists, isdir, isfile, join, split as split_path
+from os.path import abspath, expanduser, exists, isdir, isfile, join, split as split_path
 from queue import Queue, Empty
 from threading import Thread
 from tkinter import filedialog, messagebox
@@ -15,11 +16,13 @@ from tkinter import ttk
 
 from apluslms_roman import __app_id__ as __roman_id__, CourseConfig, Engine
 from apluslms_roman.backends.docker import DockerBackend
+from apluslms_roman.history import BuildHistory
 from apluslms_roman.observer import (
     Phase,
     Message,
     BuildObserver,
 )
+from apluslms_roman.utils.timing import format_duration
 
 __author__ = 'io.github.apluslms'
 __app_id__ = 'io.github.apluslms.RomanTki'
@@ -237,16 +240,24 @@ class Progress(ttk.Progressbar):
         self.config(value=0)
         self._val = 0
         self._steps = 0
-
-    def set_steps(self, steps):
-        self.config(value=0, maximum=steps)
+        self._marks = [0]
+
+    def set_steps(self, steps, weights=None):
+        # weights are the expected durations of the steps, so the bar moves in time
+        if not weights:
+            weights = [1] * steps
+        self._marks = [0] + list(accumulate(weights))
+        self.config(value=0, maximum=self._marks[-1])
         self._val = -1
         self._steps = steps
 
     def move(self):
         if self._val < self._steps:
             self._val += 1
-            self.config(value=self._val)
+            self.config(value=self._marks[self._val])
+
+    def remaining(self):
+        return self._marks[-1] - self._marks[max(self._val, 0)]
 
 
 class Roman:
@@ -454,7 +465,8 @@ Used configuration:""", 'step')
             return
 
         steps = len(self.config.steps)
-        self.progress.set_steps(steps * 2)
+        durations = self.get_expected_durations()
+        self.progress.set_steps(steps * 2, durations)
 
         self.lock()
         self.build_task = build_task = BuildTask(self.engine, self.config)
@@ -483,7 +495,11 @@ Used configuration:""", 'step')
                     self.progress.move()
                     status = status_texts.get(phase, "Something")
                     self.console.write("{} step {}".format(status, step), 'step')
-                    self.set_status("{} step {}/{}…".format(status, step, steps))
+                    text = "{} step {}/{}…".format(status, step, steps)
+                    if durations:
+                        text += " about {} left".format(
+                            format_duration(self.progress.remaining()))
+                    self.set_status(text)
                 elif typ == Message.MANAGER_MSG:
                     self.console.write(msg, 'manager')
                 elif typ == Message.CONTAINER_MSG:
@@ -497,6 +513,25 @@ Used configuration:""", 'step')
                 self.unlock()
         update()
 
+    def get_expected_durations(self):
+        """
+        Returns the expected durations for the prepare and build steps from the
+        build history, or None if there are no recorded builds.
+        """
+        history = BuildHistory()
+        try:
+            durations = history.expected_durations(abspath(self.config_dir))
+        except history.errors:
+            return None
+        if not durations:
+            return None
+        default = sum(durations.values()) / len(durations)
+        names = [(step.get('name') if hasattr(step, 'get') else None) or str(i)
+            for i, step in enumerate(self.config.steps)]
+        # preparing is fast, when the images are already pulled
+        return ([1.0] * len(names)
+            + [durations.get(name, default) for name in names])
+
     def quit(self):
         if self.build_task and self.build_task.is_alive():
             self.build_task.join()
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import struct
+from http.server import BaseHTTPRequestHandler
+from os.path import join
+from socketserver import ThreadingMixIn, UnixStreamServer
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+from urllib.parse import parse_qs, urlsplit
+
+from apluslms_roman.backends import BuildResult, BuildStep, BuildTask, Environment
+from apluslms_roman.backends.aio import AsyncBackend, SyncBackend, run_sync
+from apluslms_roman.backends.docker_aio import (
+    DockerAPIError,
+    DockerAsyncBackend,
+    StreamDemuxer,
+    parse_size,
+)
+from apluslms_roman.observer import Message, StepState
+from ..helpers import ListObserver
+
+
+class SleepBackend(AsyncBackend):
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+
+    async def build_step(self, task, step, observer):
+        self.started.append(str(step))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        observer.step_running(step)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if step.cmd == 'fail':
+            observer.step_failed(step)
+            return BuildResult(1, None, step)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+
+class SleepSyncBackend(SyncBackend):
+    async_backend_class = SleepBackend
+
+
+class TestAsyncBackend(TestCase):
+
+    def build(self, steps, workers):
+        backend = SleepSyncBackend(Environment(1000, 1000, {}))
+        observer = ListObserver()
+        observer.enter_build()
+        result = backend.build(BuildTask('/src', steps, workers, None), observer)
+        return backend.backend, observer, result
+
+    def test_build_shouldRunIndependentStepsConcurrently(self):
+        steps = [BuildStep(i, 'img', depends_on=[]) for i in range(4)]
+        backend, observer, result = self.build(steps, 2)
+        self.assertTrue(result.ok)
+        self.assertEqual(backend.max_running, 2)
+        for step in steps:
+            self.assertEqual(observer.get_step_state(step), StepState.SUCCEEDED)
+
+    def test_build_shouldRespectDependencies(self):
+        steps = [BuildStep(0, 'img', name='a'), BuildStep(1, 'img', depends_on=[0]),
+            BuildStep(2, 'img', depends_on=[0])]
+        backend, _observer, result = self.build(steps, 4)
+        self.assertTrue(result.ok)
+        self.assertEqual(backend.started[0], 'a')
+        self.assertEqual(backend.max_running, 2)
+
+    def test_failure_shouldStopStartingSteps(self):
+        steps = [BuildStep(0, 'img', cmd='fail', depends_on=[]),
+            BuildStep(1, 'img', depends_on=[])]
+        backend, _observer, result = self.build(steps, 1)
+        self.assertEqual((result.code, result.step), (1, steps[0]))
+        self.assertEqual(backend.started, ['0'])
+
+    def test_runSync_shouldCloseTheLoop(self):
+        async def value():
+            return asyncio.get_event_loop()
+        loop = run_sync(value())
+        self.assertTrue(loop.is_closed())
+
+
+class TestStreams(TestCase):
+
+    def test_demuxer_shouldJoinSplitFrames(self):
+        frame = lambda stream, data: struct.pack('>BxxxI', stream, len(data)) + data
+        data = frame(1, b'out\n') + frame(2, b'err\n')
+        demuxer = StreamDemuxer()
+        self.assertEqual(demuxer.feed(data[:6]), [])
+        self.assertEqual(demuxer.feed(data[6:14]), [(1, b'out\n')])
+        self.assertEqual(demuxer.feed(data[14:]), [(2, b'err\n')])
+
+    def test_parseSize(self):
+        self.assertEqual(parse_size('100M'), 100 << 20)
+        self.assertEqual(parse_size('2gb'), 2 << 30)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'docker'
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunks(self, chunks):
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def handle_request(self, method):
+        docker = self.server.docker
+        url = urlsplit(self.path)
+        path = url.path.split('/', 2)[2]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        docker.requests.append((method, path, parse_qs(url.query), body))
+        if path == '_ping':
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'OK')
+        elif path.startswith('images/') and path.endswith('/json'):
+            if path[7:-5] in docker.images:
+                self.send_json({'Id': 'sha256:' + path[7:-5]})
+            else:
+                self.send_json({'message': 'No such image'}, 404)
+        elif path == 'images/create':
+            query = parse_qs(url.query)
+            tag = query.get('tag')
+            docker.images.add(query['fromImage'][0] + (':' + tag[0] if tag else ''))
+            self.send_chunks([b'{"status": "Pulling fs layer", "id": "abc"}\n',
+                b'{"status": "Pull complete", "id": "abc"}\n'])
+        elif path == 'containers/create':
+            self.send_json({'Id': 'c1'}, 201)
+        elif path == 'containers/c1/start':
+            self.send_response(204)
+            self.end_headers()
+        elif path == 'containers/c1/logs':
+            frame = lambda stream, data: struct.pack('>BxxxI', stream, len(data)) + data
+            self.send_chunks([frame(1, b'hello\nwor'), frame(2, b'ld\n')])
+        elif path == 'containers/c1/wait':
+            sleep(docker.wait_delay)
+            self.send_json({'StatusCode': docker.exit_code})
+        elif path == 'containers/c1':
+            self.send_response(204)
+            self.end_headers()
+        else:
+            self.send_json({'message': 'page not found'}, 404)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+class FakeDockerServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class TestAsyncDockerBackend(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        socket = join(self.tmp.name, 'docker.sock')
+        self.server = FakeDockerServer(socket, FakeDockerHandler)
+        self.server.docker = self
+        self.requests = []
+        self.images = {'present:latest'}
+        self.exit_code = 0
+        self.wait_delay = 0
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.backend = DockerAsyncBackend(Environment(1000, 1000,
+            {'DOCKER_HOST': 'unix://' + socket}))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_verify(self):
+        self.assertIsNone(self.backend.verify())
+
+    def test_errorResponse_shouldRaiseWithTheMessage(self):
+        client = self.backend.backend.client
+        with self.assertRaises(DockerAPIError) as cm:
+            run_sync(client.request('GET', '/nothing'))
+        self.assertEqual(cm.exception.status, 404)
+        self.assertIn('page not found', str(cm.exception))
+
+    def test_prepare_shouldPullMissingImages(self):
+        steps = [BuildStep(0, 'present'), BuildStep(1, 'missing'), BuildStep(2, 'missing')]
+        observer = ListObserver()
+        observer.enter_prepare()
+        result = self.backend.prepare(BuildTask(self.tmp.name, steps, 1, None), observer)
+        self.assertTrue(result.ok)
+        pulls = [r for r in self.requests if r[1] == 'images/create']
+        self.assertEqual([(r[2]['fromImage'], r[2]['tag']) for r in pulls],
+            [(['missing'], ['latest'])])
+        for step in steps:
+            self.assertEqual(observer.get_step_state(step), StepState.SUCCEEDED)
+        self.assertIn((Message.MANAGER_MSG, steps[1], ['abc: Pull complete']),
+            observer.messages)
+
+    def test_prepare_shouldPullDigestWithoutTag(self):
+        step = BuildStep(0, 'missing@sha256:abc')
+        observer = ListObserver()
+        observer.enter_prepare()
+        result = self.backend.prepare(BuildTask(self.tmp.name, [step], 1, None), observer)
+        self.assertTrue(result.ok)
+        pull = next(r for r in self.requests if r[1] == 'images/create')
+        self.assertEqual(pull[2], {'fromImage': ['missing@sha256:abc']})
+
+    def test_buildStep_shouldStreamLogsAndRemoveContainer(self):
+        step = BuildStep(0, 'present', cmd='make html', step_env=['A=1'])
+        observer = ListObserver()
+        observer.enter_build()
+        result = self.backend.build_step(BuildTask(self.tmp.name, [step], 1, None),
+            step, observer)
+        self.assertTrue(result.ok)
+        self.assertEqual(observer.get_step_state(step), StepState.SUCCEEDED)
+        logs = [data for type_, _step, data in observer.messages
+            if type_ == Message.CONTAINER_MSG]
+        self.assertEqual(sum(logs, []), ['hello', 'world'])
+        create = next(r[3] for r in self.requests if r[1] == 'containers/create')
+        self.assertEqual((create['Cmd'], create['Env'], create['User']),
+            (['make', 'html'], ['A=1'], '1000:1000'))
+        self.assertEqual(self.requests[-1][:3], ('DELETE', 'containers/c1', {'force': ['1']}))
+
+    def test_buildStep_shouldReturnTheExitCode(self):
+        self.exit_code = 2
+        step = BuildStep(0, 'present')
+        observer = ListObserver()
+        observer.enter_build()
+        result = self.backend.build_step(BuildTask(self.tmp.name, [step], 1, None),
+            step, observer)
+        self.assertEqual((result.code, result.step), (2, step))
+        self.assertEqual(observer.get_step_state(step), StepState.FAILED)
+
+    def test_lateExitCode_shouldNotBeReportedAsStepTimeout(self):
+        self.wait_delay = 0.5
+        backend = DockerAsyncBackend(Environment(1000, 1000, {
+            'DOCKER_HOST': self.backend.environment.environ['DOCKER_HOST'],
+            'DOCKER_WAIT_TIMEOUT': '0.05'}))
+        step = BuildStep(0, 'present', timeout=30)
+        observer = ListObserver()
+        observer.enter_build()
+        result = backend.build_step(BuildTask(self.tmp.name, [step], 1, None),
+            step, observer)
+        self.assertEqual((result.code, result.step), (-1, step))
+        self.assertIn("was not received in 0.05 seconds", result.error)
@@ -0,0 +1,373 @@
+from threading import Event
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import docker
+
+from apluslms_roman.backends import (
+    BuildStep,
+    BuildTask,
+    Environment,
+    parse_repository_tag,
+)
+from apluslms_roman.backends.docker import (
+    CLEAN_WORK_COMMAND,
+    ContainerPool,
+    DockerBackend,
+    format_pull_progress,
+)
+from apluslms_roman.observer import Message, StepState
+from ..helpers import ListObserver
+
+
+def get_backend(client):
+    backend = DockerBackend(Environment(1000, 1000, {}))
+    backend.__dict__['_client'] = client
+    return backend
+
+
+class TestFormatPullProgress(TestCase):
+
+    def test_progress_shouldBeReportedInSteps(self):
+        layers = {}
+        event = lambda current: {'status': 'Downloading', 'id': 'abc',
+            'progressDetail': {'current': current, 'total': 1000000}}
+        self.assertEqual(format_pull_progress(event(10), layers),
+            "abc: Downloading 0% of 1.0 MB")
+        self.assertIsNone(format_pull_progress(event(20), layers))
+        self.assertEqual(format_pull_progress(event(500000), layers),
+            "abc: Downloading 50% of 1.0 MB")
+
+    def test_statusWithoutLayer_shouldBeReturnedAsIs(self):
+        self.assertEqual(format_pull_progress({'status': 'Digest: x'}, {}), "Digest: x")
+
+
+class TestParseRepositoryTag(TestCase):
+
+    def test_references(self):
+        for image, expected in (
+                ('img', ('img', 'latest')),
+                ('org/img:1.0', ('org/img', '1.0')),
+                ('localhost:5000/img', ('localhost:5000/img', 'latest')),
+                ('localhost:5000/img:2', ('localhost:5000/img', '2')),
+                ('img@sha256:abc', ('img@sha256:abc', None))):
+            with self.subTest(image=image):
+                self.assertEqual(parse_repository_tag(image), expected)
+
+
+class TestDockerPrepare(TestCase):
+
+    def test_missingImages_shouldBePulledOnce(self):
+        client = MagicMock()
+        client.images.get.side_effect = docker.errors.ImageNotFound('missing')
+        client.api.pull.return_value = [
+            {'status': 'Pulling fs layer', 'id': 'abc'},
+            {'status': 'Pull complete', 'id': 'abc'},
+        ]
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'b'), BuildStep(2, 'a')]
+        observer = ListObserver()
+        observer.enter_prepare()
+        result = get_backend(client).prepare(BuildTask('/src', steps, 1, None), observer)
+
+        self.assertTrue(result.ok)
+        pulled = sorted(c[0][:2] for c in client.api.pull.call_args_list)
+        self.assertEqual(pulled, [('a', 'latest'), ('b', 'latest')])
+        for step in steps:
+            self.assertEqual(observer.get_step_state(step), StepState.SUCCEEDED)
+        lines = [data[0] for type_, step, data in observer.messages
+            if type_ == Message.MANAGER_MSG]
+        self.assertIn("abc: Pull complete", lines)
+
+    def test_pullError_shouldFailSteps(self):
+        client = MagicMock()
+        client.images.get.side_effect = docker.errors.ImageNotFound('missing')
+        client.api.pull.return_value = [{'error': 'manifest unknown'}]
+        steps = [BuildStep(0, 'a')]
+        observer = ListObserver()
+        observer.enter_prepare()
+        result = get_backend(client).prepare(BuildTask('/src', steps, 1, None), observer)
+
+        self.assertFalse(result.ok)
+        self.assertIs(result.step, steps[0])
+        self.assertIn("manifest unknown", result.error)
+        self.assertEqual(observer.get_step_state(steps[0]), StepState.FAILED)
+
+    def test_prepare_shouldRecordTimings(self):
+        client = MagicMock()
+        client.images.get.side_effect = docker.errors.ImageNotFound('missing')
+        client.api.pull.return_value = [{'status': 'Pull complete', 'id': 'abc'}]
+        steps = [BuildStep(0, 'a')]
+        observer = ListObserver()
+        observer.enter_prepare()
+        get_backend(client).prepare(BuildTask('/src', steps, 1, None), observer)
+
+        self.assertEqual(list(observer.timings.step(steps[0])),
+            ['image lookup', 'pull', 'prepare'])
+
+
+class TestDockerBuildStep(TestCase):
+
+    def test_buildStep_shouldRecordStageTimings(self):
+        client = MagicMock()
+        container = client.containers.create.return_value
+        container.logs.return_value = [b'hello\n']
+        container.wait.return_value = {'StatusCode': 0}
+        step = BuildStep(0, 'a')
+        observer = ListObserver()
+        observer.enter_build()
+        result = get_backend(client).build_step(BuildTask('/src', [step], 1, None),
+            step, observer)
+
+        self.assertTrue(result.ok)
+        self.assertEqual(list(observer.timings.step(step)),
+            ['create', 'start', 'logs', 'wait', 'remove', 'build'])
+        timings = [data for type_, step_, data in observer.messages
+            if type_ == Message.TIMING_MSG]
+        self.assertEqual([stage for stage, _seconds in timings],
+            ['create', 'start', 'logs', 'wait', 'remove', 'build'])
+
+
+def get_events_client(exit_code=0):
+    """A client, which sends a die event for a container after it is started"""
+    client = MagicMock()
+    container = client.containers.create.return_value
+    container.id = 'c1'
+    started = Event()
+    container.start.side_effect = lambda: started.set()
+    def events(**kwargs):
+        started.wait(5)
+        yield {'status': 'die', 'id': 'c1',
+            'Actor': {'ID': 'c1', 'Attributes': {'exitCode': str(exit_code)}}}
+    client.events.side_effect = events
+    return client
+
+
+class TestDockerContainerExit(TestCase):
+
+    def build_step(self, backend, step):
+        observer = ListObserver()
+        observer.enter_build()
+        return backend.build_step(BuildTask('/src', [step], 1, None), step, observer)
+
+    def test_exitCode_shouldBeReadFromEvents(self):
+        client = get_events_client(exit_code=3)
+        client.containers.create.return_value.logs.return_value = [b'hello\n']
+        result = self.build_step(get_backend(client), BuildStep(0, 'a'))
+        self.assertEqual(result.code, 3)
+        client.containers.create.return_value.wait.assert_not_called()
+
+    def test_withoutEvents_shouldWaitForContainer(self):
+        client = MagicMock()
+        client.events.side_effect = docker.errors.APIError('no events')
+        container = client.containers.create.return_value
+        container.logs.return_value = []
+        container.wait.return_value = {'StatusCode': 4}
+        backend = DockerBackend(Environment(1000, 1000, {'DOCKER_WAIT_TIMEOUT': '30'}))
+        backend.__dict__['_client'] = client
+        result = self.build_step(backend, BuildStep(0, 'a'))
+        self.assertEqual(result.code, 4)
+        container.wait.assert_called_once_with(timeout=30.0)
+
+    def test_stepTimeout_shouldStopContainer(self):
+        client = get_events_client(exit_code=137)
+        container = client.containers.create.return_value
+        killed = Event()
+        container.kill.side_effect = lambda: killed.set()
+        container.logs.side_effect = lambda **kwargs: iter(
+            [b'started\n'] if killed.wait(5) else [])
+        result = self.build_step(get_backend(client), BuildStep(0, 'a', timeout=0.01))
+        container.kill.assert_called_once_with()
+        self.assertEqual(result.code, -1)
+        self.assertIn("timeout of 0.01 seconds", result.error)
+
+    def test_timeoutAfterOutput_shouldUseExitStatus(self):
+        client = get_events_client(exit_code=0)
+        container = client.containers.create.return_value
+        killed = Event()
+        container.kill.side_effect = lambda: killed.set()
+        # the output ends, but the timeout fires before it is cancelled
+        container.logs.side_effect = lambda **kwargs: iter(
+            [b'done\n'] if killed.wait(5) else [])
+        result = self.build_step(get_backend(client), BuildStep(0, 'a', timeout=0.01))
+        container.kill.assert_called_once_with()
+        self.assertTrue(result.ok)
+
+    def test_build_shouldCloseEventsStream(self):
+        client = get_events_client(exit_code=0)
+        client.containers.create.return_value.logs.return_value = []
+        closed = Event()
+        def events(**kwargs):
+            yield {'status': 'die', 'id': 'c1',
+                'Actor': {'ID': 'c1', 'Attributes': {'exitCode': '0'}}}
+            closed.wait(5)
+        stream = MagicMock()
+        stream.__iter__.side_effect = events
+        stream.close.side_effect = closed.set
+        client.events.side_effect = None
+        client.events.return_value = stream
+        backend = get_backend(client)
+        observer = ListObserver()
+        observer.enter_build()
+        step = BuildStep(0, 'a')
+        result = backend.build(BuildTask('/src', [step], 1, None), observer)
+        self.assertTrue(result.ok)
+        stream.close.assert_called_once_with()
+        self.assertNotIn('_supervisor', backend.__dict__)
+
+
+def get_reusing_backend(client, warm_images=''):
+    backend = DockerBackend(Environment(1000, 1000, {
+        'DOCKER_REUSE_CONTAINERS': 'true',
+        'DOCKER_WARM_IMAGES': warm_images,
+    }))
+    backend.__dict__['_client'] = client
+    return backend
+
+
+def get_exec_client(exit_codes=None, clean_code=0):
+    """`exit_codes` are the codes of the step commands, not the cleanups"""
+    client = MagicMock()
+    client.containers.create.return_value.status = 'running'
+    client.images.get.return_value.attrs = {
+        'Config': {'Entrypoint': ['make'], 'Cmd': ['all']}}
+    client.api.exec_create.side_effect = lambda container, command, **kwargs: {
+        'Id': '%s%d' % ('clean' if command == CLEAN_WORK_COMMAND else 'exec',
+            client.api.exec_create.call_count)}
+    client.api.exec_start.return_value = [b'hel', b'lo\nwor', b'ld\n']
+    codes = list(exit_codes or [])
+    client.api.exec_inspect.side_effect = lambda exec_id: {
+        'ExitCode': clean_code if exec_id.startswith('clean')
+            else codes.pop(0) if codes else 0}
+    return client
+
+
+def get_step_commands(client):
+    return [c[0][1] for c in client.api.exec_create.call_args_list
+        if c[0][1] != CLEAN_WORK_COMMAND]
+
+
+class TestDockerReuseContainers(TestCase):
+
+    def build(self, backend, steps, workers=1):
+        observer = ListObserver()
+        observer.enter_build()
+        result = backend.build(BuildTask('/src', steps, workers, None), observer)
+        return result, observer
+
+    def test_sameImageSteps_shouldShareContainer(self):
+        client = get_exec_client()
+        steps = [BuildStep(0, 'a', 'html'), BuildStep(1, 'a', ['pdf', 'x y']),
+            BuildStep(2, 'a')]
+        result, observer = self.build(get_reusing_backend(client), steps)
+
+        self.assertTrue(result.ok)
+        client.containers.create.assert_called_once()
+        self.assertEqual(client.containers.create.call_args[1]['entrypoint'][0], '/bin/sh')
+        self.assertEqual(get_step_commands(client), [['make', 'html'],
+            ['make', 'pdf', 'x y'], ['make', 'all']])
+        client.containers.create.return_value.remove.assert_called_once_with(force=True)
+        lines = [data for type_, step, data in observer.messages
+            if type_ == Message.CONTAINER_MSG and step is steps[0]]
+        self.assertEqual(sum(lines, []), ['hello', 'world'])
+
+    def test_differentMounts_shouldUseOwnContainers(self):
+        client = get_exec_client()
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'a', mnt='/compile'), BuildStep(2, 'b')]
+        self.build(get_reusing_backend(client), steps)
+        self.assertEqual(client.containers.create.call_count, 3)
+
+    def test_failedCommand_shouldReturnExitCode(self):
+        client = get_exec_client(exit_codes=[0, 2])
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'a'), BuildStep(2, 'a')]
+        result, observer = self.build(get_reusing_backend(client), steps)
+        self.assertEqual((result.code, result.step), (2, steps[1]))
+        self.assertEqual(observer.get_step_state(steps[1]), StepState.FAILED)
+        self.assertEqual(len(get_step_commands(client)), 2)
+
+    def test_timedOutStep_shouldNotReturnContainerToPool(self):
+        client = get_exec_client(exit_codes=[137])
+        killed = Event()
+        client.containers.create.return_value.kill.side_effect = lambda: killed.set()
+        client.api.exec_start.side_effect = lambda *args, **kwargs: iter(
+            [b'started\n'] if killed.wait(5) else [])
+        step = BuildStep(0, 'a', timeout=0.01)
+        with patch.object(ContainerPool, 'release', autospec=True,
+                side_effect=ContainerPool.release) as release:
+            result, _observer = self.build(get_reusing_backend(client), [step])
+        self.assertEqual((result.code, result.step), (-1, step))
+        self.assertIn("timeout of 0.01 seconds", result.error)
+        self.assertTrue(release.call_args[1]['broken'])
+
+    def test_step_shouldCleanWorkBeforeNextStep(self):
+        client = get_exec_client()
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'a'), BuildStep(2, 'a', mnt='/compile')]
+        result, _observer = self.build(get_reusing_backend(client), steps)
+        self.assertTrue(result.ok)
+        commands = [c[0][1] for c in client.api.exec_create.call_args_list]
+        self.assertEqual(commands, [['make', 'all'], CLEAN_WORK_COMMAND,
+            ['make', 'all'], CLEAN_WORK_COMMAND, ['make', 'all']])
+        self.assertEqual(client.api.exec_create.call_args_list[1][1]['workdir'], '/work')
+
+    def test_failedCleanup_shouldNotReturnContainerToPool(self):
+        client = get_exec_client(clean_code=1)
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'a')]
+        result, _observer = self.build(get_reusing_backend(client), steps)
+        self.assertTrue(result.ok)
+        self.assertEqual(client.containers.create.call_count, 2)
+
+    def test_cancelledStep_shouldNotReturnContainerToPool(self):
+        client = get_exec_client()
+        backend = get_reusing_backend(client)
+        task = BuildTask('/src', [BuildStep(0, 'a')], 1, None)
+        client.api.exec_start.side_effect = lambda *args, **kwargs: (
+            backend.cancel(task), iter([]))[1]
+        observer = ListObserver()
+        observer.enter_build()
+        with patch.object(ContainerPool, 'release', autospec=True,
+                side_effect=ContainerPool.release) as release:
+            with self.assertRaises(KeyboardInterrupt):
+                backend.build(task, observer)
+        client.containers.create.return_value.kill.assert_called_once_with()
+        self.assertTrue(release.call_args[1]['broken'])
+
+    def test_stepFallingBackToOwnContainer_shouldBePendingOnce(self):
+        client = get_exec_client()
+        client.containers.create.return_value.status = 'exited'
+        step_container = MagicMock()
+        step_container.logs.return_value = []
+        step_container.wait.return_value = {'StatusCode': 0}
+        client.containers.create.side_effect = [
+            client.containers.create.return_value, step_container]
+        observer = ListObserver()
+        observer.enter_build()
+        observer.step_pending = MagicMock(wraps=observer.step_pending)
+        step = BuildStep(0, 'a')
+        result = get_reusing_backend(client).build(
+            BuildTask('/src', [step], 1, None), observer)
+        self.assertTrue(result.ok)
+        observer.step_pending.assert_called_once_with(step)
+
+    def test_imageWithoutShell_shouldUseContainerPerStep(self):
+        client = get_exec_client()
+        idle = MagicMock(status='exited')
+        step_container = MagicMock()
+        step_container.logs.return_value = [b'hello\n']
+        step_container.wait.return_value = {'StatusCode': 0}
+        client.containers.create.side_effect = [idle, step_container, step_container]
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'a')]
+        result, observer = self.build(get_reusing_backend(client), steps)
+
+        self.assertTrue(result.ok)
+        idle.remove.assert_called_once_with(force=True)
+        self.assertEqual(step_container.start.call_count, 2)
+        client.api.exec_create.assert_not_called()
+
+    def test_warmImages_shouldBeStartedBeforeSteps(self):
+        client = get_exec_client()
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'b'), BuildStep(2, 'a')]
+        backend = get_reusing_backend(client, warm_images='a, c')
+        self.assertEqual(backend.warm_images, {'a:latest', 'c:latest'})
+        result, _observer = self.build(backend, steps)
+        self.assertTrue(result.ok)
+        images = [c[1]['image'] for c in client.containers.create.call_args_list]
+        self.assertEqual(images, ['a:latest', 'b:latest'])
@@ -0,0 +1,111 @@
+import sys
+from os import mkdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import sleep, time
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.backends import BuildStep, BuildTask, Environment
+from apluslms_roman.backends.local import LocalBackend
+from apluslms_roman.observer import StepState
+from ..helpers import ListObserver
+
+
+def python(code):
+    return (sys.executable, '-c', code)
+
+
+class TestLocalBackend(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = self.tmp.name
+        mkdir(join(self.path, '_build'))
+        with open(join(self.path, 'index.rst'), 'w') as f:
+            f.write('hello\n')
+        self.backend = LocalBackend(Environment(1000, 1000, {}))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self, *steps, workers=1):
+        observer = ListObserver()
+        task = BuildTask(self.path, list(steps), workers, None)
+        observer.enter_prepare()
+        result = self.backend.prepare(task, observer)
+        if result.ok:
+            observer.enter_build()
+            result = self.backend.build(task, observer)
+        return result, observer
+
+    def test_step_shouldRunInWorkLayout(self):
+        step = BuildStep(0, 'sphinx', cmd=python(
+            "import os; print(open('src/index.rst').read().strip()); "
+            "open('build/out.html', 'w').write(os.environ['LANG_X'])"),
+            step_env=['LANG_X=fi'])
+        result, observer = self.build(step)
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(observer.output(step), ['hello'])
+        with open(join(self.path, '_build', 'out.html')) as f:
+            self.assertEqual(f.read(), 'fi')
+        self.assertEqual(observer.get_step_state(step), StepState.SUCCEEDED)
+
+    def test_nonStrEnv_shouldBeJson(self):
+        step = BuildStep(0, 'img', cmd=python(
+            "import os; print(os.environ['LIST'], os.environ['FLAG'], os.environ['N'])"),
+            step_env=[{'LIST': ['a', 'b']}, {'FLAG': True}, {'N': 2}])
+        result, observer = self.build(step)
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(observer.output(step), ['["a", "b"] true 2'])
+
+    def test_mnt_shouldRunInProjectDirectory(self):
+        step = BuildStep(0, 'img', cmd=python("open('new.txt', 'w')"), mnt='/content')
+        result, _observer = self.build(step)
+        self.assertTrue(result.ok, result.error)
+        with open(join(self.path, 'new.txt')):
+            pass
+
+    def test_failingStep_shouldReturnExitCode(self):
+        steps = [BuildStep(0, 'img', cmd=python("import sys; sys.exit(3)")),
+            BuildStep(1, 'img', cmd=python("pass"))]
+        result, observer = self.build(*steps)
+        self.assertEqual((result.code, result.step), (3, steps[0]))
+        self.assertEqual(observer.get_step_state(steps[1]), StepState.NOTSTARTED)
+
+    def test_timeout_shouldStopTheStep(self):
+        step = BuildStep(0, 'img', cmd=python("import time; time.sleep(30)"), timeout=0.2)
+        result, _observer = self.build(step)
+        self.assertEqual((result.code, result.step), (-1, step))
+        self.assertIn("timeout of 0.2 seconds", result.error)
+
+    def test_missingCommand_shouldFail(self):
+        step = BuildStep(0, 'img', cmd='roman-no-such-command')
+        result, _observer = self.build(step)
+        self.assertEqual(result.code, -1)
+        self.assertIn('FileNotFoundError', result.error)
+
+    def test_stepWithoutCmd_shouldFailPrepare(self):
+        step = BuildStep(0, 'img')
+        result, observer = self.build(step)
+        self.assertEqual((result.code, result.step), (-1, step))
+        self.assertEqual(observer.get_step_state(step), StepState.FAILED)
+
+    def test_interrupt_shouldStopRunningSteps(self):
+        steps = [BuildStep(0, 'img', cmd=python("import time; time.sleep(30)"),
+            depends_on=[]), BuildStep(1, 'img', depends_on=[])]
+        build_step = self.backend.build_step
+        def interrupt(task, step, observer):
+            if step.ref == 0:
+                return build_step(task, step, observer)
+            while observer.get_step_state(steps[0]) != StepState.RUNNING:
+                sleep(0.01)
+            raise KeyboardInterrupt
+        observer = ListObserver()
+        observer.enter_build()
+        start = time()
+        with patch.object(self.backend, 'build_step', interrupt), \
+                self.assertRaises(KeyboardInterrupt):
+            self.backend.build(BuildTask(self.path, steps, 2, None), observer)
+        self.assertLess(time() - start, 10)
+        self.assertEqual(observer.get_step_state(steps[0]), StepState.CANCELLED)
@@ -0,0 +1,31 @@
+from apluslms_roman.observer import BuildObserver, Message
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class NullObserver(BuildObserver):
+    def _message(self, *args, **kwargs):
+        pass
+
+
+class ListObserver(BuildObserver):
+    """
+    Records (type, step, data) of the messages. When `blocked` is an event,
+    each message waits for it to be set first.
+    """
+    def __init__(self, blocked=None):
+        super().__init__()
+        self.messages = []
+        self.blocked = blocked
+
+    def _message(self, phase, type_, step=None, state=None, data=None):
+        if self.blocked is not None:
+            self.blocked.wait(5)
+        self.messages.append((type_, step, data))
+
+    def output(self, step):
+        return [line for type_, step_, data in self.messages
+            if type_ == Message.CONTAINER_MSG and step_ is step for line in data]
@@ -0,0 +1,101 @@
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Lock
+from unittest import TestCase
+
+from apluslms_roman.backends import Backend, BuildResult
+from apluslms_roman.batch import BatchBuilder, find_projects, read_project_list
+from apluslms_roman.builder import Engine
+from .helpers import NullObserver, write
+
+
+class RecordingBackend(Backend):
+    prepared = []
+    built = []
+    lock = Lock()
+
+    def prepare(self, task, observer):
+        self.prepared.append(sorted(step.img for step in task.steps))
+        return BuildResult()
+
+    def build_step(self, task, step, observer):
+        with self.lock:
+            self.built.append((task.path, step.img))
+        observer.container_msg(step, "building {}\n".format(step.img))
+        if step.cmd == 'fail':
+            return BuildResult(2, None, step)
+        return BuildResult(step=step)
+
+
+class FailingBackend(RecordingBackend):
+    def prepare(self, task, observer):
+        for step in task.steps:
+            if step.img in ('img2:latest', 'img3:latest'):
+                observer.step_failed(step)
+            else:
+                observer.step_succeeded(step)
+        return BuildResult(-1, "pull failed", next(step for step in task.steps
+            if step.img == 'img2:latest'))
+
+    def build_step(self, task, step, observer):
+        if task.path.endswith('b'):
+            raise RuntimeError("broken backend")
+        return super().build_step(task, step, observer)
+
+
+class TestBatchBuilder(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        root = self.root = self.tmp.name
+        for name, steps in (
+                ('a', "[img1, img2]"),
+                ('b', "[img1]"),
+                ('c/nested', "[{img: img3, cmd: fail}]")):
+            makedirs(join(root, name))
+            write(join(root, name, 'roman.yml'),
+                "version: '2.0'\nsteps: %s\n" % steps)
+        makedirs(join(root, 'invalid'))
+        write(join(root, 'invalid', 'roman.yml'), "version: '2.0'\nfoo: bar\n")
+        makedirs(join(root, 'empty', '_build'))
+        RecordingBackend.prepared = []
+        RecordingBackend.built = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_findProjects(self):
+        projects = sorted(p[len(self.root) + 1:] for p in find_projects(self.root))
+        self.assertEqual(projects, ['a', 'b', 'c/nested', 'invalid'])
+
+    def test_readProjectList(self):
+        path = join(self.root, 'list.txt')
+        write(path, "# projects\na\n\n  b  # second\n")
+        self.assertEqual(list(read_project_list(path)), ['a', 'b'])
+
+    def test_build_shouldPrepareImagesOnceAndReportEachProject(self):
+        paths = sorted(find_projects(self.root))
+        engine = Engine(backend_class=RecordingBackend)
+        results = BatchBuilder(engine, paths, workers=3,
+            observer=NullObserver()).build()
+
+        self.assertEqual(RecordingBackend.prepared,
+            [['img1:latest', 'img2:latest', 'img3:latest']])
+        self.assertEqual(len(RecordingBackend.built), 4)
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual([r.ok for r in results], [True, True, False, False])
+        self.assertEqual(results[2].result.code, 2)
+        self.assertIn("building img3:latest", results[2].log)
+        self.assertIsNotNone(results[3].error)
+
+    def test_build_shouldReportFailuresPerProject(self):
+        paths = [join(self.root, name) for name in ('a', 'b', 'c/nested')]
+        engine = Engine(backend_class=FailingBackend)
+        results = BatchBuilder(engine, paths, observer=NullObserver()).build()
+        self.assertEqual([r.ok for r in results], [False, False, False])
+        self.assertIn("pull failed", results[0].error)
+        self.assertEqual(results[1].error, "RuntimeError broken backend")
+        self.assertIn("img3:latest", results[2].error)
+        self.assertEqual(FailingBackend.built, [])
+
@@ -1,7 +1,15 @@
+import sys
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import time
 from unittest import TestCase
 
-from apluslms_roman.builder import Builder
+from apluslms_roman.backends.local import LocalBackend
+from apluslms_roman.builder import Builder, Engine
 from apluslms_roman.configuration import ProjectConfig
+from apluslms_roman.utils.scheduler import StepGraphError
+from apluslms_roman.utils.watch import ALL_CHANGED, PollingWatcher, Watcher
+from .helpers import NullObserver, write
 
 
 class TestBuilderGetSteps(TestCase):
@@ -35,3 +43,189 @@ class TestBuilderGetSteps(TestCase):
         self.assertEqual(steps[0].ref, 2)
 
 
+
+class TestBuilderStepDependencies(TestCase):
+
+    def get_builder(self, steps):
+        config = {'version': '2.0', 'steps': steps}
+        config = ProjectConfig(ProjectConfig.Container(
+            '/a', allow_missing=True), None, config, None)
+        return Builder(None, config)
+
+    def test_dependsOnByName_shouldResolveToIndex(self):
+        builder = self.get_builder([
+            {'img': 'a', 'name': 'src'},
+            {'img': 'b', 'name': 'html', 'depends_on': ['src']},
+            {'img': 'c', 'name': 'pdf', 'depends_on': [0]},
+        ])
+        steps = builder.get_steps()
+        self.assertIsNone(steps[0].depends_on)
+        self.assertEqual(steps[1].depends_on, (0,))
+        self.assertEqual(steps[2].depends_on, (0,))
+
+    def test_dependsOnUnknownStep_shouldRaiseKeyError(self):
+        builder = self.get_builder([
+            {'img': 'a', 'depends_on': ['missing']},
+        ])
+        with self.assertRaises(KeyError):
+            builder.get_steps()
+
+    def test_circularDependencies_shouldRaiseStepGraphError(self):
+        builder = self.get_builder([
+            {'img': 'a', 'name': 'one', 'depends_on': ['two']},
+            {'img': 'b', 'name': 'two', 'depends_on': ['one']},
+        ])
+        with self.assertRaises(StepGraphError):
+            builder.get_steps()
+
+
+class TestBuilderChangedSteps(TestCase):
+
+    def test_changedInputs_shouldSelectStepAndDependents(self):
+        config = {
+            'version': '2.0',
+            'steps': [
+                {'img': 'a', 'name': 'html', 'inputs': ['src/*.rst']},
+                {'img': 'b', 'name': 'pdf', 'inputs': ['tex'], 'depends_on': []},
+                {'img': 'c', 'name': 'upload', 'depends_on': ['html']},
+            ]}
+        config = ProjectConfig(ProjectConfig.Container(
+            '/a', allow_missing=True), None, config, None)
+        builder = Builder(None, config)
+        steps = builder.get_steps()
+
+        changed = builder.get_changed_steps(steps, {'src/index.rst'})
+        self.assertEqual([s.name for s in changed], ['html', 'upload'])
+        changed = builder.get_changed_steps(steps, {'tex/main.tex'})
+        self.assertEqual([s.name for s in changed], ['pdf', 'upload'])
+        changed = builder.get_changed_steps(steps, {'README'})
+        self.assertEqual([s.name for s in changed], ['upload'])
+
+
+class QueueWatcher(Watcher):
+    """
+    Returns the queued changes and raises KeyboardInterrupt, when none are
+    left. The changes in `after_reset` are queued by the next reset.
+    """
+    def __init__(self):
+        super().__init__('/a')
+        self.changes = []
+        self.after_reset = []
+        self.files = {}
+
+    def scan(self):
+        return dict(self.files)
+
+    def wait(self, timeout=None):
+        if self.changes:
+            return set(self.changes.pop(0))
+        if timeout is None:
+            raise KeyboardInterrupt
+        return set()
+
+    def reset(self):
+        self.changes, self.after_reset = self.after_reset, []
+
+
+class RecordingBuilder(Builder):
+    """Writes a file of `during_build` in each build, by a step with `mnt` if asked"""
+    def __init__(self, config, watcher):
+        super().__init__(None, config)
+        self.watcher = watcher
+        self.built = []
+        self.during_build = []
+
+    def build(self, step_refs=None, clean_build=False, workers=1, use_cache=None,
+            source_writes=None):
+        self.built.append(step_refs)
+        if self.during_build:
+            path, by_step = self.during_build.pop(0)
+            now = time()
+            self.watcher.files[path] = (int(now * 1e9), len(self.built))
+            self.watcher.changes.append([path])
+            if by_step:
+                source_writes.append((now, now))
+        return len(self.built)
+
+    def reload_config(self):
+        return True
+
+
+class TestBuilderWatch(TestCase):
+
+    def setUp(self):
+        config = {
+            'version': '2.0',
+            'steps': [
+                {'img': 'a', 'name': 'html', 'inputs': ['src/']},
+                {'img': 'b', 'name': 'pdf', 'inputs': ['tex/'], 'depends_on': []},
+            ]}
+        config = ProjectConfig(ProjectConfig.Container(
+            '/a', allow_missing=True), None, config, None)
+        self.watcher = QueueWatcher()
+        self.builder = RecordingBuilder(config, self.watcher)
+
+    def watch(self):
+        results = []
+        with self.assertRaises(KeyboardInterrupt):
+            for result in self.builder.watch(watcher=self.watcher, delay=0):
+                results.append(result)
+        return results
+
+    def test_changesDuringBuild_shouldBeRebuilt(self):
+        self.builder.during_build = [('src/index.rst', False), ('tex/main.tex', False)]
+        self.assertEqual(self.watch(), [1, 2, 3])
+        self.assertEqual(self.builder.built, [None, ['0'], ['1']])
+
+    def test_filesWrittenByBuild_shouldNotBeRebuilt(self):
+        self.builder.during_build = [('src/generated.rst', True)]
+        self.assertEqual(self.watch(), [1])
+
+    def test_lostChanges_shouldRebuildAllSteps(self):
+        self.watcher.after_reset.append([ALL_CHANGED])
+        self.assertEqual(self.watch(), [1, 2])
+        self.assertEqual(self.builder.built, [None, None])
+
+
+class OnePollWatcher(PollingWatcher):
+    """Polls once for each burst of changes and raises KeyboardInterrupt, if none"""
+    def wait(self, timeout=None):
+        changes = super().wait(0)
+        if not changes and timeout is None:
+            raise KeyboardInterrupt
+        return changes
+
+
+class TestBuilderWatchLocal(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        write(join(self.tmp.name, 'index.rst'), 'hello')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def watch(self, code, mnt=None):
+        step = {'img': 'python', 'cmd': [sys.executable, '-c', code]}
+        if mnt:
+            step['mnt'] = mnt
+        config = ProjectConfig(ProjectConfig.Container(
+            join(self.tmp.name, 'roman.yml'), allow_missing=True), None,
+            {'version': '2.0', 'steps': [step]}, None)
+        builder = Engine(LocalBackend).create_builder(config, observer=NullObserver())
+        results = []
+        with self.assertRaises(KeyboardInterrupt):
+            for result in builder.watch(watcher=OnePollWatcher(self.tmp.name), delay=0):
+                self.assertTrue(result.ok)
+                results.append(result)
+        return results
+
+    def test_stepWritingToProject_shouldBuildOnce(self):
+        results = self.watch("open('generated.rst', 'w').write('x')", mnt='/src')
+        self.assertEqual(len(results), 1)
+
+    def test_editDuringBuild_shouldBeRebuilt(self):
+        # a step without mnt stands for the user here
+        results = self.watch("if open('src/index.rst').read() == 'hello':\n"
+            "    open('src/index.rst', 'w').write('world')")
+        self.assertEqual(len(results), 2)
@@ -0,0 +1,133 @@
+from os import makedirs, utime
+from os.path import getsize, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.backends import Backend, BuildResult, BuildStep, BuildTask
+from apluslms_roman.cache import StepCache, hash_tree
+from apluslms_roman.observer import StepState
+from .helpers import NullObserver, write
+
+
+class CountingBackend(Backend):
+    def __init__(self):
+        super().__init__(None)
+        self.built = []
+
+    def get_image_id(self, step):
+        return 'sha256:' + step.img
+
+    def build_step(self, task, step, observer):
+        self.built.append(step.ref)
+        write(join(task.path, '_build', 'out%d.txt' % step.ref), 'built ' + step.img)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+
+class TestHashTree(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+        write(join(self.dir, 'index.rst'), 'hello')
+        makedirs(join(self.dir, '_build'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_changedContent_shouldChangeHash(self):
+        before = hash_tree(self.dir)
+        write(join(self.dir, 'index.rst'), 'world')
+        self.assertNotEqual(before, hash_tree(self.dir))
+
+    def test_ignoredFiles_shouldNotChangeHash(self):
+        before = hash_tree(self.dir, ('_build', '*.log'))
+        write(join(self.dir, '_build', 'index.html'), 'hello')
+        write(join(self.dir, 'sphinx.log'), 'log')
+        self.assertEqual(before, hash_tree(self.dir, ('_build', '*.log')))
+
+
+class TestStepCache(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.src = join(self.tmp.name, 'src')
+        makedirs(join(self.src, '_build'))
+        write(join(self.src, 'index.rst'), 'hello')
+        self.cache_dir = join(self.tmp.name, 'cache')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self, *steps):
+        backend = CountingBackend()
+        observer = NullObserver()
+        observer.enter_build()
+        task = BuildTask(self.src, list(steps), 1, StepCache(self.cache_dir))
+        result = backend.build(task, observer)
+        self.assertTrue(result.ok)
+        return backend.built, observer
+
+    def test_key_shouldDependOnStepInputs(self):
+        cache = StepCache(self.cache_dir)
+        step = BuildStep(0, 'img', cmd='make')
+        key = cache.get_key(step, 'sha256:a', self.src)
+        self.assertEqual(key, StepCache(self.cache_dir).get_key(step, 'sha256:a', self.src))
+        self.assertNotEqual(key, cache.get_key(step, 'sha256:b', self.src))
+        self.assertNotEqual(key,
+            cache.get_key(BuildStep(0, 'img', cmd='make html'), 'sha256:a', self.src))
+
+    def test_sourceHash_shouldBeReusedUntilSourcesChange(self):
+        cache = StepCache(self.cache_dir)
+        with patch('apluslms_roman.cache.hash_tree', side_effect=hash_tree) as hash_mock:
+            before = cache.source_hash(self.src)
+            self.assertEqual(before, cache.source_hash(self.src))
+            self.assertEqual(hash_mock.call_count, 1)
+            # e.g. written by a step with a mount during the build
+            write(join(self.src, 'generated.rst'), 'generated')
+            self.assertNotEqual(before, cache.source_hash(self.src))
+            self.assertEqual(hash_mock.call_count, 2)
+
+    def test_unchangedSteps_shouldBeRestoredFromCache(self):
+        built, _ = self.build(BuildStep(0, 'a'), BuildStep(1, 'b'))
+        self.assertEqual(built, [0, 1])
+
+        write(join(self.src, '_build', 'out0.txt'), 'stale')
+        steps = [BuildStep(0, 'a'), BuildStep(1, 'b')]
+        built, observer = self.build(*steps)
+        self.assertEqual(built, [])
+        self.assertEqual(observer.get_step_state(steps[1]), StepState.CACHED)
+        with open(join(self.src, '_build', 'out0.txt')) as f:
+            self.assertEqual(f.read(), 'built a:latest')
+
+    def test_changedStep_shouldRebuildDependentSteps(self):
+        self.build(BuildStep(0, 'a'), BuildStep(1, 'b'), BuildStep(2, 'c', depends_on=[]))
+        built, _ = self.build(BuildStep(0, 'a2'), BuildStep(1, 'b'), BuildStep(2, 'c', depends_on=[]))
+        self.assertEqual(built, [0, 1])
+
+    def test_stepWithMount_shouldNotBeCached(self):
+        self.build(BuildStep(0, 'a', mnt='/src'))
+        built, _ = self.build(BuildStep(0, 'a', mnt='/src'))
+        self.assertEqual(built, [0])
+
+    def test_restore_shouldOnlyWriteTheStepOutputs(self):
+        self.build(BuildStep(0, 'a'), BuildStep(1, 'b', depends_on=[]))
+        built, _ = self.build(BuildStep(0, 'a2'), BuildStep(1, 'b', depends_on=[]))
+        self.assertEqual(built, [0])
+        with open(join(self.src, '_build', 'out0.txt')) as f:
+            self.assertEqual(f.read(), 'built a2:latest')
+
+    def test_prune_shouldRemoveLeastRecentlyUsed(self):
+        cache = StepCache(self.cache_dir)
+        build_path = join(self.src, '_build')
+        for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+            before = cache.snapshot(build_path)
+            write(join(build_path, key), 'x' * 1000)
+            cache.store(key, build_path, before)
+            utime(cache._archive(key), (i, i))
+        cache.max_bytes = sum(getsize(cache._archive(key)) for key in ('bb2', 'cc3'))
+        cache.prune()
+        self.assertEqual([key in cache for key in ('aa1', 'bb2', 'cc3')],
+            [False, True, True])
+
@@ -1,3 +1,4 @@
+import json
 import sys
 from contextlib import contextmanager, ExitStack
 from collections import namedtuple
@@ -10,6 +11,13 @@ from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from apluslms_roman import cli
+from apluslms_roman.logstore import LogLine, LogObserver
+from apluslms_roman.observer import (
+    FanOutObserver,
+    JsonLinesObserver,
+    Overflow,
+    StreamObserver,
+)
 from apluslms_yamlidator.utils.yaml import rt_dump as yaml_dump
 from .mock_files import VFS
 
@@ -48,7 +56,7 @@ class CliTestCase(TestCase):
     def setUp(self):
         self.patch_stack = ExitStack().__enter__()
         # disable Engine, so cli actions don't accidentally start one
-        self.patch_stack.enter_context(patch('apluslms_roman.cli.Engine'))
+        self.patch_stack.enter_context(patch('apluslms_roman.builder.Engine'))
 
     def tearDown(self):
         self.patch_stack.close()
@@ -132,6 +140,26 @@ class CliTestCase(TestCase):
 
 
 
+class TestLogsAction(CliTestCase):
+
+    @patch('apluslms_roman.cli.get_log_store')
+    def test_stepName_shouldShowStepOfLatestBuild(self, get_log_store):
+        build = get_log_store.return_value.latest.return_value
+        build.step.return_value.read.return_value = [LogLine(0, 1.0, 'error: x')]
+        r = self.command_test("logs html --tail 5 --grep error", config=HELLO_CONFIG)
+        build.step.assert_called_once_with('html')
+        kwargs = build.step.return_value.read.call_args[1]
+        self.assertEqual((kwargs['tail'], kwargs['pattern'].pattern), (5, 'error'))
+        self.assertEqual(r.out, "error: x\n")
+
+    @patch('apluslms_roman.cli.get_log_store')
+    def test_missingBuild_shouldError(self, get_log_store):
+        get_log_store.return_value.get.return_value = None
+        r = self.command_test("logs 12", config=HELLO_CONFIG, exit_code=1)
+        get_log_store.return_value.get.assert_called_once_with(12)
+        self.assertIn("No build logs found.", r.err)
+
+
 class TestGetConfig(CliTestCase):
 
     def test_withNormalConfig(self):
@@ -153,7 +181,7 @@ class TestGetConfig(CliTestCase):
         self.assertIn("\nValidationError:", r.err)
 
 
-@patch('apluslms_roman.cli.Engine', **{
+@patch('apluslms_roman.builder.Engine', **{
     'return_value.verify.return_value': None,
     'return_value.create_builder.return_value.build.return_value': MagicMock(
         'apluslms_roman.backends.BuildResult', **{
@@ -173,7 +201,8 @@ class TestBuildAction(CliTestCase):
         self.assertEqual(builder_config.steps[0]['img'], 'hello-world')
 
         builder = engine.create_builder.return_value
-        builder.build.assert_called_once_with(step_refs=None, clean_build=False)
+        builder.build.assert_called_once_with(step_refs=None, clean_build=False,
+            workers=1, use_cache=None)
 
     def test_withEmptySteps_shouldSayNothingToBuild(self, EngineMock):
         r = self.command_test('build', config={'version': '2'}, exit_code=1)
@@ -230,7 +259,115 @@ class TestBuildAction(CliTestCase):
         engine = EngineMock.return_value
         builder = engine.create_builder.return_value
         r = self.command_test("build --clean", config=HELLO_CONFIG, exit_code=0)
-        builder.build.assert_called_once_with(step_refs=None, clean_build=True)
+        builder.build.assert_called_once_with(step_refs=None, clean_build=True,
+            workers=1, use_cache=None)
+
+    def test_withDaemonFlag_shouldSendBuildToDaemon(self, EngineMock):
+        with patch('apluslms_roman.daemon.DaemonClient') as ClientMock:
+            ClientMock.return_value.build.return_value = (
+                EngineMock.return_value.create_builder.return_value.build.return_value)
+            r = self.command_test("build --daemon /tmp/roman.sock -s hello",
+                config=HELLO_CONFIG, exit_code=0)
+        ClientMock.assert_called_once_with('/tmp/roman.sock')
+        request = ClientMock.return_value.build.call_args[1]
+        self.assertTrue(request['config'].endswith('/roman.yml'))
+        self.assertEqual(request['steps'], ['hello'])
+        EngineMock.return_value.create_builder.assert_not_called()
+        self.assertIn("test build ok", r.out)
+
+    def test_withDaemonFlag_shouldForwardHistoryAndLogs(self, EngineMock):
+        with patch('apluslms_roman.daemon.DaemonClient') as ClientMock:
+            ClientMock.return_value.build.return_value = MagicMock(code=0,
+                error=None, step=None, timings=None)
+            self.command_test("build --daemon /tmp/roman.sock --no-history --no-logs",
+                config=HELLO_CONFIG, exit_code=0)
+        request = ClientMock.return_value.build.call_args[1]
+        self.assertEqual((request['history'], request['logs']), (False, False))
+
+    def test_withDaemonFlag_shouldRejectLocalOnlyFlags(self, EngineMock):
+        for flags in ("--watch", "--trace /tmp/trace.json", "--output-overflow drop"):
+            with self.subTest(flags=flags), \
+                    patch('apluslms_roman.daemon.DaemonClient') as ClientMock:
+                r = self.command_test("build --daemon /tmp/roman.sock " + flags,
+                    config=HELLO_CONFIG, exit_code=1)
+                ClientMock.return_value.build.assert_not_called()
+                self.assertIn("{} can't be used with --daemon.".format(flags.split()[0]),
+                    r.err)
+
+    def test_withWatchFlag_shouldPrintEachResult(self, EngineMock):
+        engine = EngineMock.return_value
+        builder = engine.create_builder.return_value
+        result = builder.build.return_value
+        builder.watch.return_value = iter([result, result])
+        r = self.command_test("build --watch", config=HELLO_CONFIG, exit_code=0)
+        builder.watch.assert_called_once_with(step_refs=None, clean_build=False,
+            workers=1, use_cache=None)
+        builder.build.assert_not_called()
+        self.assertEqual(r.out.count("test build ok"), 2)
+
+    def test_withNoHistoryFlag_shouldNotRecordBuild(self, EngineMock):
+        engine = EngineMock.return_value
+        self.command_test("build", config=HELLO_CONFIG)
+        self.assertIsNotNone(engine.create_builder.call_args[1]['history'])
+        engine.reset_mock()
+        self.command_test("build --no-history", config=HELLO_CONFIG)
+        self.assertIsNone(engine.create_builder.call_args[1]['history'])
+
+    def test_withOutputOverflow_shouldUseFanOutObserver(self, EngineMock):
+        engine = EngineMock.return_value
+        self.command_test("build --output-overflow summarize", config=HELLO_CONFIG)
+        observer = engine.create_builder.call_args[1]['observer']
+        self.assertIsInstance(observer, FanOutObserver)
+        self.assertEqual([sink.overflow for sink in observer.sinks],
+            [Overflow.SUMMARIZE, Overflow.BLOCK])
+        self.assertIsInstance(observer.sinks[1].observer, LogObserver)
+
+    def test_withEmptySteps_shouldStopObserverThreads(self, EngineMock):
+        self.command_test('build', config={'version': '2'}, exit_code=1)
+        observer = EngineMock.return_value.create_builder.call_args[1]['observer']
+        self.assertFalse(any(sink._thread.is_alive() for sink in observer.sinks))
+
+    def test_withJsonlOutput_shouldWriteResultAsJson(self, EngineMock):
+        builder = EngineMock.return_value.create_builder.return_value
+        builder.build.return_value = MagicMock(code=2, error=None, step='html',
+            timings=None)
+        r = self.command_test("build --output-format jsonl --no-logs",
+            config=HELLO_CONFIG, exit_code=2)
+        observer = EngineMock.return_value.create_builder.call_args[1]['observer']
+        self.assertIsInstance(observer.sinks[0].observer, JsonLinesObserver)
+        result = json.loads(r.out.splitlines()[-1])
+        self.assertEqual((result['type'], result['code'], result['step']),
+            ('result', 2, 'html'))
+
+    def test_withJsonlOutputAndEmptySteps_shouldWriteOnlyJson(self, EngineMock):
+        r = self.command_test("build --output-format jsonl --no-logs",
+            config={'version': '2'}, exit_code=1)
+        result = json.loads(r.out)
+        self.assertEqual((result['type'], result['code'], result['error']),
+            ('result', 1, "Nothing to build."))
+
+    def test_withJsonlOutputAndDaemon_shouldWriteOnlyJson(self, EngineMock):
+        with patch('apluslms_roman.daemon.DaemonClient') as ClientMock:
+            ClientMock.return_value.build.return_value = MagicMock(code=0,
+                error=None, step=None, timings=None)
+            r = self.command_test("build --daemon /tmp/roman.sock --output-format jsonl",
+                config=HELLO_CONFIG, exit_code=0)
+        observer = ClientMock.return_value.build.call_args[1]['observer']
+        self.assertIsInstance(observer, JsonLinesObserver)
+        self.assertEqual(json.loads(r.out)['type'], 'result')
+
+    def test_withNoLogsFlag_shouldNotStoreLogs(self, EngineMock):
+        engine = EngineMock.return_value
+        self.command_test("build --no-logs", config=HELLO_CONFIG)
+        observer = engine.create_builder.call_args[1]['observer']
+        self.assertEqual([type(sink.observer) for sink in observer.sinks], [StreamObserver])
+
+    def test_withTraceFlag_shouldWriteTrace(self, EngineMock):
+        r = self.command_test("build --trace trace.json", config=HELLO_CONFIG)
+        trace = json.loads(r.files['trace.json'].get_written_content())
+        names = [event['name'] for event in trace['traceEvents']]
+        self.assertIn('load config', names)
+        self.assertIn('validate config', names)
 
 
 
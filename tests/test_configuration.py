@@ -0,0 +1,84 @@
+from glob import glob
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.builder import Builder
+from apluslms_roman.configuration import ProjectConfig
+from apluslms_roman.utils.env import EnvDict, EnvError
+
+
+CONFIG = """\
+version: 2
+environment:
+  - FOO=bar
+steps:
+  - img: hello-world
+    name: hello
+  - img: test/{}
+"""
+
+
+class TestLoadCached(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.path = join(self.dir, 'roman.yml')
+        self.write('first')
+        patcher = patch('apluslms_roman.configuration.CACHE_DIR', join(self.dir, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, image, template=CONFIG):
+        with open(self.path, 'w') as f:
+            f.write(template.replace('{}', image))
+
+    def cached_files(self):
+        return glob(join(self.dir, 'cache', 'configs', '*.json'))
+
+    def test_firstLoad_shouldValidateAndStore(self):
+        config = ProjectConfig.load_cached(self.path)
+        self.assertFalse(config.cached)
+        self.assertEqual(config.steps[1]['img'], 'test/first')
+        self.assertEqual(len(self.cached_files()), 1)
+
+    def test_secondLoad_shouldUseCache(self):
+        ProjectConfig.load_cached(self.path)
+        with patch.object(ProjectConfig, 'load') as load:
+            config = ProjectConfig.load_cached(self.path)
+        load.assert_not_called()
+        self.assertTrue(config.cached)
+        self.assertEqual(config.dir, self.dir)
+        self.assertEqual(config.version.major, 2)
+        self.assertEqual(config.steps[0]['name'], 'hello')
+        self.assertEqual(list(config.mlget('environment')), ['FOO=bar'])
+
+    def test_changedFile_shouldMissCache(self):
+        ProjectConfig.load_cached(self.path)
+        self.write('second')
+        config = ProjectConfig.load_cached(self.path)
+        self.assertFalse(config.cached)
+        self.assertEqual(config.steps[1]['img'], 'test/second')
+        self.assertEqual(len(self.cached_files()), 2)
+
+    def test_brokenCacheFile_shouldReload(self):
+        ProjectConfig.load_cached(self.path)
+        with open(self.cached_files()[0], 'w') as f:
+            f.write('{broken')
+        config = ProjectConfig.load_cached(self.path)
+        self.assertFalse(config.cached)
+        self.assertEqual(config.steps[1]['img'], 'test/first')
+
+    def test_cachedConfigEnvError_shouldRaiseWithoutLineInfo(self):
+        self.write('first', CONFIG.replace('FOO=bar', 'FOO=${MISSING}'))
+        ProjectConfig.load_cached(self.path)
+        config = ProjectConfig.load_cached(self.path)
+        self.assertTrue(config.cached)
+        env = EnvDict((config.mlget('environment'), 'project configuration'))
+        with self.assertRaises(EnvError):
+            Builder(None, config, environment=env).get_steps()
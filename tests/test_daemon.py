@@ -0,0 +1,138 @@
+import json
+import socket
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest import TestCase
+
+from apluslms_roman.backends import Backend, BuildResult
+from apluslms_roman.daemon import BuildDaemon, DaemonClient, DaemonError, dump_message
+from apluslms_roman.observer import Message
+from .helpers import ListObserver
+
+
+class EchoBackend(Backend):
+    name = 'echo'
+
+    def prepare(self, task, observer):
+        return BuildResult()
+
+    def build_step(self, task, step, observer):
+        observer.step_running(step)
+        observer.container_msg(step, "%s %s\n" % (step.img, step.env.get('GREETING')))
+        if step.cmd == 'fail':
+            observer.step_failed(step)
+            return BuildResult(1, None, step)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+
+class TickingBackend(EchoBackend):
+    """Writes output until the step is stopped"""
+    name = 'ticking'
+    stopped = Event()
+    cancelled = Event()
+
+    def build_step(self, task, step, observer):
+        observer.step_running(step)
+        try:
+            with self.stoppable(task, self.stopped.set):
+                while not self.stopped.wait(0.01):
+                    observer.container_msg(step, "tick\n")
+        except KeyboardInterrupt:
+            self.cancelled.set()
+            raise
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+
+CONFIG = """version: '2.0'
+environment:
+  - GREETING=hello
+steps:
+  - img: first
+  - img: second
+    name: fail
+    cmd: fail
+"""
+
+
+class TestBuildDaemon(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.config = join(self.tmp.name, 'roman.yml')
+        with open(self.config, 'w') as f:
+            f.write(CONFIG)
+        self.socket = join(self.tmp.name, 'daemon.sock')
+        self.server = BuildDaemon(self.socket,
+            settings={'backend': 'tests.test_daemon.EchoBackend'})
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = DaemonClient(self.socket, timeout=10)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def test_ping(self):
+        self.assertTrue(self.client.ping())
+        self.assertFalse(DaemonClient(self.socket + '.missing').ping())
+
+    def test_build_shouldStreamMessagesAndResult(self):
+        observer = ListObserver()
+        result = self.client.build(observer=observer, config=self.config, steps=['0'])
+        self.assertTrue(result.ok)
+        lines = [data for type_, _s, data in observer.messages
+            if type_ == Message.CONTAINER_MSG]
+        self.assertEqual(lines, [("first:latest hello",)])
+
+    def test_failedBuild_shouldReturnFailedStep(self):
+        result = self.client.build(observer=ListObserver(), config=self.config)
+        self.assertEqual(result.code, 1)
+        self.assertEqual(result.step, 'fail')
+
+    def test_unknownStep_shouldRaiseDaemonError(self):
+        with self.assertRaises(DaemonError):
+            self.client.build(observer=ListObserver(), config=self.config, steps=['nope'])
+
+    def test_configShouldBeCachedUntilChanged(self):
+        self.assertIs(self.server.get_config(self.config), self.server.get_config(self.config))
+
+
+class TestBuildDaemonDisconnect(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.config = join(self.tmp.name, 'roman.yml')
+        with open(self.config, 'w') as f:
+            f.write("version: '2.0'\nsteps:\n  - img: first\n")
+        self.socket = join(self.tmp.name, 'daemon.sock')
+        self.server = BuildDaemon(self.socket,
+            settings={'backend': 'tests.test_daemon.TickingBackend'})
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        TickingBackend.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmp.cleanup()
+        TickingBackend.stopped.clear()
+        TickingBackend.cancelled.clear()
+
+    def test_clientDisconnect_shouldCancelBuild(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(10)
+        sock.connect(self.socket)
+        sock.sendall(dump_message({'action': 'build', 'config': self.config}))
+        with sock.makefile('rb') as f:
+            for line in f:
+                if b'"tick"' in line:
+                    break
+        sock.close()
+        self.assertTrue(TickingBackend.cancelled.wait(5))
+        self.assertTrue(DaemonClient(self.socket, timeout=10).ping())
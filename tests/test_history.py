@@ -0,0 +1,154 @@
+import sqlite3
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.backends import Backend, BuildResult, BuildStep
+from apluslms_roman.builder import Engine
+from apluslms_roman.configuration import ProjectConfig
+from apluslms_roman.history import BuildHistory, percentile
+from apluslms_roman.observer import BuildObserver, StepState
+from apluslms_roman.utils.timing import BuildTimings
+from .helpers import NullObserver
+
+
+class HistoryBackend(Backend):
+
+    def prepare(self, task, observer):
+        return BuildResult()
+
+    def build_step(self, task, step, observer):
+        observer.step_running(step)
+        observer.container_msg(step, "building {}\n".format(step.img))
+        if step.cmd == 'fail':
+            observer.step_failed(step)
+            return BuildResult(3, None, step)
+        observer.step_succeeded(step)
+        return BuildResult(step=step)
+
+    def get_image_id(self, step):
+        return 'sha256:' + step.img
+
+
+def build_result(steps, seconds, failed=None):
+    timings = BuildTimings()
+    for step, value in zip(steps, seconds):
+        timings.step(step).add('build', value)
+    if failed is not None:
+        return BuildResult(1, None, failed, timings=timings)
+    return BuildResult(timings=timings)
+
+
+class HistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.history = BuildHistory(join(self.tmp.name, 'data', 'history.sqlite3'))
+        self.steps = [BuildStep(0, 'a', name='html'), BuildStep(1, 'b')]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, seconds, project='/p', started=1000.0, failed=None):
+        states = {step: StepState.SUCCEEDED for step in self.steps}
+        if failed is not None:
+            states[failed] = StepState.FAILED
+        return self.history.record(project, self.steps,
+            build_result(self.steps, seconds, failed), started, sum(seconds),
+            states=states)
+
+
+class TestBuildHistory(HistoryTestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertAlmostEqual(percentile([1, 2, 3, 4, 5], 95), 4.8)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_builds_shouldReturnNewestFirst(self):
+        self.record([1.0, 2.0], started=1000.0)
+        self.record([1.0, 2.0], started=2000.0, failed=self.steps[1])
+        builds = self.history.builds('/p')
+        self.assertEqual([b.started for b in builds], [2000.0, 1000.0])
+        self.assertEqual((builds[0].code, builds[0].step), (1, '1'))
+        self.assertEqual(self.history.builds('/other'), [])
+
+    def test_expectedDurations_shouldUseMedianOfLatestRuns(self):
+        for i, seconds in enumerate([100.0, 1.0, 2.0, 3.0]):
+            self.record([seconds, 5.0], started=1000.0 + i)
+        self.assertEqual(self.history.expected_durations('/p', samples=3),
+            {'html': 2.0, '1': 5.0})
+
+    def test_expectedDurations_shouldIgnoreFailedRuns(self):
+        self.record([1.0, 9.0], failed=self.steps[1])
+        self.assertEqual(self.history.expected_durations('/p'), {'html': 1.0})
+
+    def test_slowestSteps(self):
+        self.record([1.0, 4.0], project='/p')
+        self.record([3.0, 2.0], project='/q')
+        slowest = self.history.slowest_steps(limit=2)
+        self.assertEqual([(s.project, s.step, s.duration) for s in slowest],
+            [('/p', '1', 4.0), ('/q', 'html', 3.0)])
+
+    def test_stepStats_shouldGroupByPeriod(self):
+        day = 24 * 60 * 60
+        for i, seconds in enumerate([1.0, 2.0, 3.0, 10.0]):
+            self.record([seconds, 1.0], started=10 * day + i * day / 2)
+        stats = {s.step: s for s in self.history.step_stats('/p')}
+        self.assertEqual((stats['html'].count, stats['html'].p50, stats['html'].max),
+            (4, 2.5, 10.0))
+        by_day = [s for s in self.history.step_stats('/p', period='day')
+            if s.step == 'html']
+        self.assertEqual([s.count for s in by_day], [2, 2])
+        self.assertLess(by_day[0].period, by_day[1].period)
+
+    def test_clear(self):
+        self.record([1.0, 1.0], project='/p')
+        self.record([1.0, 1.0], project='/q')
+        self.history.clear('/p')
+        self.assertEqual([b.project for b in self.history.builds()], ['/q'])
+        self.assertEqual([s.project for s in self.history.slowest_steps()], ['/q', '/q'])
+
+
+class TestBuilderHistory(HistoryTestCase):
+
+    def get_builder(self, steps, observer):
+        config = {'version': '2.0', 'steps': steps}
+        config = ProjectConfig(ProjectConfig.Container(
+            join(self.tmp.name, 'roman.yml'), allow_missing=True), None, config, None)
+        engine = Engine(HistoryBackend)
+        return engine.create_builder(config, observer=observer, history=self.history)
+
+    def test_build_shouldRecordSteps(self):
+        builder = self.get_builder([{'img': 'a', 'name': 'html'},
+            {'img': 'b', 'cmd': 'fail'}, {'img': 'c'}], NullObserver())
+        result = builder.build()
+        self.assertEqual(result.code, 3)
+        build, = self.history.builds()
+        self.assertEqual((build.project, build.code, build.step), (self.tmp.name, 3, '1'))
+        with sqlite3.connect(self.history.path) as conn:
+            rows = conn.execute('SELECT step, digest, state, code, log_bytes '
+                'FROM steps ORDER BY rowid').fetchall()
+        self.assertEqual(rows, [
+            ('html', 'sha256:a:latest', 'SUCCEEDED', 0, 18),
+            ('1', 'sha256:b:latest', 'FAILED', 3, 18),
+            ('2', None, 'NOTSTARTED', None, None),
+        ])
+
+    def test_build_shouldSetExpectedDurations(self):
+        self.record([4.0, 6.0], project=self.tmp.name)
+        observer = NullObserver()
+        builder = self.get_builder([{'img': 'a', 'name': 'html'}, {'img': 'b'}],
+            observer)
+        seen = []
+        def step_succeeded(step):
+            seen.append((str(step), observer.get_expected(step), observer.eta()))
+            BuildObserver.step_succeeded(observer, step)
+        with patch.object(observer, 'step_succeeded', side_effect=step_succeeded):
+            builder.build()
+        self.assertEqual([(name, expected) for name, expected, _eta in seen],
+            [('html', 4.0), ('1', 6.0)])
+        self.assertTrue(6.0 < seen[0][2] <= 10.0)
+        self.assertTrue(0.0 < seen[1][2] <= 6.0)
@@ -0,0 +1,118 @@
+import re
+import zlib
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.backends import BuildResult, BuildStep
+from apluslms_roman.logstore import LogObserver, LogStore, parse_since
+from apluslms_roman.observer import FanOutObserver, ObserverSink
+
+
+class LogStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.store = LogStore(join(self.tmp.name, 'logs'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_build(self, project='/p', started=1000.0, segments=10):
+        build = self.store.create(project, started)
+        for i in range(segments):
+            # one segment per second
+            build.write('html', ["line %d.%d" % (i, j) for j in range(3)], 1000.0 + i)
+        build.write('pdf', ['error: x'], 1000.0)
+        build.close(1, None, 'pdf')
+        return build
+
+
+class TestLogStore(LogStoreTestCase):
+
+    def test_read_shouldReturnAllLines(self):
+        build = self.store.get(self.write_build().id)
+        self.assertEqual((build.info.project, build.info.code, build.info.step),
+            ('/p', 1, 'pdf'))
+        self.assertEqual([step.name for step in build.steps()], ['html', 'pdf'])
+        lines = build.step('html').read()
+        self.assertEqual(len(lines), 30)
+        self.assertEqual(lines[4], (4, 1001.0, 'line 1.1'))
+        self.assertEqual(len(build.step('html').segments()), 10)
+
+    def test_tail_shouldDecompressOnlyTheLastSegments(self):
+        step = self.store.get(self.write_build().id).step('html')
+        with patch('apluslms_roman.logstore.zlib.decompress',
+                side_effect=zlib.decompress) as decompress:
+            lines = step.read(tail=4)
+        self.assertEqual([line.text for line in lines],
+            ['line 8.2', 'line 9.0', 'line 9.1', 'line 9.2'])
+        self.assertEqual(decompress.call_count, 2)
+
+    def test_grepAndSince_shouldFilterLines(self):
+        step = self.store.get(self.write_build().id).step('html')
+        lines = step.read(since=1007.0, pattern=re.compile(r'\.1$'))
+        self.assertEqual([line.text for line in lines], ['line 7.1', 'line 8.1', 'line 9.1'])
+        lines = step.read(tail=1, pattern=re.compile('^line 2'))
+        self.assertEqual([line.text for line in lines], ['line 2.2'])
+
+    def test_builds_shouldBeNewestFirst(self):
+        first = self.write_build('/p')
+        self.write_build('/q')
+        third = self.write_build('/p')
+        self.assertEqual([b.id for b in self.store.builds('/p')], [third.id, first.id])
+        self.assertEqual(self.store.latest('/p').id, third.id)
+
+    def test_prune_shouldKeepSizeAndAgeLimits(self):
+        day = 24 * 60 * 60
+        builds = [self.write_build(started=started) for started in (1.0, 3 * day, 4 * day)]
+        size = self.store.get(builds[2].id).info.size
+        self.store.max_days = 2
+        with patch('apluslms_roman.logstore.time', return_value=4 * day):
+            self.store.prune()
+            self.assertEqual([b.id for b in self.store.builds()],
+                [builds[2].id, builds[1].id])
+            self.store.max_bytes = size
+            self.store.prune()
+        self.assertEqual([b.id for b in self.store.builds()], [builds[2].id])
+
+    def test_parseSince(self):
+        self.assertEqual(parse_since('90s', now=1000.0), 910.0)
+        self.assertEqual(parse_since('2h', now=10000.0), 2800.0)
+        self.assertIsInstance(parse_since('2020-01-02 10:00'), float)
+        with self.assertRaises(ValueError):
+            parse_since('yesterday')
+
+
+class TestLogObserver(LogStoreTestCase):
+
+    def test_build_shouldStoreContainerOutput(self):
+        observer = FanOutObserver([ObserverSink(LogObserver(self.store, '/p'))])
+        step = BuildStep(0, 'img')
+        observer.enter_prepare()
+        observer.enter_build()
+        observer.step_running(step)
+        observer.container_msg(step, "a\nb\n")
+        observer.step_failed(step)
+        observer.result_msg(BuildResult(2, None, step))
+        observer.done()
+        observer.close()
+        build = self.store.latest('/p')
+        self.assertEqual((build.info.code, build.info.step), (2, '0'))
+        self.assertEqual([line.text for line in build.step('0').read()], ['a', 'b'])
+
+    def test_storeError_shouldCloseTheBuild(self):
+        observer = LogObserver(self.store, '/p')
+        step = BuildStep(0, 'img')
+        observer.enter_build()
+        observer.container_msg(step, "a\n")
+        build = observer.build
+        with patch.object(build, 'write', side_effect=OSError("disk full")), \
+                self.assertLogs('apluslms_roman.logstore', 'WARNING'):
+            observer.container_msg(step, "b\n")
+        self.assertIsNone(observer.build)
+        self.assertEqual(build._writers, {})
+        self.assertEqual([line.text for line in self.store.get(build.id).step('0').read()],
+            ['a'])
+
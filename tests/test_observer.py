@@ -0,0 +1,155 @@
+import json
+from io import StringIO
+from threading import Event
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.backends import BuildResult, BuildStep
+from apluslms_roman.observer import (
+    FanOutObserver,
+    JsonLinesObserver,
+    Message,
+    ObserverSink,
+    Overflow,
+    StepState,
+    StreamObserver,
+)
+from .helpers import ListObserver
+
+
+class BlockedStream(StringIO):
+    """Waits for `blocked` before each write and counts the flushes"""
+    def __init__(self, blocked=None):
+        super().__init__()
+        self.blocked = blocked
+        self.flushes = 0
+        self.flushed = 0
+
+    def write(self, text):
+        if self.blocked is not None:
+            self.blocked.wait(5)
+        return super().write(text)
+
+    def flush(self):
+        self.flushes += 1
+        self.flushed = self.tell()
+
+class TestStreamObserver(TestCase):
+
+    def test_runningStep_shouldShowExpectedDuration(self):
+        stream = StringIO()
+        observer = StreamObserver(stream)
+        step = BuildStep(0, 'img')
+        observer.set_expected({step: 90.0})
+        observer.enter_build()
+        observer.step_running(step)
+        self.assertIn("BUILD 0 Running.. (usually 1m 30s, about 1m 30s left)", stream.getvalue())
+
+
+class TestJsonLinesObserver(TestCase):
+
+    def test_messages_shouldBeWrittenAsJsonLines(self):
+        stream = StringIO()
+        observer = JsonLinesObserver(stream)
+        step = BuildStep(0, 'img', name='html')
+        observer.enter_build()
+        observer.step_running(step)
+        observer.container_msg(step, "a\nä\n")
+        observer.write_result(BuildResult(step=step))
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(e['msg'] if e['type'] == 'message' else 'result')
+            for e in events], ['PHASE_UPDATE', 'STATE_UPDATE', 'CONTAINER_MSG', 'result'])
+        log = events[2]
+        self.assertEqual((log['phase'], log['step'], log['ref'], log['state'], log['data']),
+            ('BUILD', 'html', 0, 'RUNNING', ['a', 'ä']))
+        self.assertIsInstance(log['time'], float)
+        self.assertIn('"data":["a","ä"]', stream.getvalue())
+        self.assertEqual(observer.log_bytes[step], 5)
+        self.assertEqual((events[3]['code'], events[3]['step']), (0, 'html'))
+
+    def test_behindFanOut_shouldWriteTimeOfTheEvent(self):
+        blocked = Event()
+        stream = BlockedStream(blocked)
+        observer = FanOutObserver([JsonLinesObserver(stream)])
+        step = BuildStep(0, 'img')
+        with patch('apluslms_roman.observer.time', return_value=100.0):
+            observer.enter_build()
+            observer.container_msg(step, "a\n")
+        blocked.set()
+        observer.done()
+        observer.close()
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([e['time'] for e in events[:2]], [100.0, 100.0])
+        self.assertGreater(events[2]['time'], 100.0)
+
+    def test_containerMessages_shouldNotFlushEachLine(self):
+        stream = BlockedStream()
+        observer = JsonLinesObserver(stream)
+        step = BuildStep(0, 'img')
+        observer.enter_build()
+        flushes = stream.flushes
+        for i in range(10):
+            observer.container_msg(step, "line %d\n" % (i,))
+        self.assertLessEqual(stream.flushes - flushes, 1)
+        observer.step_succeeded(step)
+        self.assertEqual(stream.flushed, len(stream.getvalue()))
+
+
+class TestFanOutObserver(TestCase):
+
+    def setUp(self):
+        self.step = BuildStep(0, 'img')
+
+    def fill(self, overflow, maxsize=2):
+        blocked = Event()
+        target = ListObserver(blocked)
+        sink = ObserverSink(target, maxsize, overflow)
+        observer = FanOutObserver([sink])
+        observer.enter_build()
+        observer.step_running(self.step)
+        for i in range(5):
+            observer.container_msg(self.step, "line %d\nline %d" % (i, i))
+        blocked.set()
+        observer.done()
+        observer.close()
+        return target, sink
+
+    def logs(self, target):
+        return [data for type_, step, data in target.messages
+            if type_ in (Message.CONTAINER_MSG, Message.MANAGER_MSG)]
+
+    def test_messages_shouldReachAllObserversInOrder(self):
+        targets = [ListObserver(), ListObserver()]
+        observer = FanOutObserver(targets)
+        observer.enter_build()
+        observer.step_running(self.step)
+        observer.container_msg(self.step, "a\nb\n")
+        observer.step_succeeded(self.step)
+        observer.done()
+        self.assertEqual(observer.states, {self.step: StepState.SUCCEEDED})
+        for target in targets:
+            self.assertEqual([m[0] for m in target.messages], [Message.PHASE_UPDATE,
+                Message.STATE_UPDATE, Message.CONTAINER_MSG, Message.STATE_UPDATE,
+                Message.TIMING_MSG, Message.TIMING_MSG, Message.PHASE_UPDATE])
+            self.assertEqual(target.messages[2][2], ['a', 'b'])
+        observer.close()
+
+    def test_dropOldest_shouldKeepNewestLines(self):
+        target, sink = self.fill(Overflow.DROP_OLDEST)
+        logs = self.logs(target)
+        self.assertEqual(logs[-1], ['line 4', 'line 4'])
+        self.assertLess(len(logs), 5)
+        self.assertEqual(sink.dropped, 2 * (5 - len(logs)))
+        self.assertEqual(target.messages[-1][0], Message.PHASE_UPDATE)
+
+    def test_summarize_shouldReportDroppedLines(self):
+        target, sink = self.fill(Overflow.SUMMARIZE)
+        logs = self.logs(target)
+        self.assertEqual(logs[-1], ["%d lines of output were dropped" % (sink.dropped,)])
+        self.assertGreater(sink.dropped, 0)
+        self.assertEqual(sum(len(data) for data in logs[:-1]) + sink.dropped, 10)
+
+    def test_block_shouldKeepAllLines(self):
+        target, sink = self.fill(Overflow.BLOCK, maxsize=100)
+        self.assertEqual(len(self.logs(target)), 5)
+        self.assertEqual(sink.dropped, 0)
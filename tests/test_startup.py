@@ -0,0 +1,93 @@
+import json
+import subprocess
+import sys
+from os import environ, pathsep
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+# modules, which must be imported only by the subsystem using them
+HEAVY_MODULES = (
+    'requests',
+    'docker',
+    'sqlite3',
+    'apluslms_roman.backends.docker',
+    'apluslms_roman.batch',
+    'apluslms_roman.builder',
+    'apluslms_roman.cache',
+    'apluslms_roman.daemon',
+    'apluslms_roman.logstore',
+    'apluslms_roman.utils.watch',
+)
+
+# modules, which 'roman --version' must not import, as it reads no files
+VERSION_HEAVY_MODULES = HEAVY_MODULES + (
+    'ruamel.yaml',
+    'jsonschema',
+    'apluslms_roman.configuration',
+    'apluslms_roman.history',
+    'apluslms_roman.settings',
+    'apluslms_roman.validation',
+)
+
+SCRIPT = """
+import json, sys
+from apluslms_roman.cli import main
+try:
+    main(args=sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps({'modules': sorted(sys.modules)}))
+"""
+
+
+class TestStartup(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+        with open(join(self.dir, 'roman.yml'), 'w') as f:
+            f.write("version: 2\nsteps:\n  - img: hello-world\n    name: hello\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_cli(self, *args, script=SCRIPT):
+        env = dict(environ)
+        paths = [ROOT, join(ROOT, 'apluslms-yamlidator')]
+        if env.get('PYTHONPATH'):
+            paths.append(env['PYTHONPATH'])
+        env['PYTHONPATH'] = pathsep.join(paths)
+        env['XDG_CONFIG_HOME'] = join(self.dir, 'config')
+        env['XDG_CACHE_HOME'] = join(self.dir, 'cache')
+        proc = subprocess.run([sys.executable, '-c', script] + list(args),
+            cwd=self.dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return json.loads(proc.stdout.splitlines()[-1])
+
+    def assertFastStartup(self, *args, heavy_modules=HEAVY_MODULES):
+        result = self.run_cli(*args)
+        loaded = [m for m in heavy_modules if m in result['modules']]
+        self.assertEqual(loaded, [], "roman {} imported heavy modules".format(' '.join(args)))
+
+    def test_version(self):
+        self.assertFastStartup('--version', heavy_modules=VERSION_HEAVY_MODULES)
+
+    def test_configPrint(self):
+        self.assertFastStartup('config')
+
+    def test_stepList(self):
+        self.assertFastStartup('step', 'list')
+
+    def test_buildListSteps(self):
+        self.assertFastStartup('build', '?')
+
+    def test_importPackage_shouldNotLoadYaml(self):
+        result = self.run_cli(script="import json, sys, apluslms_roman; "
+            "print(json.dumps({'modules': sorted(sys.modules)}))")
+        for module in ('ruamel.yaml', 'jsonschema', 'apluslms_roman.builder'):
+            self.assertNotIn(module, result['modules'])
@@ -0,0 +1,112 @@
+import json
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman import cli, validation
+from apluslms_roman.validation import FileResult, FileValidator, validate_files
+
+from .test_cli import capture_output
+
+
+VALID = "version: 2\nsteps:\n  - img: hello-world\n    name: hello\n"
+INVALID = "version: 2\nsteps:\n  - name: hello\n"
+
+
+class ValidationTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.paths = []
+        for i in range(6):
+            self.paths.append(self.write('p%d.yml' % i, INVALID if i == 3 else VALID))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        path = join(self.tmp.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+
+class TestFileValidator(ValidationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.validator = FileValidator('roman_project')
+
+    def test_validFile(self):
+        result = self.validator.validate(self.paths[0])
+        self.assertTrue(result.ok)
+        self.assertEqual([doc.error for doc in result.documents], [None])
+
+    def test_invalidFile_shouldRenderError(self):
+        result = self.validator.validate(self.paths[3])
+        self.assertFalse(result.ok)
+        self.assertIn("'img' is a required property", '\n'.join(result.invalid[0].error))
+
+    def test_emptyFile_shouldHaveMessage(self):
+        result = self.validator.validate(self.write('empty.yml', ''))
+        self.assertTrue(result.ok)
+        self.assertEqual(result.documents, [])
+        self.assertIsNotNone(result.message)
+
+    def test_brokenFile_shouldHaveError(self):
+        result = self.validator.validate(self.write('broken.yml', "a: [b\n"))
+        self.assertFalse(result.ok)
+        self.assertIsNotNone(result.error)
+
+    def test_missingVersion_shouldHaveMessage(self):
+        validator = FileValidator('roman_project', max_version='1.0')
+        result = validator.validate(self.paths[0])
+        self.assertEqual(result.documents, [])
+        self.assertIsNotNone(result.message)
+
+
+class TestValidateFiles(ValidationTestCase):
+
+    def test_inProcess_shouldKeepOrder(self):
+        results = list(validate_files(self.paths, 'roman_project'))
+        self.assertEqual([r.path for r in results], self.paths)
+        self.assertEqual([r.ok for r in results], [True, True, True, False, True, True])
+
+    def test_withWorkers_shouldKeepOrder(self):
+        results = list(validate_files(self.paths, 'roman_project', workers=2))
+        self.assertTrue(all(isinstance(r, FileResult) for r in results))
+        self.assertEqual([r.path for r in results], self.paths)
+        self.assertEqual([r.ok for r in results], [True, True, True, False, True, True])
+
+    def test_worker_shouldUseRemoteSchemaSettings(self):
+        settings = {'cache_dir': None, 'ttl': 60, 'timeout': 5.0, 'offline': True}
+        with patch.object(validation, '_worker_validator', None), \
+                patch.object(validation, '_worker_key', None), \
+                patch.object(validation.remote_schemas, 'configure') as configure:
+            for path in self.paths[:2]:
+                result = validation._validate_in_worker('roman_project', None,
+                    settings, path)
+                self.assertTrue(result.ok)
+        configure.assert_called_once_with(**settings)
+
+    def test_unordered_shouldReturnAllResults(self):
+        results = list(validate_files(self.paths, 'roman_project', workers=2,
+            ordered=False))
+        self.assertEqual(sorted(r.path for r in results), sorted(self.paths))
+
+
+class TestValidateSchemaAction(ValidationTestCase):
+
+    def test_summary_shouldBeWritten(self):
+        summary = join(self.tmp.name, 'summary.json')
+        with capture_output() as (out, err), self.assertRaises(SystemExit) as cm:
+            cli.main(args=['validate', 'schema', '-j', '2', '--summary',
+                summary, 'roman_project'] + self.paths)
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("Found total of 1 errors in 6 documents.", out.getvalue())
+        with open(summary) as f:
+            data = json.load(f)
+        self.assertEqual(data['files'], 6)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['invalid_files'], [self.paths[3]])
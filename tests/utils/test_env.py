@@ -11,6 +11,7 @@ from apluslms_roman.utils.env import (
     replacement_rgxs,
     sub_rgx,
     var_rgx,
+    compile_value,
     EnvDict
 )
 from apluslms_yamlidator.utils.collections import OrderedDict
@@ -202,6 +203,13 @@ class TestExpansionErrors(TestCase):
         self.check_err_msg("Unrecognized parameter substitution pattern",
             env.get_combined)
 
+    def test_referenceInName_shouldError(self):
+        for value in ('${${A}x}', 'B${${B}}/', '${${A}${B}:-c}'):
+            with self.subTest(value=value):
+                env = EnvDict(([{'A': 'a'}, {'B': 'b'}, {'VAR1': value}], 0),)
+                self.check_err_msg("Unrecognized parameter substitution pattern",
+                    env.get_combined)
+
     def test_wrongReplacementPattern_shouldError(self):
         env = EnvDict(([
             {'VAR': 'hello'},
@@ -226,6 +234,60 @@ class TestCombineEnvs(TestCase):
             {'VAR1': 'test', 'VAR2': 'hello!', 'VAR3': 'test2'}, dict(env))
 
 
+class TestLayeredCombine(TestCase):
+
+    def setUp(self):
+        self.env = EnvDict(([{'VAR1': 'test'}, {'VAR2': '${VAR1}!'}], 'project'))
+
+    def test_getCombined_shouldBeMemoized(self):
+        with patch('apluslms_roman.utils.env.update') as update_mock:
+            self.env.get_combined()
+            self.env.get_combined()
+        self.assertEqual(update_mock.call_count, 2)
+
+    def test_combineWithEmpty_shouldEqualProjectLayer(self):
+        self.assertEqual(self.env.combine([], 'step'), self.env.get_combined())
+        self.assertEqual(self.env.combine(None, 'step'), self.env.get_combined())
+
+    def test_modifiedCombined_shouldNotChangeProjectLayer(self):
+        combined = self.env.combine(None, 'step')
+        combined['VAR1'] = 'changed'
+        self.assertEqual('test', self.env.get_combined()['VAR1'])
+        self.assertEqual('test', self.env.combine(None, 'other')['VAR1'])
+
+    def test_combine_shouldNotModifyProjectLayer(self):
+        combined = self.env.combine([
+            {'VAR1': '${VAR2}?'},
+            {'name': 'VAR2', 'unset': True},
+        ], 'step')
+        self.assertEqual({'VAR1': 'test!?'}, dict(combined))
+        self.assertEqual({'VAR1': 'test', 'VAR2': 'test!'}, dict(self.env.get_combined()))
+
+    def test_changedLayers_shouldBeExpandedAgain(self):
+        self.env.get_combined()
+        self.env.set_in_env('project', 'VAR1', 'other')
+        self.assertEqual('other!', self.env.get_combined()['VAR2'])
+        self.env.add_env([{'VAR3': 'x'}], 'global')
+        self.assertEqual('x', self.env.get_combined()['VAR3'])
+
+    def test_builderSteps_shouldShareProjectLayer(self):
+        config = ProjectConfig.load('/roman.yml', allow_missing=True)
+        config.mlset('steps', [
+            {'img': 'a'},
+            {'img': 'b'},
+            {'img': 'c', 'env': [{'VAR3': '${VAR2}'}]},
+        ])
+        with patch('apluslms_roman.builder.isdir', return_value=True), \
+                patch.object(EnvDict, '_expand', autospec=True,
+                    side_effect=EnvDict._expand) as expand:
+            steps = Builder(None, config, environment=self.env).get_steps()
+        # the project layer once and the environment of the step c
+        self.assertEqual(expand.call_count, 2)
+        self.assertEqual(steps[0].env, steps[1].env)
+        self.assertEqual('test!', steps[2].env['VAR3'])
+        self.assertNotIn('VAR3', steps[0].env)
+
+
 class TestLineCol(CliTestCase):
 
     def test_basic_shouldPrintCorrectPartOfYaml(self):
@@ -317,3 +379,45 @@ class TestStepEnvs(TestCase):
         steps = builder.get_steps()
         self.assertEqual(steps[0].env, {'a': 'b'})
         self.assertEqual(steps[1].env, {})
+
+
+class TestCompiledExpansion(TestCase):
+
+    def test_sameValue_shouldBeCompiledOnce(self):
+        compile_value.cache_clear()
+        EnvDict(([
+            {'VAR': 'a'},
+            {'TEST1': '${VAR:-b}/${VAR}'},
+            {'TEST2': '${VAR:-b}/${VAR}'},
+        ], 0)).get_combined()
+        info = compile_value.cache_info()
+        self.assertEqual(info.hits, 1)
+
+    def test_invalidReferences_shouldBeText(self):
+        env = EnvDict(([
+            {'VAR': 'a'},
+            {'TEST': '${}${VAR${:-{x}}$$VAR${VAR'},
+        ], 0)).get_combined()
+        self.assertEqual(env['TEST'], '${}${VAR${:-{x}}$$VAR${VAR')
+
+    def test_expandedValues_shouldNotBeExpandedAgain(self):
+        env = EnvDict(([
+            {'VAR': 'a'},
+            {'DOLLAR': '$'},
+            {'TEST': '${DOLLAR}{VAR}'},
+        ], 0)).get_combined()
+        self.assertEqual(env['TEST'], '${VAR}')
+
+    def test_nonStrInSubstitution_shouldBeJson(self):
+        env = EnvDict(([
+            {'LIST': ['a', 'b']},
+            {'TEST': 'x${LIST:-c}'},
+        ], 0)).get_combined()
+        self.assertEqual(env['TEST'], 'x["a", "b"]')
+
+    def test_manyReferences(self):
+        env = [{'VAR%d' % i: str(i)} for i in range(100)]
+        value = ''.join('${VAR%d}-' % i for i in range(100)) * 10
+        env.append({'TEST': value})
+        env = EnvDict((env, 0)).get_combined()
+        self.assertEqual(env['TEST'], ''.join('%d-' % i for i in range(100)) * 10)
@@ -0,0 +1,88 @@
+from io import StringIO
+from threading import Event
+from unittest import TestCase
+
+from apluslms_roman.backends import BuildStep
+from apluslms_roman.observer import StreamObserver
+from apluslms_roman.utils.logs import LineDecoder, LogBuffer
+from apluslms_roman.utils.scheduler import Deadlines
+
+
+class TestLineDecoder(TestCase):
+
+    def test_decode_shouldKeepPartialLinesAndCharacters(self):
+        decoder = LineDecoder()
+        self.assertEqual(decoder.decode(b'a\nb\xc3'), 'a\n')
+        self.assertEqual(decoder.decode(b'\xa4'), '')
+        self.assertEqual(decoder.decode(b'\nc\nd'), 'b\xe4\nc\n')
+        self.assertEqual(decoder.decode(b'', final=True), 'd')
+
+    def test_invalidBytes_shouldBeReplaced(self):
+        self.assertEqual(LineDecoder().decode(b'\xff\n'), '�\n')
+
+
+class TestLogBuffer(TestCase):
+
+    def test_lines_shouldBeCoalescedUntilClose(self):
+        writes = []
+        with LogBuffer(writes.append, max_delay=60) as logs:
+            for chunk in (b'a\n', b'b\nc', b'\n', b'd'):
+                logs.feed(chunk)
+            self.assertEqual(writes, [])
+        self.assertEqual(writes, ['a\nb\nc\nd'])
+
+    def test_maxBytes_shouldFlush(self):
+        writes = []
+        logs = LogBuffer(writes.append, max_bytes=4, max_delay=60)
+        logs.feed(b'ab\n')
+        logs.feed(b'cd\nef')
+        self.assertEqual(writes, ['ab\ncd\n'])
+        logs.close()
+        self.assertEqual(writes, ['ab\ncd\n', 'ef'])
+
+    def test_maxBytes_shouldCountEncodedBytes(self):
+        writes = []
+        logs = LogBuffer(writes.append, max_bytes=5, max_delay=60)
+        logs.feed('ää\n'.encode('utf-8'))
+        self.assertEqual(writes, ['ää\n'])
+
+    def test_maxDelay_shouldFlushFromTimer(self):
+        written = Event()
+        writes = []
+        def write(text):
+            writes.append(text)
+            written.set()
+        logs = LogBuffer(write, max_delay=0.01)
+        logs.feed(b'a\n')
+        self.assertTrue(written.wait(5))
+        self.assertEqual(writes, ['a\n'])
+        logs.close()
+        self.assertEqual(writes, ['a\n'])
+
+    def test_blockedWrite_shouldNotStallDeadlines(self):
+        deadlines = Deadlines()
+        writing, release = Event(), Event()
+        def write(text):
+            writing.set()
+            release.wait(5)
+        logs = LogBuffer(write, max_delay=0.01, deadlines=deadlines)
+        try:
+            logs.feed(b'a\n')
+            self.assertTrue(writing.wait(5))
+            called = Event()
+            deadlines.add(0.01, called.set)
+            self.assertTrue(called.wait(5))
+        finally:
+            release.set()
+        logs.close()
+
+
+class TestStreamObserver(TestCase):
+
+    def test_containerMessage_shouldPrefixEachLine(self):
+        stream = StringIO()
+        observer = StreamObserver(stream)
+        step = BuildStep(0, 'img')
+        observer.enter_build()
+        observer.container_msg(step, 'a\nb\n')
+        self.assertEqual(stream.getvalue(), 'BUILD 0 >> a\nBUILD 0 >> b\n')
@@ -0,0 +1,144 @@
+from threading import Event
+from unittest import TestCase
+
+from apluslms_roman.backends import BuildStep
+from apluslms_roman.utils.scheduler import (
+    Deadlines,
+    Overlaps,
+    StepGraph,
+    StepGraphError,
+    run_graph,
+)
+
+
+def make_steps(*depends_on):
+    return [BuildStep(i, 'img', depends_on=deps) for i, deps in enumerate(depends_on)]
+
+
+class TestStepGraph(TestCase):
+
+    def test_withoutDependencies_shouldDependOnPreviousStep(self):
+        steps = make_steps(None, None, None)
+        graph = StepGraph(steps)
+        self.assertEqual(graph.dependencies[steps[0]], ())
+        self.assertEqual(graph.dependencies[steps[1]], (steps[0],))
+        self.assertEqual(graph.dependencies[steps[2]], (steps[1],))
+        self.assertEqual(graph.order, steps)
+
+    def test_withEmptyDependencies_shouldBeIndependent(self):
+        steps = make_steps(None, [], [])
+        graph = StepGraph(steps)
+        self.assertEqual(graph.dependencies[steps[1]], ())
+        self.assertEqual(graph.dependencies[steps[2]], ())
+
+    def test_dependencyOutsideGraph_shouldBeIgnored(self):
+        steps = make_steps(None, [], [0, 1])
+        graph = StepGraph(steps[1:])
+        self.assertEqual(graph.dependencies[steps[2]], (steps[1],))
+
+    def test_orderShouldFollowDependencies(self):
+        steps = make_steps([2], [0], [])
+        graph = StepGraph(steps)
+        self.assertEqual(graph.order, [steps[2], steps[0], steps[1]])
+
+    def test_circularDependencies_shouldRaise(self):
+        with self.assertRaises(StepGraphError):
+            StepGraph(make_steps([1], [0]))
+
+
+class TestRunGraph(TestCase):
+
+    def test_sequential_shouldRunInOrder(self):
+        steps = make_steps(None, None, None)
+        results = run_graph(StepGraph(steps), lambda step: step.ref)
+        self.assertEqual(results, [(step, step.ref) for step in steps])
+
+    def test_stop_shouldNotStartNewSteps(self):
+        steps = make_steps(None, None, None)
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                results = run_graph(StepGraph(steps), lambda step: step.ref,
+                    workers=workers, stop=lambda result: result == 1)
+                self.assertEqual([r for _s, r in results], [0, 1])
+
+    def test_parallel_shouldRunIndependentStepsConcurrently(self):
+        steps = make_steps([], [], [0, 1])
+        started = {step: Event() for step in steps}
+
+        def func(step):
+            started[step].set()
+            if step.ref == 0:
+                # finishes only if step 1 is running at the same time
+                self.assertTrue(started[steps[1]].wait(5))
+            elif step.ref == 2:
+                self.assertTrue(all(started[s].is_set() for s in steps[:2]))
+            return step.ref
+
+        results = run_graph(StepGraph(steps), func, workers=2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1], (steps[2], 2))
+
+    def test_interrupt_shouldCancelAndWaitForRunningSteps(self):
+        steps = make_steps([], [])
+        started = Event()
+        cancelled = Event()
+        finished = []
+
+        def func(step):
+            if step.ref == 1:
+                self.assertTrue(started.wait(5))
+                raise KeyboardInterrupt
+            started.set()
+            finished.append(cancelled.wait(5))
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_graph(StepGraph(steps), func, workers=2, cancel=cancelled.set)
+        self.assertEqual(finished, [True])
+
+
+class TestOverlaps(TestCase):
+
+    def test_end_shouldReportOtherRunningTasks(self):
+        overlaps = Overlaps()
+        overlaps.start('a')
+        self.assertFalse(overlaps.end('a'))
+        overlaps.start('a')
+        overlaps.start('b')
+        self.assertTrue(overlaps.end('b'))
+        overlaps.start('c')
+        self.assertTrue(overlaps.end('a'))
+        self.assertTrue(overlaps.end('c'))
+
+
+class TestDeadlines(TestCase):
+
+    def test_callbacks_shouldRunInDeadlineOrder(self):
+        deadlines = Deadlines()
+        called = []
+        done = Event()
+        deadlines.add(0.04, lambda: (called.append('late'), done.set()))
+        deadlines.add(0.01, lambda: called.append('early'))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(called, ['early', 'late'])
+
+    def test_cancelledCallback_shouldNotRun(self):
+        deadlines = Deadlines()
+        called = []
+        done = Event()
+        handle = deadlines.add(0.01, lambda: called.append('cancelled'))
+        deadlines.cancel(handle)
+        deadlines.add(0.03, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(called, [])
+
+    def test_cancel_shouldReportWhetherTheCallbackWasTaken(self):
+        deadlines = Deadlines()
+        started = Event()
+        release = Event()
+        running = deadlines.add(0.01, lambda: (started.set(), release.wait(5)))
+        pending = deadlines.add(60, lambda: None)
+        self.assertTrue(started.wait(5))
+        self.assertFalse(deadlines.cancel(running))
+        self.assertTrue(deadlines.cancel(pending))
+        release.set()
+
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from apluslms_roman.observer import Message
+from apluslms_roman.utils.timing import BuildTimings, Timings, format_timings
+from ..helpers import ListObserver
+
+
+class TestTimings(TestCase):
+
+    def test_add_shouldSumAndKeepOrder(self):
+        timings = Timings()
+        timings.add('b', 1.0)
+        timings.add('a', 2.0)
+        timings.add('b', 0.5)
+        self.assertEqual(timings.items(), [('b', 1.5), ('a', 2.0)])
+
+    def test_measure_shouldAddDurationOnError(self):
+        timings = Timings()
+        with patch('apluslms_roman.utils.timing.clock', side_effect=[1.0, 3.5]):
+            with self.assertRaises(ValueError):
+                with timings.measure('stage'):
+                    raise ValueError()
+        self.assertEqual(timings['stage'], 2.5)
+
+    def test_formatTimings(self):
+        timings = BuildTimings()
+        timings.phases.add('build', 2.0)
+        timings.step('hello').add('pull', 1.25)
+        self.assertEqual(format_timings(timings), [
+            "build                        2.000s",
+            "step hello:",
+            "  pull                       1.250s",
+        ])
+
+
+class TestObserverTimings(TestCase):
+
+    def test_phasesAndSteps_shouldBeTimed(self):
+        observer = ListObserver()
+        with patch('apluslms_roman.observer.clock', side_effect=[0.0, 1.0, 3.0, 6.0]):
+            observer.enter_build()      # 0.0
+            observer.step_pending('s')  # 1.0
+            observer.step_running('s')
+            observer.step_succeeded('s') # 3.0
+            observer.done()             # 6.0
+        self.assertEqual(observer.timings.phases.items(), [('build', 6.0)])
+        self.assertEqual(observer.timings.step('s').items(), [('build', 2.0)])
+        timings = [(step, data) for type_, step, data in observer.messages
+            if type_ == Message.TIMING_MSG]
+        self.assertEqual(timings, [('s', ('build', 2.0)), (None, ('build', 6.0))])
@@ -0,0 +1,65 @@
+import json
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from apluslms_roman.utils.trace import Tracer, tracer
+from ..helpers import NullObserver
+
+
+class TestTracer(TestCase):
+
+    def test_disabled_shouldNotCollect(self):
+        t = Tracer()
+        with t.span('a'):
+            pass
+        t.counter('c', {'v': 1})
+        self.assertFalse(t.enabled)
+        self.assertEqual(t.stop(), [])
+
+    def test_span_shouldAddCompleteEvent(self):
+        t = Tracer()
+        t.start()
+        with t.span('a', cat='test', args={'x': 1}):
+            pass
+        events = t.stop()
+        self.assertEqual([e['ph'] for e in events], ['M', 'X'])
+        span = events[1]
+        self.assertEqual((span['name'], span['cat'], span['args']), ('a', 'test', {'x': 1}))
+        self.assertGreaterEqual(span['dur'], 0)
+        self.assertEqual(span['tid'], events[0]['tid'])
+
+    def test_write_shouldWriteTraceFile(self):
+        t = Tracer()
+        t.start()
+        t.counter('log', {'bytes': 3})
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'trace.json')
+            t.write(path)
+            with open(path) as f:
+                data = json.load(f)
+        self.assertEqual(data['traceEvents'][-1]['ph'], 'C')
+        self.assertFalse(t.enabled)
+
+
+class TestObserverTrace(TestCase):
+
+    def setUp(self):
+        tracer.start()
+
+    def tearDown(self):
+        tracer.stop()
+
+    def test_observer_shouldTracePhasesStepsAndLogs(self):
+        observer = NullObserver()
+        observer.enter_build()
+        observer.step_running('s')
+        with observer.measure('s', 'wait'):
+            observer.container_msg('s', 'hello\n')
+        observer.step_succeeded('s')
+        observer.done()
+        events = [(e['ph'], e['name'], e.get('cat')) for e in tracer.stop()]
+        self.assertIn(('X', 'build', 'phase'), events)
+        self.assertIn(('X', 'step s', 'step'), events)
+        self.assertIn(('X', 'wait', 'stage'), events)
+        self.assertIn(('C', 'log s', 'log'), events)
@@ -0,0 +1,86 @@
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from apluslms_roman.utils.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    Watcher,
+    iter_changes,
+)
+from ..helpers import write
+
+
+try:
+    InotifyWatcher('.').close()
+except OSError:
+    HAS_INOTIFY = False
+else:
+    HAS_INOTIFY = True
+
+
+class WatcherTests:
+    watcher_class = None
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+        makedirs(join(self.dir, 'src'))
+        makedirs(join(self.dir, '_build'))
+        write(join(self.dir, 'src', 'index.rst'), 'hello')
+        self.watcher = self.get_watcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def get_watcher(self):
+        return self.watcher_class(self.dir)
+
+    def test_changedFile_shouldBeReported(self):
+        write(join(self.dir, 'src', 'index.rst'), 'hello world')
+        self.assertEqual(self.watcher.wait(2), {'src/index.rst'})
+
+    def test_ignoredFiles_shouldNotBeReported(self):
+        write(join(self.dir, '_build', 'index.html'), 'hello')
+        self.assertEqual(self.watcher.wait(0.2), set())
+
+    def test_newDirectory_shouldBeWatched(self):
+        makedirs(join(self.dir, 'src', 'new'))
+        self.watcher.wait(0.5)
+        write(join(self.dir, 'src', 'new', 'a.rst'), 'hello')
+        self.assertIn('src/new/a.rst', self.watcher.wait(2))
+
+    def test_reset_shouldForgetChanges(self):
+        write(join(self.dir, 'src', 'index.rst'), 'hello world')
+        self.watcher.reset()
+        self.assertEqual(self.watcher.wait(0.2), set())
+
+
+class TestPollingWatcher(WatcherTests, TestCase):
+    def get_watcher(self):
+        return PollingWatcher(self.dir, interval=0.05)
+
+
+@skipIf(not HAS_INOTIFY, "inotify is not supported")
+class TestInotifyWatcher(WatcherTests, TestCase):
+    watcher_class = InotifyWatcher
+
+
+class ListWatcher(Watcher):
+    def __init__(self, *changes):
+        super().__init__('.')
+        self.changes = list(changes)
+
+    def wait(self, timeout=None):
+        return set(self.changes.pop(0)) if self.changes else set()
+
+
+class TestIterChanges(TestCase):
+
+    def test_burstOfChanges_shouldBeYieldedOnce(self):
+        watcher = ListWatcher(['a'], ['b'], [], ['c'])
+        changes = iter_changes(watcher, delay=0)
+        self.assertEqual(next(changes), {'a', 'b'})
+        self.assertEqual(next(changes), {'c'})